@@ -0,0 +1,78 @@
+import struct
+from array import array
+
+# Compact columnar form of a whisperx alignment, for sending to the player.
+# alignment.json is a list of {"word", "start", "end", "score"} dicts; here the same
+# data is three parallel arrays plus a word table:
+#
+#   header   b"KALN" | version u8 | word count u32
+#   words    u32 byte length + utf-8 words joined by "\0"
+#   start_ms u32[count]   (MISSING where whisperx couldn't place the word)
+#   end_ms   u32[count]
+#   score    u8[count]    (score * 254, MISSING_SCORE if unknown)
+#
+# All little-endian. Times are milliseconds, which is what QMediaPlayer reports.
+
+MAGIC = b"KALN"
+VERSION = 1
+MISSING = 0xFFFFFFFF
+MISSING_SCORE = 0xFF
+
+class ColumnarAlignment:
+    def __init__(self, words, start_ms, end_ms, scores):
+        self.words = words
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def from_word_segments(cls, word_segments):
+        words = []
+        start_ms, end_ms, scores = array("I"), array("I"), array("B")
+        for seg in word_segments:
+            words.append(seg["word"])
+            start = seg.get("start")
+            end = seg.get("end")
+            score = seg.get("score")
+            start_ms.append(MISSING if start is None else int(round(start * 1000)))
+            end_ms.append(MISSING if end is None else int(round(end * 1000)))
+            scores.append(MISSING_SCORE if score is None else max(0, min(254, int(round(score * 254)))))
+        return cls(words, start_ms, end_ms, scores)
+
+    def to_bytes(self):
+        word_blob = "\0".join(self.words).encode("utf-8")
+        parts = [MAGIC, struct.pack("<BI", VERSION, len(self.words)), struct.pack("<I", len(word_blob)), word_blob]
+        for column in (self.start_ms, self.end_ms, self.scores):
+            column = array(column.typecode, column)
+            if struct.pack("=H", 1) != struct.pack("<H", 1):
+                column.byteswap()  # big-endian host
+            parts.append(column.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if data[:4] != MAGIC:
+            raise ValueError("Not an alignment file")
+        version, count = struct.unpack_from("<BI", data, 4)
+        if version != VERSION:
+            raise ValueError(f"Unsupported alignment version {version}")
+        offset = 9
+        (blob_len,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        blob = data[offset:offset + blob_len].decode("utf-8")
+        offset += blob_len
+        words = blob.split("\0") if count else []
+
+        columns = []
+        for typecode in ("I", "I", "B"):
+            column = array(typecode)
+            size = column.itemsize * count
+            column.frombytes(data[offset:offset + size])
+            if struct.pack("=H", 1) != struct.pack("<H", 1):
+                column.byteswap()
+            columns.append(column)
+            offset += size
+        return cls(words, *columns)
@@ -1,143 +1,267 @@
 import os
-import subprocess
-import torch
-import shutil
-import sys
-from moviepy import VideoFileClip
+import time
+import uuid
 import whisperx
 import json
 from pathlib import Path
-from util import TRACK_ROOT
+from util import (TRACK_ROOT, SEGMENTED_MIN_MINUTES, DEFAULT_SEPARATION_PROFILE, STEMS, STEM_FORMATS, KEEP_WAV_STEMS, SEGMENTED_ALIGNMENT,
+                  ALIGN_WORKERS, PREVIEW_SECONDS, pick_device)
+from scheduler import check_cancelled, check_lease, JobCancelled
+from separation import get_engine
+from segmented_separation import separate_file_segmented, audio_frames
+from segmented_alignment import align_segmented
+from media import check_ingestable, extract_audio, write_muted_video, encode_stems
+from pipeline import Pipeline
+from dedup_cache import ARTIFACTS
+from workspace import JobWorkspace, publish, write_atomic, partial_state
+from progressive import LivePreview
+from catalog import catalog
+from lyrics_index import lyrics_index
+from alignment_format import ColumnarAlignment
+from model_registry import registry as align_models
+from metrics import STAGE_SECONDS
 
-def run_karaoke_process(video_path, task_id, original_file_name, output_base_dir="karaoke_output"):
+# rough share of the total time each stage takes, for percent-complete
+STAGE_WEIGHTS = {"extract_audio": 5, "separate": 75, "encode_stems": 10, "muted_video": 10}
+STAGE_MESSAGES = {
+    "extract_audio": "Extracting audio",
+    "separate": "Separating vocals",
+    "encode_stems": "Compressing stems",
+    "muted_video": "Preparing video",
+}
+
+def separate_stems(audio_path, song_output_dir, on_progress=None, profile=None, on_written=None):
+    # stems are written straight into the song folder, no demucs output tree to copy from
+    # on_written(seconds): the stems are wanted as they grow (progressive preview)
+    vocals_path = os.path.join(song_output_dir, "vocals.wav")
+    no_vocals_path = os.path.join(song_output_dir, "no_vocals.wav")
+    first_segment = PREVIEW_SECONDS if on_written is not None else None
+
+    engine = get_engine(profile)
+    if engine.backend == "onnx":
+        # streams the file through its own windows, any length fits in memory
+        return engine.separate_file(audio_path, vocals_path, no_vocals_path, on_progress=on_progress,
+                                    on_written=on_written)
+    frames, rate = audio_frames(audio_path)
+    if SEGMENTED_MIN_MINUTES and frames / rate > SEGMENTED_MIN_MINUTES * 60:
+        # long recording: windows in parallel, memory bounded by the window size
+        return separate_file_segmented(audio_path, vocals_path, no_vocals_path, on_progress=on_progress,
+                                       first_segment_seconds=first_segment, on_written=on_written,
+                                       model_name=engine.model_name, shifts=engine.shifts)
+    if on_written is not None:
+        # windows one after another on the resident model, a short one first
+        return separate_file_segmented(audio_path, vocals_path, no_vocals_path, on_progress=on_progress,
+                                       engine=engine, first_segment_seconds=first_segment, on_written=on_written)
+    return engine.separate_file(audio_path, vocals_path, no_vocals_path)
+
+def separate_preview(audio_path, build_dir, preview, on_progress=None, profile=None, on_written=None):
+    """separate_stems for a progressive preview: the stems grow inside the published (partial)
+    song folder, then the finished WAVs are linked back into build_dir for encoding."""
+    timings = separate_stems(audio_path, preview.song_dir, on_progress, profile, on_written)
+    preview.take_stems(build_dir, STEMS)
+    return timings
+
+def run_karaoke_process(video_path, task_id, original_file_name, output_base_dir="karaoke_output", progress=None,
+                        profile=None):
+    # progress: optional fn(**status_fields) used to publish live stage, percent and timings
+    # profile: separation profile name (util.SEPARATION_PROFILES), None for the default
     video_name_no_ext = os.path.splitext(original_file_name)[0]
     
-    # Demucs uses the filename (minus extension) for its folder structure
-    temp_audio_name = f"temp_{task_id}"
-    temp_audio = os.path.join(output_base_dir, f"{temp_audio_name}.wav")
-    
     song_output_dir = os.path.join(output_base_dir, video_name_no_ext)
-    os.makedirs(song_output_dir, exist_ok=True)
+    # everything is built in this run's own scratch folder and published when complete,
+    # so /tracks never lists a half-built track and a failed re-run leaves the old one alone.
+    # Per run, not per task: a stalled worker's run and the retry of it can overlap
+    workspace = JobWorkspace(f"{task_id}-{uuid.uuid4().hex}").create()
+    temp_audio = os.path.join(workspace.path, "audio.wav")
+    build_dir = workspace.track_dir
+    video_dir = build_dir
+
+    done_weight = 0
+
+    def on_update(stage, event, timings):
+        nonlocal done_weight
+        print(f"--- {stage}: {event} ---")
+        if event == "done":
+            done_weight += STAGE_WEIGHTS[stage]
+            STAGE_SECONDS.observe(timings[stage], stage=stage)
+            if stage == "muted_video" and preview is not None:
+                check_lease()
+                preview.add_video(video_dir)
+        if progress is not None:
+            message = f"{STAGE_MESSAGES[stage]}..." if event == "started" else f"{STAGE_MESSAGES[stage]}: done"
+            progress(message=message, stage=stage, percent=done_weight, timings=timings)
+
+    def on_separate_progress(fraction):
+        # only windowed separation reports progress inside the stage
+        if progress is not None:
+            progress(percent=int(done_weight + STAGE_WEIGHTS["separate"] * fraction))
+
+    preview = None
+    job_start = time.perf_counter()
+    time_to_preview = None
+
+    def on_preview(ready_seconds):
+        nonlocal time_to_preview
+        check_lease()
+        preview.update(ready_seconds)
+        if time_to_preview is None:
+            time_to_preview = time.perf_counter() - job_start
+            STAGE_SECONDS.observe(time_to_preview, stage="preview")
+            print(f"--- preview playable after {time_to_preview:.1f}s ---")
+        if progress is not None:
+            progress(message=f"{STAGE_MESSAGES['separate']} ({ready_seconds:.0f}s playable)...",
+                     track=video_name_no_ext, preview_seconds=round(ready_seconds, 1))
 
     try:    
-        print(f"--- Step 1: Extracting audio from {original_file_name} ---")
-        video = VideoFileClip(video_path)
-
-        video.audio.write_audiofile(temp_audio, codec='pcm_s16le', logger=None)
-        muted_video_path = os.path.join(song_output_dir, "video.mp4")
-        video.write_videofile(muted_video_path, audio=False, logger=None)
-        
-        video.close()
-
-        print(f"--- Step 2: Running AI Separation on GPU ---")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        demucs_cmd = [
-            sys.executable, "-m", "demucs", 
-            "--two-stems", "vocals",
-            # "-n", "htdemucs",
-            "-n", "htdemucs_ft",
-            "-d", device,
-            # "--shifts", "3", 
-            "-o", output_base_dir,
-            temp_audio
-        ]
-
-        # Run and wait for completion
-        subprocess.run(demucs_cmd, check=True, shell=True)
-
-        # --- Step 3: Organizing output files ---
-        print("--- Step 3: Organizing output files ---")
-
-        demucs_out_path = os.path.join(output_base_dir, "htdemucs_ft", temp_audio_name)
-        
-        found_vocals = False
-        for stem in ["vocals.wav", "no_vocals.wav"]:
-            src = os.path.join(demucs_out_path, stem)
-            dst = os.path.join(song_output_dir, stem)
-
-            if os.path.exists(src):
-                shutil.copy2(src, dst)
-                found_vocals = True
-
-        # Cleanup
-        if os.path.exists(temp_audio):
-            os.remove(temp_audio)
-        
-        # Remove the nested Demucs folder structure
-        ht_root = os.path.join(output_base_dir, "htdemucs_ft") 
-
-        if os.path.exists(ht_root):
-            shutil.rmtree(ht_root, ignore_errors=True)
-
-        # last thing is to save the video (without audio)
-
-        print("Processing done")
-
-        if found_vocals:
-            return True, f"Files saved in: {song_output_dir}"
+        info = check_ingestable(video_path)
+
+        claimed = LivePreview(song_output_dir, info["duration"], task_id)
+        check_lease()  # claiming creates the track's folder in the library
+        if PREVIEW_SECONDS > 0 and claimed.claim():
+            # new track: listed as a partial preview from the first stem window on. The
+            # video is made on the side and joins it when ready (see on_update)
+            preview = claimed
+            video_dir = os.path.join(workspace.path, "video")
+            os.makedirs(video_dir)
+
+        # extract_audio -> separate (accelerator) -> encode_stems (process pool)
+        # muted_video (process pool, overlaps with the above)
+        pipeline = Pipeline(on_update)
+        pipeline.add("extract_audio", extract_audio, video_path, temp_audio)
+        pipeline.add("muted_video", write_muted_video, video_path, os.path.join(video_dir, "video.mp4"),
+                     info["video_codec"], pool="process")
+        if preview is not None:
+            pipeline.add("separate", separate_preview, temp_audio, build_dir, preview, on_separate_progress, profile,
+                         on_preview, deps=["extract_audio"])
         else:
-            return False, "Separation finished, but files weren't found."
+            pipeline.add("separate", separate_stems, temp_audio, build_dir, on_separate_progress, profile,
+                         deps=["extract_audio"])
+        pipeline.add("encode_stems", encode_stems, build_dir, STEMS, STEM_FORMATS, KEEP_WAV_STEMS,
+                     deps=["separate"], pool="process")
+        results = pipeline.run()
+
+        timings = pipeline.timings
+        check_lease()
+        if preview is not None:
+            # compressed stems in, WAVs (unless kept) and the partial marker out
+            preview.finish(build_dir)
+        else:
+            # atomic rename into TRACK_ROOT (replaces only the media of an existing track, so
+            # hard links into the dedup cache are swapped out rather than written through)
+            publish(build_dir, song_output_dir, ARTIFACTS)
+        catalog.refresh(video_name_no_ext, duration=info["duration"])
+        print("Processing done: " + ", ".join(f"{k}={v:.1f}s" for k, v in timings.items()))
+        return True, f"Files saved in: {song_output_dir}", {
+            "track": video_name_no_ext,
+            "timings": timings,
+            "separation": results["separate"],
+            "profile": profile or DEFAULT_SEPARATION_PROFILE,
+            "video_remuxed": results["muted_video"],
+            "stem_formats": results["encode_stems"],
+            "time_to_preview": time_to_preview,
+        }
+
+    except JobCancelled:
+        print(f"Cancelled: {original_file_name}")
+        if preview is not None:
+            preview.abort()
+        raise
 
     except Exception as e:
         print(f"Error encountered: {e}")
-        if os.path.exists(song_output_dir):
-            shutil.rmtree(song_output_dir, ignore_errors=True)
+        if preview is not None:
+            preview.abort()
         return False, str(e)
     
     finally:
-        print("--- Step 4: Finalizing Cleanup ---")
-        # 1. Remove the temporary WAV file extracted from video
-        if os.path.exists(temp_audio):
-            os.remove(temp_audio)
-        
-        # 2. Remove the nested 'htdemucs_ft' directory entirely
-        if os.path.exists(ht_root):
-            shutil.rmtree(ht_root, ignore_errors=True)
-
-def run_lyrics_alignment_process(song_name: str, lyrics:str, language_code:str):
+        # the extracted WAV, stems and anything left unpublished
+        workspace.remove()
+
+def run_lyrics_alignment_process(song_name: str, lyrics:str, language_code:str, progress=None):
+    # progress: optional fn(**status_fields) used to publish live stage and percent
+    def report(message, percent):
+        if progress is not None:
+            progress(message=message, percent=percent)
+
     song_dir = os.path.join(TRACK_ROOT, song_name)
     if not os.path.isdir(song_dir):
         msg = f"Song directory not found: {song_dir}"
         print(msg)
         return False, msg
+    if partial_state(song_dir) is not None:
+        msg = f"{song_name} is still being separated. Add lyrics once it's finished"
+        print(msg)
+        return False, msg
 
-    audio_path = os.path.join(song_dir, "vocals.wav")
-    if not os.path.isfile(audio_path):
-        msg = f"Vocals file not found: {audio_path}. Has the track been split yet?"
+    # lossless copies first; whisperx decodes any of them through ffmpeg
+    audio_path = next((os.path.join(song_dir, f"vocals.{fmt}") for fmt in ("wav", "flac", "opus")
+                       if os.path.isfile(os.path.join(song_dir, f"vocals.{fmt}"))), None)
+    if audio_path is None:
+        msg = f"Vocals file not found in {song_dir}. Has the track been split yet?"
         print(msg)
         return False, msg
     
     # save the raw lyrics. we're gonna serve this too
-    lyrics_raw_path = os.path.join(song_dir, "lyrics_raw.txt")
-    with open(lyrics_raw_path, "w", encoding="utf-8") as f:
-        f.write(lyrics)
-
-    align_model, metadata = whisperx.load_align_model(
-        language_code=language_code,
-        device="cuda"
-    )
-    segments = [{"text": lyrics}]
-    audio = whisperx.load_audio(audio_path)
-
-    result = whisperx.align(
-        segments,
-        align_model,
-        metadata,
-        audio,
-        device="cuda"
-    )
+    check_lease()
+    write_atomic(os.path.join(song_dir, "lyrics_raw.txt"), lyrics)
+
+    timings = {}
+    def finished(stage, start):
+        timings[stage] = time.perf_counter() - start
+        STAGE_SECONDS.observe(timings[stage], stage=stage)
+
+    check_cancelled()
+    report("Loading alignment model...", 10)
+    start = time.perf_counter()
+    device = pick_device()
+    align_model, metadata = align_models.get(language_code, device)
+    finished("align_model", start)
+    report("Aligning lyrics...", 30)
+    start = time.perf_counter()
+
+    segmented = None
+    if SEGMENTED_ALIGNMENT:
+        segmented = align_segmented(
+            audio_path, lyrics, language_code, align_model, metadata, device, workers=ALIGN_WORKERS,
+            on_progress=lambda done, total: report(f"Aligning lyrics ({done}/{total} segments)...",
+                                                   30 + int(55 * done / total)))
+    if segmented is not None:
+        word_segments, segment_stats = segmented
+        print(f"Aligned {segment_stats['realigned']} of {segment_stats['segments']} segments, rest reused")
+    else:
+        # no sung regions found (or segmenting disabled): whole lyrics against the whole song
+        segments = [{"text": lyrics}]
+        audio = whisperx.load_audio(audio_path)
+
+        result = whisperx.align(
+            segments,
+            align_model,
+            metadata,
+            audio,
+            device=device
+        )
+        word_segments = result["word_segments"]
+    finished("align", start)
 
     alignment_data = {
         "audio_path": audio_path,
         "language": language_code,
-        "word_segments": result["word_segments"]
+        "word_segments": word_segments
     }
 
     output_path = os.path.join(song_dir, "alignment.json")
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(alignment_data, f, ensure_ascii=False, indent=2)
+    check_lease()
+    write_atomic(output_path, json.dumps(alignment_data, ensure_ascii=False, separators=(",", ":")))
+    # compact copy the player loads (see alignment_format.py)
+    write_atomic(os.path.join(song_dir, "alignment.bin"),
+                 ColumnarAlignment.from_word_segments(word_segments).to_bytes())
+
+    report("Indexing lyrics...", 90)
+    start = time.perf_counter()
+    catalog.refresh(song_name, language=language_code)
+    lyrics_index.index_track(song_name, lyrics, word_segments)
+    finished("index_lyrics", start)
 
-    debug_msg = f"Saved {len(result['word_segments'])} word segments to {output_path}"
+    debug_msg = f"Saved {len(word_segments)} word segments to {output_path}"
     print(debug_msg)
-    return True, debug_msg
\ No newline at end of file
+    return True, debug_msg, {"timings": timings}
\ No newline at end of file
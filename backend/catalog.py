@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import wave
+from util import TRACK_ROOT, CATALOG_DB, STEMS, STEM_MEDIA_TYPES
+from workspace import PARTIAL_MARKER, is_internal, partial_state
+from lyrics_index import lyrics_index
+
+# Persistent index of the track library. The processing pipeline updates a track's
+# row when it finishes (separation, lyrics), so /tracks is one indexed query instead
+# of os.listdir + isdir over TRACK_ROOT, and the UI gets duration, stems and lyrics
+# state without a follow-up call per track. Folders that aren't finished never get
+# a row, so half-built tracks don't show up; the exception is a progressive preview
+# (progressive.py), listed with partial=True and how many seconds are ready to play.
+
+SORT_COLUMNS = {"name", "created_at", "updated_at", "duration", "size_bytes"}
+
+class Catalog:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    name          TEXT PRIMARY KEY,
+                    duration      REAL,
+                    stems         TEXT NOT NULL DEFAULT '{}',
+                    has_lyrics    INTEGER NOT NULL DEFAULT 0,
+                    has_alignment INTEGER NOT NULL DEFAULT 0,
+                    language      TEXT,
+                    size_bytes    INTEGER NOT NULL DEFAULT 0,
+                    created_at    REAL NOT NULL,
+                    updated_at    REAL NOT NULL,
+                    partial       INTEGER NOT NULL DEFAULT 0,
+                    ready_seconds REAL
+                )""")
+            # catalogs from before progressive previews
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tracks)")}
+            if "partial" not in columns:
+                conn.execute("ALTER TABLE tracks ADD COLUMN partial INTEGER NOT NULL DEFAULT 0")
+                conn.execute("ALTER TABLE tracks ADD COLUMN ready_seconds REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tracks_created ON tracks(created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tracks_updated ON tracks(updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tracks_duration ON tracks(duration)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tracks_language ON tracks(language)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _scan_folder(song_dir):
+        """What's on disk for one track: stem formats, lyrics files, total size."""
+        files = {entry.name: entry.stat().st_size for entry in os.scandir(song_dir) if entry.is_file()}
+        stems = {stem: [fmt for fmt in STEM_MEDIA_TYPES if f"{stem}.{fmt}" in files] for stem in STEMS}
+        partial = partial_state(song_dir) if PARTIAL_MARKER in files else None
+        return {
+            "stems": stems,
+            "has_lyrics": "lyrics_raw.txt" in files,
+            "has_alignment": "alignment.json" in files,
+            "size_bytes": sum(files.values()),
+            "partial": partial is not None,
+            "ready_seconds": partial["ready_seconds"] if partial else None,
+        }
+
+    def refresh(self, name: str, duration: float = None, language: str = None):
+        """Re-read a track folder and upsert its row. Call whenever the pipeline changes a track."""
+        song_dir = os.path.join(TRACK_ROOT, name)
+        if not os.path.isdir(song_dir):
+            self.remove(name)
+            return
+        info = self._scan_folder(song_dir)
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("""
+                INSERT INTO tracks (name, duration, stems, has_lyrics, has_alignment, language, size_bytes,
+                                    created_at, updated_at, partial, ready_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    duration = COALESCE(excluded.duration, tracks.duration),
+                    stems = excluded.stems,
+                    has_lyrics = excluded.has_lyrics,
+                    has_alignment = excluded.has_alignment,
+                    language = COALESCE(excluded.language, tracks.language),
+                    size_bytes = excluded.size_bytes,
+                    updated_at = excluded.updated_at,
+                    partial = excluded.partial,
+                    ready_seconds = excluded.ready_seconds
+                """,
+                (name, duration, json.dumps(info["stems"]), info["has_lyrics"], info["has_alignment"],
+                 language, info["size_bytes"], now, now, info["partial"], info["ready_seconds"]))
+
+    def remove(self, name: str):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM tracks WHERE name = ?", (name,))
+        # so /search doesn't turn up a track that's gone
+        lyrics_index.remove_track(name)
+
+    def get(self, name: str):
+        row = self._conn().execute("SELECT * FROM tracks WHERE name = ?", (name,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    @staticmethod
+    def _to_dict(row):
+        track = dict(row)
+        track["stems"] = json.loads(track["stems"])
+        track["has_lyrics"] = bool(track["has_lyrics"])
+        track["has_alignment"] = bool(track["has_alignment"])
+        track["partial"] = bool(track["partial"])
+        return track
+
+    def query(self, offset=0, limit=100, sort="name", descending=False,
+              has_lyrics=None, language=None, search=None):
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Can't sort by '{sort}'")
+        where, params = [], []
+        if has_lyrics is not None:
+            where.append("has_lyrics = ?")
+            params.append(int(has_lyrics))
+        if language is not None:
+            where.append("language = ?")
+            params.append(language)
+        if search:
+            where.append("name LIKE ? ESCAPE '\\'")
+            escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM tracks {clause}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM tracks {clause} ORDER BY {sort} {'DESC' if descending else 'ASC'}, name LIMIT ? OFFSET ?",
+            (*params, limit, offset)).fetchall()
+        return total, [self._to_dict(row) for row in rows]
+
+    def version(self, *query_args):
+        """Cheap fingerprint of the catalog plus the query, used as the /tracks ETag."""
+        count, latest = self._conn().execute("SELECT COUNT(*), COALESCE(MAX(updated_at), 0) FROM tracks").fetchone()
+        digest = hashlib.sha1(repr((count, latest, query_args)).encode()).hexdigest()[:16]
+        return f'"{digest}"'
+
+    def rescan(self):
+        """Bring the catalog in line with TRACK_ROOT: add finished folders it doesn't know
+        (e.g. tracks from before the catalog existed) and drop rows whose folder is gone.
+        Partial folders are left out: a live job keeps its own row up to date, and one that
+        died left nothing worth listing."""
+        on_disk = set()
+        if os.path.isdir(TRACK_ROOT):
+            for entry in os.scandir(TRACK_ROOT):
+                if entry.is_dir() and not is_internal(entry.name) and os.path.isfile(os.path.join(entry.path, "video.mp4")) \
+                        and not os.path.exists(os.path.join(entry.path, PARTIAL_MARKER)):
+                    on_disk.add(entry.name)
+
+        known = {row[0] for row in self._conn().execute("SELECT name FROM tracks")}
+        for name in known - on_disk:
+            self.remove(name)
+        for name in on_disk - known:
+            self.refresh(name, duration=_wav_duration(os.path.join(TRACK_ROOT, name)),
+                         language=_alignment_language(os.path.join(TRACK_ROOT, name)))
+        return len(on_disk - known), len(known - on_disk)
+
+def _wav_duration(song_dir):
+    try:
+        with wave.open(os.path.join(song_dir, "no_vocals.wav"), "rb") as w:
+            return w.getnframes() / w.getframerate()
+    except (OSError, wave.Error, EOFError):
+        return None
+
+def _alignment_language(song_dir):
+    try:
+        with open(os.path.join(song_dir, "alignment.json"), "r", encoding="utf-8") as f:
+            return json.load(f).get("language")
+    except (OSError, ValueError):
+        return None
+
+catalog = Catalog(CATALOG_DB)
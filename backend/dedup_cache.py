@@ -0,0 +1,131 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from util import CACHE_DIR, CACHE_BUDGET_BYTES, STEMS, STEM_MEDIA_TYPES
+from workspace import JobWorkspace, STAGING_DIR, publish
+
+# Content-addressed cache of finished ingest outputs. Uploads are hashed while they
+# stream in; if the same bytes were processed before (under any filename) the stored
+# artifacts are linked into the new track folder and the whole pipeline is skipped.
+#
+# karaoke_cache/index.db          hash -> size, last used
+# karaoke_cache/<sha256>/...      hard links to the artifacts of the first track
+
+ARTIFACTS = ("video.mp4", *(f"{stem}.{fmt}" for stem in STEMS for fmt in STEM_MEDIA_TYPES))
+
+def is_complete(folder):
+    """video plus every stem in at least one format"""
+    return os.path.isfile(os.path.join(folder, "video.mp4")) and all(
+        any(os.path.isfile(os.path.join(folder, f"{stem}.{fmt}")) for fmt in STEM_MEDIA_TYPES)
+        for stem in STEMS)
+
+def link_or_copy(src, dst):
+    # hard links cost no space; fall back to a copy across filesystems
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+class ContentCache:
+    def __init__(self, root: str, budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    hash       TEXT PRIMARY KEY,
+                    size       INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used  REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _entry_dir(self, content_hash):
+        return os.path.join(self.root, content_hash)
+
+    def lookup(self, content_hash: str):
+        """Return the cached artifact folder for this hash, or None."""
+        entry_dir = self._entry_dir(content_hash)
+        with self._conn() as conn:
+            row = conn.execute("SELECT hash FROM entries WHERE hash = ?", (content_hash,)).fetchone()
+            if row is None:
+                return None
+            if not is_complete(entry_dir):
+                # someone cleaned the folder by hand
+                conn.execute("DELETE FROM entries WHERE hash = ?", (content_hash,))
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE hash = ?", (time.time(), content_hash))
+        return entry_dir
+
+    def restore(self, content_hash: str, song_dir: str):
+        """Link cached artifacts into song_dir. Returns False on a cache miss."""
+        entry_dir = self.lookup(content_hash)
+        if entry_dir is None:
+            return False
+        # linked next to TRACK_ROOT first, then published in one rename like a processed track
+        with JobWorkspace(f"restore-{uuid.uuid4().hex}", root=STAGING_DIR) as workspace:
+            for name in os.listdir(entry_dir):
+                link_or_copy(os.path.join(entry_dir, name), os.path.join(workspace.track_dir, name))
+            publish(workspace.track_dir, song_dir, ARTIFACTS)
+        return True
+
+    def store(self, content_hash: str, song_dir: str):
+        """Remember the artifacts of a freshly processed track under its content hash."""
+        if not is_complete(song_dir):
+            return
+        entry_dir = self._entry_dir(content_hash)
+        os.makedirs(entry_dir, exist_ok=True)
+        size = 0
+        for name in ARTIFACTS:
+            src = os.path.join(song_dir, name)
+            if os.path.isfile(src):
+                link_or_copy(src, os.path.join(entry_dir, name))
+                size += os.path.getsize(src)
+
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (hash, size, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (content_hash, size, now, now))
+        self.evict()
+
+    def total_bytes(self):
+        row = self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return row[0]
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits its budget.
+        Tracks keep their own hard links, so evicting never breaks a published song."""
+        with self._evict_lock:
+            total = self.total_bytes()
+            if total <= self.budget_bytes:
+                return 0
+            evicted = 0
+            rows = self._conn().execute("SELECT hash, size FROM entries ORDER BY last_used").fetchall()
+            for content_hash, size in rows:
+                if total <= self.budget_bytes:
+                    break
+                with self._conn() as conn:
+                    conn.execute("DELETE FROM entries WHERE hash = ?", (content_hash,))
+                shutil.rmtree(self._entry_dir(content_hash), ignore_errors=True)
+                total -= size
+                evicted += 1
+            return evicted
+
+content_cache = ContentCache(CACHE_DIR, CACHE_BUDGET_BYTES)
@@ -0,0 +1,67 @@
+"""Export a Demucs model to ONNX for the CPU separation profiles (separation_onnx.py).
+
+    python export_onnx.py --model htdemucs --int8
+
+Writes models/<model>.onnx and models/<model>.json (sources, sample rate, window
+length). With --int8 it also writes models/<model>.int8.onnx, quantised dynamically
+(int8 weights for the MatMul/Conv-heavy parts, activations quantised on the fly).
+Exporting needs torch (2.5+), demucs, onnx and onnxscript. Machines that only run the
+exported model just need onnxruntime. Compare an export with the PyTorch path using
+benchmarks/bench_separation.py before switching profiles over to it.
+"""
+import argparse
+import json
+import os
+import torch
+from demucs.apply import BagOfModels
+from demucs.pretrained import get_model
+from util import ONNX_MODEL_DIR
+
+class _Bag(torch.nn.Module):
+    """A bag of models (e.g. htdemucs_ft) as one graph: weighted average per source, like apply_model."""
+
+    def __init__(self, bag):
+        super().__init__()
+        self.models = torch.nn.ModuleList(bag.models)
+        weights = torch.tensor(bag.weights, dtype=torch.float32)  # (models, sources)
+        self.register_buffer("weights", weights[:, :, None, None])
+        self.register_buffer("totals", weights.sum(0)[:, None, None])
+
+    def forward(self, mix):
+        out = sum(model(mix) * self.weights[i] for i, model in enumerate(self.models))
+        return out / self.totals
+
+def export(model_name, out_dir=ONNX_MODEL_DIR, int8=False):
+    model = get_model(model_name)
+    single = model.models[0] if isinstance(model, BagOfModels) else model
+    net = _Bag(model) if isinstance(model, BagOfModels) else model
+    net.eval()
+    # the graph is traced for one window length, the one the model was trained on
+    segment = int(float(single.segment) * single.samplerate)
+    dummy = torch.zeros(1, single.audio_channels, segment)
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{model_name}.onnx")
+    with torch.no_grad():
+        torch.onnx.export(net, (dummy,), path, input_names=["mix"], output_names=["sources"], dynamo=True)
+    with open(os.path.join(out_dir, f"{model_name}.json"), "w", encoding="utf-8") as f:
+        json.dump({"sources": list(model.sources), "samplerate": model.samplerate,
+                   "channels": model.audio_channels, "segment": segment}, f, indent=2)
+    print(f"Wrote {path} ({os.path.getsize(path) / 2**20:.0f} MB, {segment} samples per window)")
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = os.path.join(out_dir, f"{model_name}.int8.onnx")
+        quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+        print(f"Wrote {int8_path} ({os.path.getsize(int8_path) / 2**20:.0f} MB)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="htdemucs", help="any Demucs model name, e.g. htdemucs, htdemucs_ft")
+    parser.add_argument("--out-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--int8", action="store_true", help="also write a quantised copy")
+    args = parser.parse_args()
+    export(args.model, args.out_dir, args.int8)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import gzip
+import os
+import struct
+from email.utils import formatdate
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from util import STEM_MEDIA_TYPES
+
+# File responses that understand HTTP Range, so the player can start and seek
+# without downloading whole stems/videos first.
+
+CHUNK_SIZE = 256 * 1024
+WAV_HEADER = 44  # what the wave module writes for 16-bit PCM
+
+def _etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def _parse_range(header: str, size: int):
+    """Parse a single 'bytes=start-end' range. Returns (start, end) inclusive, or None to send the whole file."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None  # multi-range isn't worth it for media, send the whole thing
+    start_s, _, end_s = spec.strip().partition("-")
+    try:
+        if start_s == "":
+            # suffix range: last N bytes
+            length = int(end_s)
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+def _iter_file(path, start, length, header=b""):
+    if start < len(header):
+        # the first bytes come from a rewritten header instead of the file
+        head = header[start:start + length]
+        yield head
+        start, length = start + len(head), length - len(head)
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _wav_snapshot(path, size):
+    """(size, header) for serving the first `size` bytes of a WAV that's still being written:
+    whole frames only, and a header whose lengths match them (the one on disk can already
+    count frames written after the stat)."""
+    with open(path, "rb") as f:
+        header = bytearray(f.read(WAV_HEADER))
+    if len(header) < WAV_HEADER or header[36:40] != b"data":
+        raise HTTPException(status_code=503, detail="Audio track isn't ready yet", headers={"Retry-After": "5"})
+    block_align = struct.unpack_from("<H", header, 32)[0]
+    data = (size - WAV_HEADER) // block_align * block_align
+    struct.pack_into("<I", header, 4, 36 + data)
+    struct.pack_into("<I", header, 40, data)
+    return WAV_HEADER + data, bytes(header)
+
+def ranged_file_response(request: Request, path: str, media_type: str, growing: bool = False, vary: str = None):
+    # growing: a WAV stem of a partial track (progressive.py), served as it is right now
+    # vary: request headers that chose this file (content negotiation), sent with every status
+    stat = os.stat(path)
+    size = stat.st_size
+    header = b""
+    if growing:
+        size, header = _wav_snapshot(path, size)
+    etag = _etag(stat)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+    }
+    if growing:
+        headers["Cache-Control"] = "no-cache"  # there'll be more of it next time
+    if vary:
+        headers["Vary"] = vary
+
+    if request.headers.get("if-none-match") == etag:
+        # client caches (the player's disk cache) revalidate before re-downloading
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(length)
+            return StreamingResponse(_iter_file(path, start, length, header), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    if growing:
+        # FileResponse would send whatever was appended after the stat as well
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_file(path, 0, size, header), media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+def negotiate_stem(song_dir: str, stem: str, preferences):
+    """Pick which stored encoding of a stem to send. preferences is a list of format names
+    ("opus", "flac", "wav") in the client's order; anything stored is used as a fallback."""
+    for fmt in [*preferences, *STEM_MEDIA_TYPES]:
+        if fmt not in STEM_MEDIA_TYPES:
+            continue
+        path = os.path.join(song_dir, f"{stem}.{fmt}")
+        if os.path.isfile(path):
+            return path, STEM_MEDIA_TYPES[fmt]
+    return None, None
+
+def accept_preferences(accept_header: str):
+    """Turn an Accept header into stem format preferences, highest q first."""
+    by_type = {media_type: fmt for fmt, media_type in STEM_MEDIA_TYPES.items()}
+    by_type["audio/opus"] = "opus"
+    by_type["audio/x-flac"] = "flac"
+    by_type["audio/x-wav"] = "wav"
+    weighted = []
+    for i, part in enumerate(accept_header.split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    pass
+        if media_type in by_type and q > 0:
+            weighted.append((-q, i, by_type[media_type]))
+    return [fmt for _, _, fmt in sorted(weighted)]
+
+def file_etag(path: str):
+    return _etag(os.stat(path))
+
+def compressed_response(request: Request, body: bytes, media_type: str, min_size: int = 1024, etag: str = None):
+    """Small generated payloads (lyrics, alignments): gzip them when the client accepts it.
+    Media files aren't sent through here, they're already compressed and need Range."""
+    headers = {"Vary": "Accept-Encoding"}
+    if etag is not None:
+        headers["ETag"] = etag
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+    if len(body) >= min_size and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type=media_type, headers=headers)
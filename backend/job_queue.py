@@ -0,0 +1,180 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from scheduler import QueueFull
+
+# Shared job queue for distributed mode (see worker.py). The API only enqueues; any
+# number of worker processes, on this machine or others that see the same file, claim
+# jobs under a lease and renew it with heartbeats while they run. A job whose lease
+# runs out (worker crashed, was killed, lost the machine) goes back to the queue for
+# another worker, up to max_attempts claims.
+#   "sqlite:///path/to/jobs.db" -> shared file (local disk, or a network share for a few nodes)
+
+class JobQueue:
+    """Interface every backend implements. A job is {"task_id", "kind", "args", "attempts"};
+    kind names the job wrapper (see jobs.JOB_KINDS) and args must be JSON serialisable."""
+
+    def enqueue(self, task_id: str, kind: str, args, priority: int = 0, max_queued: int = 0):
+        """Raises QueueFull if max_queued jobs are already waiting."""
+        raise NotImplementedError
+
+    def claim(self, worker: str, lease_seconds: float):
+        """Lease the next job (lowest priority number, then oldest) to `worker`, or return None."""
+        raise NotImplementedError
+
+    def heartbeat(self, task_id: str, worker: str, lease_seconds: float) -> bool:
+        """Extend the lease. False if the worker no longer holds it."""
+        raise NotImplementedError
+
+    def complete(self, task_id: str, worker: str):
+        raise NotImplementedError
+
+    def remove(self, task_id: str):
+        """Drop a job that hasn't been claimed yet. Returns the job, or None if it wasn't waiting."""
+        raise NotImplementedError
+
+    def requeue_expired(self, max_attempts: int):
+        """Put jobs with a lapsed lease back in the queue, or drop them once they've been claimed
+        max_attempts times. Returns [(job, gave_up)] for the caller to update task state."""
+        raise NotImplementedError
+
+    def position(self, task_id: str):
+        raise NotImplementedError
+
+    def queued_count(self) -> int:
+        raise NotImplementedError
+
+    def running_count(self) -> int:
+        raise NotImplementedError
+
+class SQLiteJobQueue(JobQueue):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    task_id     TEXT PRIMARY KEY,
+                    kind        TEXT NOT NULL,
+                    args        TEXT NOT NULL,
+                    priority    INTEGER NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    state       TEXT NOT NULL DEFAULT 'queued',
+                    worker      TEXT,
+                    lease_until REAL,
+                    attempts    INTEGER NOT NULL DEFAULT 0
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_next ON jobs(state, priority, enqueued_at)")
+
+    def _conn(self):
+        # one connection per thread, same settings as the task store
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Run fn(conn) in a write transaction taken up front, like SQLiteTaskStore.transition."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _to_job(row):
+        return {"task_id": row["task_id"], "kind": row["kind"], "args": json.loads(row["args"]),
+                "attempts": row["attempts"]}
+
+    def enqueue(self, task_id, kind, args, priority=0, max_queued=0):
+        def insert(conn):
+            if max_queued and self._count(conn, "queued") >= max_queued:
+                raise QueueFull(f"Job queue is full ({max_queued} waiting)")
+            conn.execute("INSERT OR REPLACE INTO jobs (task_id, kind, args, priority, enqueued_at) VALUES (?, ?, ?, ?, ?)",
+                         (task_id, kind, json.dumps(list(args)), priority, time.time()))
+        self._write(insert)
+
+    def claim(self, worker, lease_seconds):
+        def take(conn):
+            row = conn.execute("SELECT * FROM jobs WHERE state = 'queued' "
+                               "ORDER BY priority, enqueued_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                         "WHERE task_id = ?", (worker, time.time() + lease_seconds, row["task_id"]))
+            return {**self._to_job(row), "attempts": row["attempts"] + 1}
+        return self._write(take)
+
+    def heartbeat(self, task_id, worker, lease_seconds):
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE task_id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + lease_seconds, task_id, worker))
+        return cur.rowcount == 1
+
+    def complete(self, task_id, worker):
+        # only the current lease holder; a worker that lost its lease mustn't drop the retry
+        self._conn().execute("DELETE FROM jobs WHERE task_id = ? AND worker = ?", (task_id, worker))
+
+    def remove(self, task_id):
+        def drop(conn):
+            row = conn.execute("SELECT * FROM jobs WHERE task_id = ? AND state = 'queued'", (task_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM jobs WHERE task_id = ?", (task_id,))
+            return self._to_job(row)
+        return self._write(drop)
+
+    def requeue_expired(self, max_attempts):
+        def sweep(conn):
+            rows = conn.execute("SELECT * FROM jobs WHERE state = 'leased' AND lease_until < ?",
+                                (time.time(),)).fetchall()
+            expired = []
+            for row in rows:
+                gave_up = row["attempts"] >= max_attempts
+                if gave_up:
+                    conn.execute("DELETE FROM jobs WHERE task_id = ?", (row["task_id"],))
+                else:
+                    conn.execute("UPDATE jobs SET state = 'queued', worker = NULL, lease_until = NULL "
+                                 "WHERE task_id = ?", (row["task_id"],))
+                expired.append((self._to_job(row), gave_up))
+            return expired
+        return self._write(sweep)
+
+    def position(self, task_id):
+        conn = self._conn()
+        row = conn.execute("SELECT priority, enqueued_at FROM jobs WHERE task_id = ? AND state = 'queued'",
+                           (task_id,)).fetchone()
+        if row is None:
+            return None
+        ahead = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND "
+                             "(priority < ? OR (priority = ? AND enqueued_at < ?))",
+                             (row["priority"], row["priority"], row["enqueued_at"])).fetchone()[0]
+        return ahead + 1
+
+    @staticmethod
+    def _count(conn, state):
+        return conn.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (state,)).fetchone()[0]
+
+    def queued_count(self):
+        return self._count(self._conn(), "queued")
+
+    def running_count(self):
+        return self._count(self._conn(), "leased")
+
+def make_job_queue(url: str) -> JobQueue:
+    if url.startswith("sqlite:///"):
+        return SQLiteJobQueue(url[len("sqlite:///"):])
+    raise ValueError(f"Unknown job queue: {url}")
@@ -0,0 +1,116 @@
+import os
+import time
+from util import TRACK_ROOT, TASK_STORE_URL, JOB_MAX_ATTEMPTS, SEPARATION_PROFILES, DEFAULT_SEPARATION_PROFILE
+from scheduler import JobCancelled, lease_held
+from task_store import make_task_store, OWNER, ACTIVE_STATUSES
+from dedup_cache import content_cache
+from metrics import JOB_SECONDS, QUEUE_WAIT_SECONDS
+
+# The job wrappers: run a processing function for a task and record its outcome in the
+# task store. They run on the API's scheduler threads, or in worker.py processes when a
+# job queue is configured, so nothing here may depend on the web app.
+
+tasks = make_task_store(TASK_STORE_URL) # tracks jobs, shared between worker processes
+
+def background_wrap(task_id: str, fn, *args, running_message="Working...", kind="job", **kwargs):
+    """Run fn for a task and record the outcome. Returns False if this worker lost the job's
+    lease meanwhile (see scheduler.check_lease): a retry owns the task now, and this run's
+    outcome is dropped."""
+    started_at = time.time()
+    if not tasks.transition(task_id, ("queued",), "processing", running_message, started_at=started_at, worker=OWNER):
+        return True # cancelled while it was waiting
+    queued_at = (tasks.get(task_id) or {}).get("queued_at", started_at)
+    QUEUE_WAIT_SECONDS.observe(started_at - queued_at, kind=kind)
+
+    def timing(outcome):
+        # per-task timing shown in /status, and the same numbers for /metrics
+        finished_at = time.time()
+        JOB_SECONDS.observe(finished_at - started_at, kind=kind, outcome=outcome)
+        return {"finished_at": finished_at, "queue_seconds": round(started_at - queued_at, 3),
+                "run_seconds": round(finished_at - started_at, 3)}
+
+    returned = False
+    try:
+        # jobs return (success, message) and optionally a dict of extra status fields (e.g. timings)
+        success, message, *extra = fn(*args, **kwargs)
+        outcome = "completed" if success else "failed"
+        returned = True
+    except JobCancelled as e:
+        outcome, message = "cancelled", str(e)
+    except Exception as e:
+        outcome, message = "failed", str(e)
+
+    if not lease_held():
+        print(f"Lost the lease on task {task_id} while it ran; leaving it to the retry")
+        return False
+    if returned:
+        tasks.transition(task_id, ("processing", "cancelling"), outcome, message,
+                         **(extra[0] if extra else {}), **timing(outcome))
+    else:
+        tasks.update(task_id, outcome, message, **timing(outcome))
+    return True
+
+# Video-specific cleanup wrapper
+def background_wrap_video(task_id: str, file_path: str, original_file_name: str, content_hash: str = None,
+                          profile: str = None):
+    # content_hash: dedup cache key to store the outputs under
+    # the ML stack (torch, demucs, whisperx) is imported by the first job, not at startup
+    from audio_processing import run_karaoke_process
+    owned = background_wrap(task_id, run_karaoke_process, file_path, task_id, original_file_name,
+                            running_message="GPU is working...", kind="track", profile=profile,
+                            progress=lambda **fields: tasks.update(task_id, **fields))
+    if not owned:
+        return # the retry still needs the upload; it's removed when that finishes or is given up on
+    remove_upload(file_path)
+
+    state = tasks.get(task_id)
+    if content_hash and state and state["status"] == "completed":
+        content_cache.store(content_hash, os.path.join(TRACK_ROOT, state["track"]))
+
+def remove_upload(file_path: str):
+    # cleanup the original upload
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+# Lyrics-specific wrapper
+def background_wrap_lyrics(task_id: str, song_name: str, lyrics: str, language_code: str):
+    from audio_processing import run_lyrics_alignment_process
+    background_wrap(task_id, run_lyrics_alignment_process, song_name, lyrics, language_code,
+                    running_message="Aligning lyrics...", kind="lyrics",
+                    progress=lambda **fields: tasks.update(task_id, **fields))
+
+# queue job kind -> wrapper, called as wrapper(task_id, *args)
+JOB_KINDS = {
+    "track": background_wrap_video,
+    "lyrics": background_wrap_lyrics,
+}
+
+def job_device(kind: str, args, accelerator: str):
+    """Which slots a job takes, the same in the API and in workers. ONNX profiles separate on
+    CPU even on a GPU machine, so they take KARAOKE_CPU_SLOTS."""
+    if kind == "track":
+        profile = SEPARATION_PROFILES.get(args[3] or DEFAULT_SEPARATION_PROFILE, {})
+        if profile.get("backend") == "onnx":
+            return "cpu"
+    return accelerator
+
+def discard_job(kind: str, args):
+    """Clean up after a job that will never run (cancelled while queued, or given up on)."""
+    if kind == "track":
+        remove_upload(args[0])
+
+def recover_expired_jobs(job_queue):
+    """Requeue the jobs of workers whose lease ran out and bring their tasks in line."""
+    for job, gave_up in job_queue.requeue_expired(JOB_MAX_ATTEMPTS):
+        task_id = job["task_id"]
+        if gave_up:
+            print(f"Giving up on task {task_id} after {job['attempts']} lost workers")
+            tasks.transition(task_id, ACTIVE_STATUSES, "failed",
+                             f"The worker processing this task stopped responding ({job['attempts']} attempts)")
+            discard_job(job["kind"], job["args"])
+        elif tasks.transition(task_id, ("processing",), "queued",
+                              f"Worker stopped responding, retrying (attempt {job['attempts'] + 1} of {JOB_MAX_ATTEMPTS})"):
+            print(f"Requeued task {task_id} from a lost worker")
+        else:
+            # cancel was requested before the worker died; the next claim sees it and skips the job
+            tasks.transition(task_id, ("cancelling",), "cancelled", "Cancelled")
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+from util import TRACK_ROOT, CATALOG_DB
+from workspace import is_internal
+
+# Full-text index over every track's lyrics (SQLite FTS5), one row per lyric line.
+# Each line carries the time span of its aligned words, and the words themselves live
+# in a side table, so a search hit can jump straight to the moment in the song.
+# Tracks are re-indexed one at a time when their lyrics are aligned, and dropped with
+# their catalog row (catalog.remove).
+
+class LyricsIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS lyric_lines USING fts5(
+                    text,
+                    track UNINDEXED,
+                    line_no UNINDEXED,
+                    start UNINDEXED,
+                    end UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS lyric_words (
+                    track   TEXT NOT NULL,
+                    line_no INTEGER NOT NULL,
+                    idx     INTEGER NOT NULL,
+                    word    TEXT NOT NULL,
+                    start   REAL,
+                    end     REAL,
+                    PRIMARY KEY (track, idx)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_lyric_words_line ON lyric_words(track, line_no)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _split_lines(lyrics: str, word_segments):
+        """Pair each non-empty lyric line with its aligned words. whisperx emits words in text
+        order, so lines take them in sequence by whitespace token count. If the counts don't
+        line up (e.g. languages without spaces) lines are indexed without timestamps."""
+        lines = [line.strip() for line in lyrics.splitlines() if line.strip()]
+        counts = [len(line.split()) for line in lines]
+        if sum(counts) != len(word_segments):
+            return [(line, []) for line in lines]
+
+        paired, pos = [], 0
+        for line, count in zip(lines, counts):
+            paired.append((line, word_segments[pos:pos + count]))
+            pos += count
+        return paired
+
+    def index_track(self, track: str, lyrics: str, word_segments):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM lyric_lines WHERE track = ?", (track,))
+            conn.execute("DELETE FROM lyric_words WHERE track = ?", (track,))
+            idx = 0
+            for line_no, (line, words) in enumerate(self._split_lines(lyrics, word_segments)):
+                starts = [w["start"] for w in words if w.get("start") is not None]
+                ends = [w["end"] for w in words if w.get("end") is not None]
+                conn.execute(
+                    "INSERT INTO lyric_lines (text, track, line_no, start, end) VALUES (?, ?, ?, ?, ?)",
+                    (line, track, line_no, min(starts) if starts else None, max(ends) if ends else None))
+                for w in words:
+                    conn.execute(
+                        "INSERT INTO lyric_words (track, line_no, idx, word, start, end) VALUES (?, ?, ?, ?, ?, ?)",
+                        (track, line_no, idx, w["word"], w.get("start"), w.get("end")))
+                    idx += 1
+
+    def remove_track(self, track: str):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM lyric_lines WHERE track = ?", (track,))
+            conn.execute("DELETE FROM lyric_words WHERE track = ?", (track,))
+
+    @staticmethod
+    def _match_expression(query: str):
+        # quote every term so user input can't produce FTS syntax errors; last term is a prefix
+        terms = [term.replace('"', '""') for term in query.split()]
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+        return " ".join(quoted)
+
+    def search(self, query: str, limit: int = 20):
+        expression = self._match_expression(query)
+        if expression is None:
+            return []
+        conn = self._conn()
+        rows = conn.execute("""
+            SELECT track, line_no, text, start, end,
+                   snippet(lyric_lines, 0, '[', ']', '...', 12) AS snippet
+            FROM lyric_lines WHERE lyric_lines MATCH ?
+            ORDER BY bm25(lyric_lines) LIMIT ?""", (expression, limit)).fetchall()
+
+        results = []
+        for row in rows:
+            words = conn.execute(
+                "SELECT word, start, end FROM lyric_words WHERE track = ? AND line_no = ? ORDER BY idx",
+                (row["track"], row["line_no"])).fetchall()
+            results.append({
+                "track": row["track"],
+                "line_no": row["line_no"],
+                "line": row["text"],
+                "snippet": row["snippet"],
+                "start": row["start"],
+                "end": row["end"],
+                "words": [dict(w) for w in words],
+            })
+        return results
+
+    def indexed_tracks(self):
+        return {row[0] for row in self._conn().execute("SELECT DISTINCT track FROM lyric_lines")}
+
+    def backfill(self):
+        """Bring the index in line with TRACK_ROOT: index aligned tracks that aren't in it yet
+        (e.g. aligned before it existed) and drop tracks whose folder or lyrics are gone.
+        Returns (added, removed)."""
+        indexed = self.indexed_tracks()
+        aligned = set()
+        added = 0
+        for entry in (os.scandir(TRACK_ROOT) if os.path.isdir(TRACK_ROOT) else ()):
+            alignment_path = os.path.join(entry.path, "alignment.json")
+            lyrics_path = os.path.join(entry.path, "lyrics_raw.txt")
+            if is_internal(entry.name) or not (os.path.isfile(alignment_path) and os.path.isfile(lyrics_path)):
+                continue
+            aligned.add(entry.name)
+            if entry.name in indexed:
+                continue
+            try:
+                with open(alignment_path, "r", encoding="utf-8") as f:
+                    word_segments = json.load(f)["word_segments"]
+                with open(lyrics_path, "r", encoding="utf-8") as f:
+                    lyrics = f.read()
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping lyrics of {entry.name}: {e}")
+                continue
+            self.index_track(entry.name, lyrics, word_segments)
+            added += 1
+        for track in indexed - aligned:
+            self.remove_track(track)
+        return added, len(indexed - aligned)
+
+lyrics_index = LyricsIndex(CATALOG_DB)
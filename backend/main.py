@@ -1,94 +1,321 @@
-from fastapi import FastAPI, UploadFile, BackgroundTasks, HTTPException
+from contextlib import asynccontextmanager
+import asyncio
+import threading
+import time
+from fastapi import FastAPI, UploadFile, HTTPException, Form, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import Response, JSONResponse, StreamingResponse, PlainTextResponse
 import uuid
 import os
-from audio_processing import run_karaoke_process, run_lyrics_alignment_process
 import json
-from util import TRACK_ROOT
+from util import TRACK_ROOT, JOB_SLOTS, MAX_QUEUED_JOBS, TASK_STORE_URL, FINISHED_TASK_TTL, PRELOAD_MODELS, ALIGN_PRELOAD_LANGUAGES, pick_device
+from util import JOB_QUEUE_URL, SEPARATION_PROFILES, DEFAULT_SEPARATION_PROFILE
+from util import UPLOAD_DIR, UPLOAD_CHUNK_BYTES, DEDUP_CACHE, STEMS
+from scheduler import JobScheduler, QueueFull
+from job_queue import make_job_queue
+from jobs import tasks, JOB_KINDS, job_device, remove_upload, discard_job, recover_expired_jobs
+from task_events import task_events
+import uploads
+from dedup_cache import content_cache
+from workspace import evict_stale_workspaces, partial_state
+from catalog import catalog
+from lyrics_index import lyrics_index
+from file_serving import ranged_file_response, negotiate_stem, accept_preferences, compressed_response, file_etag
+from alignment_format import ColumnarAlignment
+import separation
+from model_registry import registry as align_models
+from metrics import registry as metrics, RequestTimer, UPLOAD_BYTES, UPLOAD_SECONDS, CACHE_REQUESTS
 
-app = FastAPI()
+tasks.on_change = task_events.notify
+scheduler = None  # runs jobs in this process, unless a job queue hands them to worker.py processes
+accelerator = "cpu"  # "cuda" once lifespan has found a GPU
+job_queue = make_job_queue(JOB_QUEUE_URL) if JOB_QUEUE_URL else None
 
-tasks = {} # tracks jobs
+def evict_once():
+    evicted = tasks.evict_finished(FINISHED_TASK_TTL)
+    if evicted:
+        print(f"Evicted {evicted} finished tasks")
+    uploads.evict_stale_sessions(FINISHED_TASK_TTL)
+    evict_stale_workspaces(FINISHED_TASK_TTL)  # scratch of jobs killed mid-run
+    if job_queue is not None:
+        recover_expired_jobs(job_queue)
+
+async def evict_finished_tasks():
+    while True:
+        try:
+            evict_once()
+        except Exception as e:
+            # a locked database or a folder removed mid-scan; try again next round
+            print(f"Eviction pass failed: {e!r}")
+        await asyncio.sleep(60)
+
+def sync_library_indexes():
+    catalog.rescan()
+    lyrics_index.backfill()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global scheduler, accelerator
+    task_events.bind(asyncio.get_running_loop())
+    if job_queue is None:
+        recovered = tasks.recover_orphans()
+        if recovered:
+            print(f"Marked {recovered} tasks from a previous run as failed")
+        scheduler = JobScheduler(JOB_SLOTS, max_queued=MAX_QUEUED_JOBS, cancel_check=tasks.cancel_requested)
+        # asking for a GPU imports torch; once, off the event loop, instead of on the first upload
+        accelerator = await asyncio.to_thread(pick_device)
+    elif TASK_STORE_URL == "memory":
+        raise RuntimeError("KARAOKE_JOB_QUEUE needs a task store the workers can share (sqlite:///...)")
+    # with a job queue, tasks whose worker died are requeued by lease expiry instead
+    evictor = asyncio.create_task(evict_finished_tasks())
+    # pick up tracks added/removed while the server was down
+    threading.Thread(target=sync_library_indexes, name="library-rescan", daemon=True).start()
+    if PRELOAD_MODELS and scheduler is not None:
+        # warm the separation model in the background; the first job waits on the load lock if it's early
+        threading.Thread(target=separation.preload, name="preload-separation", daemon=True).start()
+        threading.Thread(target=align_models.preload, args=(ALIGN_PRELOAD_LANGUAGES,),
+                         name="preload-align", daemon=True).start()
+    yield
+    evictor.cancel()
+    if scheduler is not None:
+        scheduler.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestTimer)
+
+def queue_position(task_id: str):
+    return (job_queue or scheduler).position(task_id)
+
+# read at scrape time; scheduler counts are for this process, queue counts for all workers
+metrics.gauge("karaoke_jobs_queued", "Jobs waiting for a worker slot", lambda: (job_queue or scheduler).queued_count())
+metrics.gauge("karaoke_jobs_running", "Jobs currently running", lambda: (job_queue or scheduler).running_count())
+metrics.gauge("karaoke_align_models_loaded", "Alignment models resident in memory", lambda: len(align_models.loaded()))
+metrics.gauge("karaoke_align_models_bytes", "Memory held by resident alignment models", align_models.total_bytes)
+metrics.gauge("karaoke_dedup_cache_bytes", "Size of the dedup cache", content_cache.total_bytes)
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/status/{task_id}")
 async def get_status(task_id: str):
-    if task_id not in tasks:
+    status = tasks.get(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if status["status"] == "queued":
+        # with the in-process scheduler, only known if the job is queued in this process
+        status["queue_position"] = queue_position(task_id)
+    return status
+
+@app.get("/events/{task_id}")
+async def task_event_stream(task_id: str):
+    # Server-Sent Events: one "status" event per change until the task finishes
+    if tasks.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    def current_state(task_id):
+        status = tasks.get(task_id)
+        if status is not None and status["status"] == "queued":
+            status["queue_position"] = queue_position(task_id)
+        return status
+
+    return StreamingResponse(task_events.stream(task_id, current_state), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/cancel/{task_id}")
+async def cancel_task(task_id: str):
+    status = tasks.get(task_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return tasks[task_id]
 
-def background_wrap(task_id: str, fn, *args, **kwargs):
+    # The store transition decides who wins if the job starts at the same moment.
+    # The job may belong to another worker process, so the flag goes through the store too.
+    if tasks.transition(task_id, ("queued",), "cancelled", "Cancelled before it started"):
+        if job_queue is None:
+            scheduler.cancel(task_id)
+        else:
+            job = job_queue.remove(task_id)
+            if job is not None:
+                discard_job(job["kind"], job["args"])
+    elif tasks.transition(task_id, ("processing",), "cancelling", "Stopping after the current step..."):
+        # a worker process sees the flag at its next check_cancelled()
+        tasks.request_cancel(task_id)
+        if job_queue is None:
+            scheduler.cancel(task_id)
+    else:
+        raise HTTPException(status_code=409, detail=f"Task is already {status['status']}")
+    return tasks.get(task_id)
+
+def submit_job(task_id: str, kind: str, *args, priority: int = 0, on_cancel=None):
+    # kind: one of jobs.JOB_KINDS; args must be JSON serialisable so they can go through the queue
+    tasks.create(task_id, "queued", "Waiting for a free worker...", queued_at=time.time())
     try:
-        success, message = fn(*args, **kwargs)
-        tasks[task_id] = {
-            "status": "completed" if success else "failed",
-            "message": message
-        }
-    except Exception as e:
-        tasks[task_id] = {"status": "failed", "message": str(e)}
-
-# Video-specific cleanup wrapper
-def background_wrap_video(task_id: str, file_path: str, original_file_name: str):
-    background_wrap(task_id, run_karaoke_process, file_path, task_id, original_file_name)
-    # cleanup the original upload
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-# Lyrics-specific wrapper
-def background_wrap_lyrics(task_id: str, song_name: str, lyrics: str, language_code: str):
-    background_wrap(task_id, run_lyrics_alignment_process, song_name, lyrics, language_code)
+        if job_queue is None:
+            scheduler.submit(task_id, JOB_KINDS[kind], task_id, *args, device=job_device(kind, args, accelerator),
+                             priority=priority, on_cancel=on_cancel)
+        else:
+            job_queue.enqueue(task_id, kind, args, priority=priority, max_queued=MAX_QUEUED_JOBS)
+    except QueueFull as e:
+        tasks.delete(task_id)
+        if on_cancel is not None:
+            on_cancel()
+        raise HTTPException(status_code=503, detail=str(e))
+
+def separation_profile(profile: str = None):
+    profile = profile or DEFAULT_SEPARATION_PROFILE
+    if profile not in SEPARATION_PROFILES:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown profile '{profile}', expected one of: {', '.join(SEPARATION_PROFILES)}")
+    return profile
+
+def start_track_job(task_id: str, upload_path: str, original_file_name: str, content_hash: str, priority: int,
+                    profile: str):
+    # the same upload separated with another profile is a different result
+    cache_key = f"{content_hash}-{profile}"
+    if DEDUP_CACHE:
+        # same bytes were processed before: link the existing outputs instead of running the pipeline
+        track = os.path.splitext(original_file_name)[0]
+        hit = content_cache.restore(cache_key, os.path.join(TRACK_ROOT, track))
+        CACHE_REQUESTS.inc(cache="dedup", result="hit" if hit else "miss")
+        if hit:
+            remove_upload(upload_path)
+            catalog.refresh(track)
+            tasks.create(task_id, "completed", "Reused the outputs of an identical upload", track=track, deduplicated=True)
+            return {"task_id": task_id}
+
+    submit_job(task_id, "track", upload_path, original_file_name,
+               cache_key if DEDUP_CACHE else None, profile,
+               priority=priority, on_cancel=lambda: remove_upload(upload_path))
+    return {"task_id": task_id}
 
 @app.post("/upload_track")
-async def process_video(file: UploadFile, background_tasks: BackgroundTasks):
+async def process_video(file: UploadFile, priority: int = 10, profile: str = None):
+    profile = separation_profile(profile)
     task_id = str(uuid.uuid4())
-    os.makedirs("uploads", exist_ok=True)
-    temp_path = os.path.join("uploads", f"{task_id}_{file.filename}")  
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    file_name = os.path.basename(file.filename)
+    temp_path = os.path.join(UPLOAD_DIR, f"{task_id}_{file_name}")
 
-    with open(temp_path, "wb") as f:
-        f.write(await file.read())
-    
-    tasks[task_id] = {"status": "processing", "message": "GPU is working..."}
-    
-    background_tasks.add_task(background_wrap_video, task_id, temp_path, file.filename)
-    return {"task_id": task_id}
+    # stream to disk, never hold the whole video in memory
+    start = time.perf_counter()
+    try:
+        content_hash = await uploads.save_stream(file, temp_path, UPLOAD_CHUNK_BYTES)
+    except uploads.UploadError as e:
+        remove_upload(temp_path)
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    UPLOAD_SECONDS.inc(time.perf_counter() - start)
+    UPLOAD_BYTES.inc(os.path.getsize(temp_path))
+
+    return start_track_job(task_id, temp_path, file_name, content_hash, priority, profile)
+
+# Resumable uploads: POST /uploads -> PUT /uploads/{id}?offset=N (repeat) -> POST /uploads/{id}/complete
+@app.post("/uploads")
+async def create_upload(filename: str = Form(...), size: int = Form(...)):
+    try:
+        session = uploads.create_session(filename, size)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {**session, "chunk_size": UPLOAD_CHUNK_BYTES}
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    # a client resuming after a dropped connection asks here where to continue from
+    try:
+        return uploads.session_info(upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = 0):
+    start = time.perf_counter()
+    try:
+        received = await uploads.write_chunk(upload_id, offset, request.stream())
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    UPLOAD_SECONDS.inc(time.perf_counter() - start)
+    UPLOAD_BYTES.inc(received - offset)
+    return {"upload_id": upload_id, "received": received}
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, priority: int = 10, profile: str = None):
+    profile = separation_profile(profile)
+    try:
+        # hashing a multi-GB file takes a while; keep the event loop serving meanwhile
+        part_path, file_name, content_hash = await asyncio.to_thread(uploads.finish_session, upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    task_id = str(uuid.uuid4())
+    upload_path = os.path.join(UPLOAD_DIR, f"{task_id}_{file_name}")
+    os.replace(part_path, upload_path)
+    return start_track_job(task_id, upload_path, file_name, content_hash, priority, profile)
 
 @app.get("/tracks")
-async def get_tracks():
-    tracks = []
-    if os.path.exists(TRACK_ROOT):
-        for name in os.listdir(TRACK_ROOT):
-            if os.path.isdir(os.path.join(TRACK_ROOT, name)):
-                tracks.append(name)
-    return {"tracks": tracks}
+async def get_tracks(request: Request, offset: int = 0, limit: int = 100, sort: str = "name", desc: bool = False,
+                     has_lyrics: bool = None, language: str = None, q: str = None):
+    query_args = (offset, limit, sort, desc, has_lyrics, language, q)
+    etag = catalog.version(*query_args)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        total, tracks = catalog.query(offset=offset, limit=min(limit, 1000), sort=sort, descending=desc,
+                                      has_lyrics=has_lyrics, language=language, search=q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    body = {"tracks": tracks, "total": total, "offset": offset, "limit": limit}
+    return JSONResponse(body, headers={"ETag": etag})
+
+@app.get("/search")
+async def search_lyrics(q: str, limit: int = 20):
+    # matching lyric lines across the library, with word-level timestamps to jump to
+    return {"query": q, "results": lyrics_index.search(q, limit=min(limit, 200))}
 
 @app.get("/audio/{song_name}/{track_type}")
-async def get_audio_file(song_name: str, track_type: str):
-    # track_type should be 'vocals' or 'no_vocals'
-    file_path = os.path.join(TRACK_ROOT, song_name, f"{track_type}")
-    print(file_path)
-    
-    if not os.path.exists(file_path):
+async def get_audio_file(song_name: str, track_type: str, request: Request, format: str = None):
+    # track_type should be 'vocals' or 'no_vocals'. An extension ("vocals.wav") or ?format=opus,flac
+    # says which encodings the client wants, otherwise the Accept header decides.
+    stem, _, ext = track_type.partition(".")
+    if stem not in STEMS:
         raise HTTPException(status_code=404, detail="Audio track not found")
-        
-    return FileResponse(file_path, media_type="audio/wav")
+
+    vary = None
+    if format:
+        preferences = [fmt.strip() for fmt in format.split(",")]
+    elif ext:
+        preferences = [ext]
+    else:
+        preferences = accept_preferences(request.headers.get("accept", ""))
+        vary = "Accept"  # the same URL is a different file for another Accept header
+
+    song_dir = os.path.join(TRACK_ROOT, song_name)
+    file_path, media_type = negotiate_stem(song_dir, stem, preferences)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="Audio track not found")
+
+    # a partial track's WAVs are still being appended to (progressive.py)
+    growing = file_path.endswith(".wav") and partial_state(song_dir) is not None
+    return ranged_file_response(request, file_path, media_type, growing=growing, vary=vary)
 
 @app.get("/video/{song_name}")
-async def get_video_file(song_name: str):
+async def get_video_file(song_name: str, request: Request):
     # Locate the video.mp4 created in audio_processing.py
     file_path = os.path.join(TRACK_ROOT, song_name, "video.mp4")
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Video file not found")
         
-    return FileResponse(file_path, media_type="video/mp4")
+    return ranged_file_response(request, file_path, "video/mp4")
 
 @app.get("/lyrics/{song_name}")
-async def get_lyrics_data(song_name: str):
+async def get_lyrics_data(song_name: str, request: Request):
     alignment_path = os.path.join(TRACK_ROOT, song_name, "alignment.json")
     lyrics_path = os.path.join(TRACK_ROOT, song_name, "lyrics_raw.txt")
 
     # Check files exist before trying to open them
-    if not os.path.isfile(alignment_path) or not not os.path.isfile(lyrics_path) :
+    if not os.path.isfile(alignment_path) or not os.path.isfile(lyrics_path):
         return None
     
     with open(alignment_path, "r", encoding="utf-8") as f:
@@ -96,16 +323,41 @@ async def get_lyrics_data(song_name: str):
     with open(lyrics_path, "r", encoding="utf-8") as f:
         lyrics_raw = f.read()
 
-    return {
+    body = {
         "song_name": song_name,
         "language": alignment_data["language"],
         "lyrics_raw": lyrics_raw,
         "word_segments": alignment_data["word_segments"]
     }
+    return compressed_response(request, json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json")
+
+@app.get("/lyrics/{song_name}/alignment")
+async def get_alignment_binary(song_name: str, request: Request):
+    # columnar binary alignment (alignment_format.py), much smaller than the JSON word list
+    song_dir = os.path.join(TRACK_ROOT, song_name)
+    bin_path = os.path.join(song_dir, "alignment.bin")
+    json_path = os.path.join(song_dir, "alignment.json")
+
+    if not os.path.isfile(bin_path):
+        if not os.path.isfile(json_path):
+            raise HTTPException(status_code=404, detail="No alignment for this track")
+        # aligned before the binary format existed: convert once and keep it
+        with open(json_path, "r", encoding="utf-8") as f:
+            word_segments = json.load(f)["word_segments"]
+        with open(bin_path, "wb") as f:
+            f.write(ColumnarAlignment.from_word_segments(word_segments).to_bytes())
+
+    with open(bin_path, "rb") as f:
+        data = f.read()
+    # lets the player's disk cache revalidate without downloading it again
+    return compressed_response(request, data, "application/octet-stream", etag=file_etag(bin_path))
 
 @app.post("/upload_lyrics/{song_name}")
-async def process_lyrics(song_name: str, background_tasks: BackgroundTasks, lyrics: str = Form(...), language_code: str = Form("en")):
+async def process_lyrics(song_name: str, lyrics: str = Form(...), language_code: str = Form("en"), priority: int = 0):
+    if partial_state(os.path.join(TRACK_ROOT, song_name)) is not None:
+        # aligning against a preview would leave the rest of the song without timings
+        raise HTTPException(status_code=409, detail="Track is still being separated")
+    # alignment is quick compared to separation, so by default it jumps ahead of queued uploads
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {"status": "processing", "message": "Aligning lyrics..."}
-    background_tasks.add_task(background_wrap_lyrics, song_name, lyrics, language_code)
+    submit_job(task_id, "lyrics", song_name, lyrics, language_code, priority=priority)
     return {"task_id": task_id}
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import av
+from imageio_ffmpeg import get_ffmpeg_exe
+
+# Ingest helpers built on ffmpeg. The old path decoded the whole video with moviepy
+# and re-encoded every frame just to drop the audio track; here the video stream is
+# copied as-is into video.mp4 and the audio is decoded to WAV separately, so the two
+# can run side by side (see pipeline.py).
+
+# video codecs that can go into an mp4 without transcoding and that QMediaPlayer plays
+REMUXABLE_VIDEO_CODECS = {"h264", "hevc", "mpeg4", "av1"}
+
+AUDIO_SAMPLE_RATE = 44100  # what Demucs works at, saves a resample later
+
+def probe(path: str):
+    """Return (video_codec, has_audio, duration_seconds) for a media file."""
+    with av.open(path) as container:
+        video_codec = container.streams.video[0].codec_context.name if container.streams.video else None
+        has_audio = len(container.streams.audio) > 0
+        duration = container.duration / av.time_base if container.duration else None
+    return video_codec, has_audio, duration
+
+def _run_ffmpeg(args):
+    cmd = [get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", *args]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+def _video_args(muted_video_path, copy: bool):
+    codec = ["-c:v", "copy"] if copy else ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p"]
+    return ["-map", "0:v:0", *codec, "-an", "-movflags", "+faststart", muted_video_path]
+
+def _audio_args(audio_path):
+    return ["-map", "0:a:0", "-vn", "-c:a", "pcm_s16le", "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "2", audio_path]
+
+def check_ingestable(video_path: str):
+    """Probe the upload and fail early if it can't be turned into a karaoke track."""
+    video_codec, has_audio, duration = probe(video_path)
+    if not has_audio:
+        raise ValueError("Video has no audio track to separate.")
+    if video_codec is None:
+        raise ValueError("File has no video stream.")
+    return {"video_codec": video_codec, "duration": duration}
+
+def extract_audio(video_path: str, audio_path: str):
+    """Decode just the audio track to WAV. Much faster than anything touching the video frames."""
+    _run_ffmpeg(["-i", video_path, *_audio_args(audio_path)])
+
+def write_muted_video(video_path: str, muted_video_path: str, video_codec: str):
+    """Copy the video stream into an mp4 without audio. Re-encodes only if the codec or
+    container can't be copied as-is. Returns True if it was a plain remux."""
+    if video_codec in REMUXABLE_VIDEO_CODECS:
+        try:
+            _run_ffmpeg(["-i", video_path, *_video_args(muted_video_path, copy=True)])
+            return True
+        except RuntimeError as e:
+            # some containers carry streams mp4 can't take as-is (odd timestamps etc.)
+            print(f"Remux failed, re-encoding instead: {e}")
+
+    _run_ffmpeg(["-i", video_path, *_video_args(muted_video_path, copy=False)])
+    return False
+
+STEM_CODECS = {
+    "flac": ["-c:a", "flac", "-compression_level", "5"],
+    "opus": ["-c:a", "libopus", "-b:a", "160k"],
+}
+
+def encode_stems(song_dir: str, stems, formats, keep_wav: bool):
+    """Write compressed copies of the separated WAV stems. Returns the formats now stored."""
+    stored = []
+    for fmt in formats:
+        for stem in stems:
+            wav_path = os.path.join(song_dir, f"{stem}.wav")
+            out_path = os.path.join(song_dir, f"{stem}.{fmt}")
+            _run_ffmpeg(["-i", wav_path, "-vn", *STEM_CODECS[fmt], out_path])
+        stored.append(fmt)
+
+    if keep_wav or not stored:
+        stored.append("wav")
+    else:
+        for stem in stems:
+            os.remove(os.path.join(song_dir, f"{stem}.wav"))
+    return stored
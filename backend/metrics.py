@@ -0,0 +1,198 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Counters, gauges and histograms rendered in the Prometheus text format on /metrics.
+# Small on purpose: labels are passed as keyword arguments, everything is thread safe,
+# and values are per process (with several uvicorn workers, scrape each one or sum).
+
+# seconds; from quick file serving up to hour-long separations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values.items()]
+
+class Gauge(_Metric):
+    """Set directly, or give it a function that's called at scrape time (returns a number,
+    or a dict of {labels tuple: number} for labelled gauges)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, function=None):
+        super().__init__(name, help_text)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []  # e.g. scheduler not started yet
+            values = value if isinstance(value, dict) else {(): value}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """Context manager that observes how long its block took."""
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+class RequestTimer:
+    """ASGI middleware: time from request to response headers, by route template. Plain ASGI
+    rather than BaseHTTPMiddleware so file and event streams pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")  # set by the router once it matched
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                             route=getattr(route, "path", "unmatched"),
+                                             method=scope["method"], status=message["status"])
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, function=None):
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.header()
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# --- the app's metrics, shared by the modules that record them ---
+
+STAGE_SECONDS = registry.histogram(
+    "karaoke_stage_seconds", "Duration of each processing stage")
+JOB_SECONDS = registry.histogram(
+    "karaoke_job_seconds", "Time a job ran for, by kind and outcome")
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "karaoke_queue_wait_seconds", "Time jobs waited for a free worker slot")
+MODEL_LOAD_SECONDS = registry.histogram(
+    "karaoke_model_load_seconds", "Time taken to load a model into memory")
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "karaoke_http_request_seconds", "Time to the response headers, by route",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+UPLOAD_BYTES = registry.counter(
+    "karaoke_upload_bytes_total", "Bytes of uploaded video received")
+UPLOAD_SECONDS = registry.counter(
+    "karaoke_upload_receive_seconds_total", "Time spent receiving upload bytes (bytes/s = bytes_total / this)")
+CACHE_REQUESTS = registry.counter(
+    "karaoke_cache_requests_total", "Cache lookups by cache and result (hit/miss)")
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+from util import ALIGN_CACHE_MB, pick_device
+from metrics import MODEL_LOAD_SECONDS, CACHE_REQUESTS
+
+# Cache of whisperx alignment models keyed by (language, device).
+# Loading one takes several seconds, so repeat alignments in a common language
+# reuse the resident model. Least recently used models are dropped once the
+# total size goes over the memory budget.
+
+def _model_bytes(model):
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except AttributeError:
+        return 0
+
+class AlignModelRegistry:
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._models = OrderedDict()  # (language, device) -> (model, metadata, size)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, language_code: str, device: str = None):
+        device = device or pick_device()
+        key = (language_code, device)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache="align_model", result="hit")
+                model, metadata, _ = self._models[key]
+                return model, metadata
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # load outside the registry lock so other languages aren't blocked,
+        # but only once per key if two jobs ask at the same time
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    CACHE_REQUESTS.inc(cache="align_model", result="hit")
+                    model, metadata, _ = self._models[key]
+                    return model, metadata
+                self.misses += 1
+                CACHE_REQUESTS.inc(cache="align_model", result="miss")
+
+            start = time.perf_counter()
+            import whisperx  # heavy; only imported once a model is actually needed
+            model, metadata = whisperx.load_align_model(language_code=language_code, device=device)
+            size = _model_bytes(model)
+            load_seconds = time.perf_counter() - start
+            MODEL_LOAD_SECONDS.observe(load_seconds, kind="align", model=language_code)
+            print(f"Loaded alignment model for '{language_code}' on {device} "
+                  f"({size / 2**20:.0f} MB) in {load_seconds:.1f}s")
+
+            with self._lock:
+                self._models[key] = (model, metadata, size)
+                self._evict(keep=key)
+            return model, metadata
+
+    def _evict(self, keep):
+        evicted_cuda = False
+        while self.total_bytes() > self.budget_bytes and len(self._models) > 1:
+            oldest = next(k for k in self._models if k != keep)
+            del self._models[oldest]
+            evicted_cuda = evicted_cuda or oldest[1] == "cuda"
+            print(f"Evicted alignment model {oldest} to stay under {self.budget_bytes / 2**20:.0f} MB")
+        if evicted_cuda:
+            import torch
+            torch.cuda.empty_cache()
+
+    def total_bytes(self):
+        return sum(size for _, _, size in self._models.values())
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def preload(self, languages):
+        for language_code in languages:
+            try:
+                self.get(language_code)
+            except Exception as e:
+                print(f"Could not preload alignment model for '{language_code}': {e}")
+
+registry = AlignModelRegistry(ALIGN_CACHE_MB * 2**20)
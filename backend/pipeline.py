@@ -0,0 +1,120 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from scheduler import check_cancelled, job_context, run_in_job
+from util import VIDEO_WORKERS
+
+# A tiny stage DAG for the ingest job. Stages start as soon as the stages they
+# depend on are done, so independent work (video remux vs. audio separation)
+# overlaps and a song takes about as long as its slowest chain of stages.
+#   pool="thread"  -> runs in a thread of this job (GPU work, I/O)
+#   pool="process" -> runs in the shared process pool (CPU heavy ffmpeg work)
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn, not fork: the backend process has threads and possibly a CUDA context
+            _process_pool = ProcessPoolExecutor(max_workers=VIDEO_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+def _discard_process_pool(pool):
+    """Forget a pool that broke (one of its workers died), so the next process_pool()
+    call starts a new one instead of every later stage failing."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _timed(fn, args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+class Stage:
+    def __init__(self, name, fn, args, deps, pool):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.deps = tuple(deps)
+        self.pool = pool
+
+class Pipeline:
+    def __init__(self, on_update=None):
+        # on_update(stage_name, event, timings) is called from the job thread on "started" / "done"
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+        self.on_update = on_update
+
+    def add(self, name, fn, *args, deps=(), pool="thread"):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name, fn, args, deps, pool)
+        return self
+
+    def _notify(self, name, event):
+        if self.on_update is not None:
+            self.on_update(name, event, dict(self.timings))
+
+    def run(self):
+        """Run every stage, returning {stage_name: result}. The first failure is re-raised
+        once the stages already running have stopped. A process stage whose worker died is
+        run once more on a new pool."""
+        pending = dict(self.stages)
+        running = {}
+        pools = {}  # process stage future -> the pool it was submitted to
+        retried = set()
+        threads = ThreadPoolExecutor(max_workers=max(1, len(self.stages)), thread_name_prefix="stage")
+        # thread stages run as part of this job, so their check_cancelled() calls work
+        context = job_context()
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dep in self.results for dep in stage.deps):
+                        if stage.pool == "process":
+                            pool = process_pool()
+                            future = pool.submit(_timed, stage.fn, stage.args)
+                            pools[future] = pool
+                        else:
+                            future = threads.submit(run_in_job, context, _timed, stage.fn, stage.args)
+                        running[future] = name
+                        del pending[name]
+                        self._notify(name, "started")
+
+                if not running:
+                    raise RuntimeError(f"Stages can never run: {', '.join(pending)}")
+
+                done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name], self.timings[name] = future.result()
+                    except BrokenProcessPool:
+                        _discard_process_pool(pools[future])
+                        if name in retried:
+                            raise
+                        retried.add(name)
+                        pool = process_pool()
+                        retry = pool.submit(_timed, self.stages[name].fn, self.stages[name].args)
+                        pools[retry] = pool
+                        running[retry] = name
+                        continue
+                    self._notify(name, "done")
+
+                check_cancelled()
+            return self.results
+        finally:
+            # a failed/cancelled run still waits for running stages so nothing writes into
+            # a directory that is about to be cleaned up
+            for future in running:
+                future.cancel()
+            wait(running)
+            threads.shutdown(wait=True)
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import uuid
+from workspace import PARTIAL_MARKER, STAGING_DIR, partial_state, publish, write_atomic
+from dedup_cache import ARTIFACTS, link_or_copy
+from catalog import catalog
+from task_store import ACTIVE_STATUSES
+from jobs import tasks
+from scheduler import lease_held
+
+# Progressive processing for new tracks. Instead of appearing in /tracks only when the
+# whole job is done, the song folder is published as soon as the first stem window is
+# separated. That window is short (KARAOKE_PREVIEW_SECONDS), so the track is playable a
+# few seconds into the job. The video doesn't hold it up: it's moved in whenever its
+# stage finishes (a re-encode can take a while). Separation then appends to the stems in place. StemWriter keeps them
+# valid WAVs at every point, and /audio serves whatever is there so far. A marker file
+# flags the folder as partial for the catalog and the player. When the stems are
+# finished they are encoded in scratch like any other track, and the final publish
+# swaps the compressed stems in and drops the WAVs and the marker.
+# Re-processing a track that already exists keeps serving the old version until the
+# new one is finished, as before. So does a second upload of a name whose preview is
+# still running: only the job that created the folder writes into it.
+
+def _is_live(task_id):
+    return (tasks.get(task_id) or {}).get("status") in ACTIVE_STATUSES
+
+class LivePreview:
+    """A new track's folder while it's being separated into."""
+
+    def __init__(self, song_dir: str, duration: float, task_id: str):
+        self.song_dir = song_dir
+        self.name = os.path.basename(song_dir)
+        self.duration = duration
+        self.task_id = task_id
+        self.opened = False
+
+    def _mark(self, ready_seconds):
+        write_atomic(os.path.join(self.song_dir, PARTIAL_MARKER),
+                     json.dumps({"ready_seconds": round(ready_seconds, 2), "duration": self.duration,
+                                 "task_id": self.task_id}))
+
+    def claim(self):
+        """Take the track name for this job by creating its folder. False if the folder is
+        there already (a finished track, or another live job's preview), and the job then
+        builds and publishes as usual."""
+        os.makedirs(os.path.dirname(self.song_dir) or ".", exist_ok=True)
+        try:
+            os.mkdir(self.song_dir)
+        except FileExistsError:
+            state = partial_state(self.song_dir)
+            if state is None or (state.get("task_id") != self.task_id and _is_live(state.get("task_id"))):
+                return False
+            # a preview whose job died (or an earlier attempt of this one): move it aside
+            # with a rename, so of two jobs taking it over only one gets it
+            stale = os.path.join(STAGING_DIR, uuid.uuid4().hex)
+            os.makedirs(STAGING_DIR, exist_ok=True)
+            try:
+                os.rename(self.song_dir, stale)
+                os.mkdir(self.song_dir)
+            except OSError:
+                return False
+            finally:
+                shutil.rmtree(stale, ignore_errors=True)
+        self.opened = True
+        self._mark(0)
+        return True
+
+    def add_video(self, video_dir: str):
+        """Move the finished muted video (video_dir/video.mp4) into the folder."""
+        publish(video_dir, self.song_dir)
+
+    def update(self, ready_seconds: float):
+        self._mark(ready_seconds)
+        catalog.refresh(self.name, duration=self.duration)
+
+    def take_stems(self, build_dir: str, stems):
+        """Hard link the finished WAVs back into the build folder to be encoded there, out of sight
+        of /audio (which would otherwise pick up half-written compressed copies)."""
+        for stem in stems:
+            link_or_copy(os.path.join(self.song_dir, f"{stem}.wav"), os.path.join(build_dir, f"{stem}.wav"))
+
+    def finish(self, build_dir: str):
+        # the video went out in add_video(); any other artifact this build didn't make is stale
+        publish(build_dir, self.song_dir, [name for name in ARTIFACTS if name != "video.mp4"])
+        os.remove(os.path.join(self.song_dir, PARTIAL_MARKER))
+
+    def abort(self):
+        """The job failed or was cancelled: a preview of a track that will never be finished goes.
+        Unless this worker lost the job meanwhile; then the folder is the retry's."""
+        if self.opened and lease_held():
+            shutil.rmtree(self.song_dir, ignore_errors=True)
+            catalog.remove(self.name)
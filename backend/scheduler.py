@@ -0,0 +1,189 @@
+import heapq
+import itertools
+import threading
+
+# Bounded job scheduler for the heavy GPU/CPU work (Demucs, whisperx).
+# Each device gets a fixed number of worker slots and its own priority queue,
+# so ten uploads at once queue up instead of all fighting for the same device.
+
+_current = threading.local()
+
+class JobCancelled(Exception):
+    pass
+
+class QueueFull(Exception):
+    pass
+
+class LeaseLost(Exception):
+    """A queue job stalled past its lease and went to another worker, which owns it now."""
+
+class Job:
+    def __init__(self, task_id, fn, args, kwargs, device, priority, seq, on_cancel=None, lease=None):
+        self.task_id = task_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.device = device
+        self.priority = priority
+        self.seq = seq
+        self.on_cancel = on_cancel
+        self.lease = lease
+        self.state = "queued"  # queued -> running -> done, or cancelled
+        self.cancel_event = threading.Event()
+
+    def __lt__(self, other):
+        # lower priority number runs first, FIFO within the same priority
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+def check_cancelled():
+    """Call from inside a running job between steps. Raises JobCancelled if the job was cancelled."""
+    job = getattr(_current, "job", None)
+    if job is None:
+        return
+    cancel_check = _current.scheduler.cancel_check
+    if job.cancel_event.is_set() or (cancel_check is not None and cancel_check(job.task_id)):
+        raise JobCancelled(f"Task {job.task_id} was cancelled")
+
+def lease_held():
+    """Whether this process still owns the running job, renewing its lease. Always True for
+    jobs without a lease (the API's own jobs)."""
+    job = getattr(_current, "job", None)
+    return job is None or job.lease is None or job.lease()
+
+def check_lease():
+    """Call from inside a running job right before it writes outside its scratch folder
+    (publishing into the library). Raises LeaseLost if a retry owns the job now."""
+    if not lease_held():
+        raise LeaseLost(f"Task {current_task_id()} was handed to another worker")
+
+def current_task_id():
+    job = getattr(_current, "job", None)
+    return job.task_id if job is not None else None
+
+def job_context():
+    """The job running on this thread, to hand to helper threads (see run_in_job)."""
+    return getattr(_current, "job", None), getattr(_current, "scheduler", None)
+
+def run_in_job(context, fn, *args):
+    """Run fn on a helper thread as part of the job from job_context(), so check_cancelled()
+    inside it sees that job's cancellation."""
+    _current.job, _current.scheduler = context
+    try:
+        return fn(*args)
+    finally:
+        _current.job = None
+
+class JobScheduler:
+    def __init__(self, slots: dict, max_queued: int = 0, cancel_check=None):
+        # slots: {"cuda": 1, "cpu": 2} -> number of jobs allowed to run at once per device
+        # cancel_check: optional fn(task_id) -> bool, for cancellations requested from another process
+        self.slots = dict(slots)
+        self.max_queued = max_queued
+        self.cancel_check = cancel_check
+        self._lock = threading.Condition()
+        self._queues = {device: [] for device in self.slots}
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._running = True
+        self._threads = []
+
+        for device, count in self.slots.items():
+            for i in range(count):
+                t = threading.Thread(target=self._worker, args=(device,), name=f"job-{device}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, task_id, fn, *args, device="cpu", priority=0, on_cancel=None, lease=None, **kwargs):
+        # lease: for queue jobs, fn() -> whether this worker still holds the job (renewing it)
+        with self._lock:
+            if device not in self._queues:
+                raise ValueError(f"No worker slots configured for device '{device}'")
+            if self.max_queued and self.queued_count() >= self.max_queued:
+                raise QueueFull(f"Job queue is full ({self.max_queued} waiting)")
+
+            job = Job(task_id, fn, args, kwargs, device, priority, next(self._seq), on_cancel, lease)
+            self._jobs[task_id] = job
+            heapq.heappush(self._queues[device], job)
+            self._lock.notify_all()
+            return job
+
+    def position(self, task_id):
+        """1-based position among the jobs waiting for the same device, or None if not queued."""
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None or job.state != "queued":
+                return None
+            ahead = sum(1 for other in self._queues[job.device] if other.state == "queued" and other < job)
+            return ahead + 1
+
+    def queued_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state == "queued")
+
+    def running_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state == "running")
+
+    def cancel(self, task_id):
+        """Cancel a job. Queued jobs are dropped right away; running jobs are asked to stop
+        and will raise JobCancelled at their next check_cancelled() call.
+        Returns the state the job was in ("queued" / "running"), or None if there was nothing to cancel."""
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None or job.state in ("done", "cancelled"):
+                return None
+
+            previous = job.state
+            job.cancel_event.set()
+            if job.state == "queued":
+                # left in the heap; workers skip it when popped
+                job.state = "cancelled"
+                del self._jobs[task_id]
+                on_cancel = job.on_cancel
+            else:
+                on_cancel = None
+
+        if on_cancel is not None:
+            on_cancel()
+        return previous
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            self._running = False
+            self._lock.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def _next_job(self, device):
+        queue = self._queues[device]
+        with self._lock:
+            while True:
+                if not self._running:
+                    return None
+                while queue and queue[0].state == "cancelled":
+                    heapq.heappop(queue)
+                if queue:
+                    job = heapq.heappop(queue)
+                    job.state = "running"
+                    return job
+                self._lock.wait()
+
+    def _worker(self, device):
+        while True:
+            job = self._next_job(device)
+            if job is None:
+                return
+
+            _current.job = job
+            _current.scheduler = self
+            try:
+                job.fn(*job.args, **job.kwargs)
+            except Exception as e:
+                # the job wrappers record their own failures, this is just a safety net
+                print(f"Job {job.task_id} crashed: {e}")
+            finally:
+                _current.job = None
+                with self._lock:
+                    job.state = "done"
+                    self._jobs.pop(job.task_id, None)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import whisperx
+from scheduler import check_cancelled
+from workspace import write_atomic
+
+# Segmented lyrics alignment. Rather than aligning the whole lyrics text against the
+# whole vocals stem in one go, find the sung regions of the stem with a simple energy
+# VAD (it's already isolated vocals, so loudness is a good enough voice detector), map
+# stanzas (or lines) onto groups of regions and align each group on its own slice of
+# audio, several at a time. Memory is bounded by the longest segment, a bad region only
+# spoils its own segment, and per-segment results are cached next to the track so
+# editing one line only re-aligns the segment it's in.
+
+SAMPLE_RATE = 16000  # whisperx.load_audio resamples to this
+FRAME_SECONDS = 0.03
+# regions quieter than this relative to the loudest frames count as silence
+SILENCE_DB = -35.0
+# gaps shorter than this are breaths, not breaks between lines
+MIN_GAP_SECONDS = 0.6
+MIN_REGION_SECONDS = 0.25
+# audio kept around each segment so words at the edges aren't clipped
+PAD_SECONDS = 1.0
+SEGMENT_CACHE = "alignment_segments.json"
+
+def voiced_regions(audio: np.ndarray, sample_rate: int = SAMPLE_RATE):
+    """(start, end) seconds of the parts of a vocals stem where someone is singing."""
+    hop = int(FRAME_SECONDS * sample_rate)
+    count = len(audio) // hop
+    if count == 0:
+        return []
+    frames = audio[:count * hop].reshape(count, hop)
+    rms = np.sqrt((frames.astype(np.float64) ** 2).mean(axis=1))
+    db = 20 * np.log10(rms + 1e-10)
+    # relative to a loud-but-not-peak reference so one clipped shout doesn't mute the rest
+    voiced = db > np.percentile(db, 95) + SILENCE_DB
+
+    regions = []
+    start = None
+    for i, is_voiced in enumerate(voiced):
+        if is_voiced and start is None:
+            start = i
+        elif not is_voiced and start is not None:
+            regions.append([start * FRAME_SECONDS, i * FRAME_SECONDS])
+            start = None
+    if start is not None:
+        regions.append([start * FRAME_SECONDS, count * FRAME_SECONDS])
+
+    merged = []
+    for region in regions:
+        if merged and region[0] - merged[-1][1] < MIN_GAP_SECONDS:
+            merged[-1][1] = region[1]
+        else:
+            merged.append(region)
+    return [(start, end) for start, end in merged if end - start >= MIN_REGION_SECONDS]
+
+def lyric_units(lyrics: str):
+    """Stanzas (blank-line separated) if the lyrics have them, otherwise single lines."""
+    stanzas, current = [], []
+    for line in lyrics.splitlines():
+        if line.strip():
+            current.append(line.strip())
+        elif current:
+            stanzas.append("\n".join(current))
+            current = []
+    if current:
+        stanzas.append("\n".join(current))
+    if len(stanzas) > 1:
+        return stanzas
+    return [line.strip() for line in lyrics.splitlines() if line.strip()]
+
+def _merge_units(units, count):
+    # fewer sung regions than units: join the neighbouring pair with the least text until they fit
+    units = list(units)
+    while len(units) > count:
+        i = min(range(len(units) - 1), key=lambda i: len(units[i]) + len(units[i + 1]))
+        units[i:i + 2] = [units[i] + "\n" + units[i + 1]]
+    return units
+
+def plan_segments(units, regions, duration):
+    """Split the regions into one contiguous group per unit, cutting at the longest gaps.
+    The cut points depend only on the audio, so editing a line's text doesn't move them."""
+    if not units or not regions:
+        return []
+    units = _merge_units(units, len(regions))
+    gaps = sorted(range(1, len(regions)), key=lambda i: regions[i][0] - regions[i - 1][1], reverse=True)
+    cuts = sorted(gaps[:len(units) - 1])
+
+    segments = []
+    bounds = [0, *cuts, len(regions)]
+    for text, first, last in zip(units, bounds, bounds[1:]):
+        segments.append({
+            "text": text,
+            "start": round(max(0.0, regions[first][0] - PAD_SECONDS), 2),
+            "end": round(min(duration, regions[last - 1][1] + PAD_SECONDS), 2),
+        })
+    return segments
+
+def _segment_key(segment, language_code, audio_path):
+    stat = os.stat(audio_path)
+    raw = f"{language_code}|{stat.st_size}|{stat.st_mtime_ns}|{segment['start']}|{segment['end']}|{segment['text']}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _load_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def align_segmented(audio_path, lyrics, language_code, align_model, metadata, device,
+                    workers=2, on_progress=None):
+    """Align lyrics segment by segment. Returns (word_segments, stats), or None if the
+    vocals have no usable sung regions and the caller should align the whole song instead."""
+    audio = whisperx.load_audio(audio_path)
+    duration = len(audio) / SAMPLE_RATE
+    segments = plan_segments(lyric_units(lyrics), voiced_regions(audio), duration)
+    if not segments:
+        return None
+
+    cache_path = os.path.join(os.path.dirname(audio_path), SEGMENT_CACHE)
+    cached = _load_cache(cache_path)
+    keys = [_segment_key(segment, language_code, audio_path) for segment in segments]
+    results = {key: cached[key] for key in keys if key in cached}
+    todo = [(key, segment) for key, segment in zip(keys, segments) if key not in results]
+
+    def align_one(segment):
+        # whisperx slices the audio to the segment itself and returns absolute times
+        return whisperx.align([segment], align_model, metadata, audio, device=device)["word_segments"]
+
+    if todo:
+        pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        try:
+            futures = {pool.submit(align_one, segment): key for key, segment in todo}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if on_progress is not None:
+                    on_progress(done, len(todo))
+                check_cancelled()
+        finally:
+            # on cancel or error, drop the segments that haven't started
+            pool.shutdown(cancel_futures=True)
+
+    # only keep the segments of the current lyrics, so the cache doesn't grow with every edit
+    write_atomic(cache_path, json.dumps({key: results[key] for key in keys}, ensure_ascii=False, separators=(",", ":")))
+
+    word_segments = [word for key in keys for word in results[key]]
+    stats = {"segments": len(segments), "realigned": len(todo)}
+    return word_segments, stats
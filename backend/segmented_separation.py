@@ -0,0 +1,250 @@
+import multiprocessing
+import os
+import threading
+import time
+import wave
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from separation import SeparationEngine
+from scheduler import check_cancelled
+from util import SEPARATION_MODEL, SEGMENT_SECONDS, SEGMENT_OVERLAP_SECONDS, SEPARATION_DEVICES, pick_device
+
+# Segmented separation for long recordings (30-90 min live sets).
+# The extracted WAV is cut into overlapping windows that are separated in parallel by
+# a pool of worker processes (one resident model each, on CPU or one GPU per worker)
+# and stitched back with a linear crossfade over the overlap. Only a few windows are
+# in flight at once and stems are written out as they are stitched, so peak memory
+# depends on the window size, not on the length of the track.
+# Progressive previews (progressive.py) use the same stitching with a short first
+# window, so the start of a new track can be played while the rest is separated.
+
+_pools = {}  # (model name, shifts) -> (executor, number of workers)
+_pool_lock = threading.Lock()
+_worker_engine = None
+
+def _init_worker(device_queue, cpu_threads, model_name, shifts):
+    global _worker_engine
+    device = device_queue.get()
+    if device == "cpu":
+        import torch
+        torch.set_num_threads(cpu_threads)
+    _worker_engine = SeparationEngine(model_name, device=device, shifts=shifts)
+    _worker_engine.load()
+
+def worker_devices():
+    if SEPARATION_DEVICES:
+        return SEPARATION_DEVICES
+    device = pick_device()
+    if device == "cuda":
+        import torch
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    # a couple of CPU workers with several threads each beats one huge one
+    return ["cpu"] * max(1, min(4, (os.cpu_count() or 2) // 2))
+
+def segment_pool(model_name=SEPARATION_MODEL, shifts=1):
+    """(pool, workers) for one model setting (a separation profile), started on first use."""
+    key = (model_name, shifts)
+    with _pool_lock:
+        if key not in _pools:
+            devices = worker_devices()
+            ctx = multiprocessing.get_context("spawn")
+            device_queue = ctx.Queue()
+            for device in devices:
+                device_queue.put(device)
+            cpu_threads = max(1, (os.cpu_count() or 1) // len(devices))
+            pool = ProcessPoolExecutor(max_workers=len(devices), mp_context=ctx, initializer=_init_worker,
+                                       initargs=(device_queue, cpu_threads, model_name, shifts))
+            _pools[key] = (pool, len(devices))
+        return _pools[key]
+
+def _discard_pool(key, pool):
+    """Forget a pool that broke (a worker died, e.g. out of memory), so the next
+    segment_pool() call starts a new one."""
+    with _pool_lock:
+        if _pools.get(key, (None,))[0] is pool:
+            del _pools[key]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def read_window(audio_path, start, length):
+    """Read `length` frames from a 16-bit PCM WAV as a float (channels, samples) tensor."""
+    with wave.open(audio_path, "rb") as w:
+        channels = w.getnchannels()
+        w.setpos(start)
+        frames = w.readframes(length)
+    data = np.frombuffer(frames, dtype="<i2").reshape(-1, channels).T.astype(np.float32) / 32768
+    import torch  # not at module level: the onnx path uses the numpy helpers here without torch
+    return torch.from_numpy(data)
+
+def _separate_window(audio_path, start, length, stats):
+    wav = read_window(audio_path, start, length)
+    vocals, no_vocals = _worker_engine.separate_tensor(wav, stats)
+    return vocals.numpy(), no_vocals.numpy()
+
+def _pooled_windows(audio_path, spans, stats, model_name, shifts):
+    """Separated windows in order, from the worker pool. If a worker dies the pool is
+    replaced and the windows that were in flight are run again, each at most once."""
+    key = (model_name, shifts)
+    pool, workers = segment_pool(*key)
+    pending = iter(spans)
+    in_flight = deque()  # (span, future)
+    retried = set()
+    while True:
+        # keep the pool busy but never hold more than a few windows in memory
+        while len(in_flight) < 2 * workers and (span := next(pending, None)) is not None:
+            in_flight.append((span, pool.submit(_separate_window, audio_path, *span, stats)))
+        if not in_flight:
+            return
+        span, future = in_flight[0]
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            _discard_pool(key, pool)
+            if span in retried:
+                raise
+            retried.add(span)
+            pool, workers = segment_pool(*key)
+            in_flight = deque((s, pool.submit(_separate_window, audio_path, *s, stats)) for s, _ in in_flight)
+            continue
+        in_flight.popleft()
+        yield result
+
+def _engine_windows(engine, audio_path, spans, stats):
+    """Separated windows in order, one at a time on an engine in this process."""
+    for start, length in spans:
+        vocals, no_vocals = engine.separate_tensor(read_window(audio_path, start, length), stats)
+        yield vocals.numpy(), no_vocals.numpy()
+
+def track_stats(audio_path, chunk_frames=2**20):
+    """Mean/std of the mono mix of the whole file, computed in chunks (what Demucs normalises by)."""
+    total, total_sq, count = 0.0, 0.0, 0
+    with wave.open(audio_path, "rb") as w:
+        channels = w.getnchannels()
+        while frames := w.readframes(chunk_frames):
+            mono = np.frombuffer(frames, dtype="<i2").reshape(-1, channels).mean(1) / 32768
+            total += mono.sum()
+            total_sq += (mono.astype(np.float64) ** 2).sum()
+            count += len(mono)
+    mean = total / count
+    std = max((total_sq / count - mean ** 2) ** 0.5, 1e-8)
+    return float(mean), float(std)
+
+def window_spans(total, segment, overlap, first=None):
+    """(start, length) of each window. Neighbours share `overlap` frames and the last one
+    reaches the end. first: length of a shorter first window, so the start is ready sooner."""
+    if segment <= overlap:
+        raise ValueError(f"Windows of {segment} frames can't overlap by {overlap}")
+    spans = []
+    start, length = 0, max(first or segment, 2 * overlap)
+    while True:
+        length = min(length, total - start)
+        spans.append((start, length))
+        if start + length >= total:
+            return spans
+        start, length = start + length - overlap, segment
+
+def _to_pcm(stem):
+    return (np.clip(stem, -1, 1) * 32767).astype("<i2").T.tobytes()
+
+class StemWriter:
+    """The vocals/no_vocals WAVs, written as separation goes. After each write() both files
+    are complete WAVs of everything so far (wave patches the header on every write, and
+    the data is flushed), so a partial track can be served while its stems grow."""
+
+    def __init__(self, paths, channels, rate):
+        self.rate = rate
+        self.frames = 0
+        self._files = [open(path, "wb") for path in paths]
+        self._writers = []
+        for f in self._files:
+            writer = wave.open(f, "wb")
+            writer.setnchannels(channels)
+            writer.setsampwidth(2)
+            writer.setframerate(rate)
+            self._writers.append(writer)
+
+    def write(self, stems):
+        for writer, f, stem in zip(self._writers, self._files, stems):
+            writer.writeframes(_to_pcm(stem))
+            f.flush()
+        self.frames += stems[0].shape[-1]
+
+    @property
+    def seconds(self):
+        return self.frames / self.rate
+
+    def close(self):
+        for writer in self._writers:
+            writer.close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def audio_frames(audio_path):
+    with wave.open(audio_path, "rb") as w:
+        return w.getnframes(), w.getframerate()
+
+def separate_file_segmented(audio_path, vocals_path, no_vocals_path,
+                            segment_seconds=SEGMENT_SECONDS, overlap_seconds=SEGMENT_OVERLAP_SECONDS, on_progress=None,
+                            engine=None, first_segment_seconds=None, on_written=None,
+                            model_name=SEPARATION_MODEL, shifts=1):
+    """Same contract as SeparationEngine.separate_file, for long tracks.
+    on_progress(fraction_done) is called after each window is written, on_written(seconds)
+    with how much of the stems is on disk. With an engine, windows are separated one at a
+    time by it, in this process, instead of by the pool (progressive previews of ordinary
+    length tracks, which aren't worth the pool's extra model copies). model_name/shifts: the
+    profile's model settings for the pool workers."""
+    timings = {}
+    total, rate = audio_frames(audio_path)
+    segment = int(segment_seconds * rate)
+    overlap = int(overlap_seconds * rate)
+    first = int(first_segment_seconds * rate) if first_segment_seconds else None
+
+    start_time = time.perf_counter()
+    stats = track_stats(audio_path)
+    timings["load_audio"] = time.perf_counter() - start_time
+
+    spans = window_spans(total, segment, overlap, first)
+    if engine is None:
+        windows = _pooled_windows(audio_path, spans, stats, model_name, shifts)
+    else:
+        windows = _engine_windows(engine, audio_path, spans, stats)
+    prev_tail = None
+    fade_in = np.linspace(0, 1, overlap, dtype=np.float32)
+
+    start_time = time.perf_counter()
+    with StemWriter((vocals_path, no_vocals_path), 2, rate) as out:
+        for written, stems in enumerate(windows, 1):
+            stems = list(stems)
+            is_last = written == len(spans)
+
+            if prev_tail is not None:
+                for i, stem in enumerate(stems):
+                    stem[:, :overlap] = stem[:, :overlap] * fade_in + prev_tail[i] * (1 - fade_in)
+
+            if is_last or overlap == 0:
+                prev_tail = None
+                bodies = stems
+            else:
+                prev_tail = [stem[:, -overlap:].copy() for stem in stems]
+                bodies = [stem[:, :-overlap] for stem in stems]
+
+            out.write(bodies)
+            check_cancelled()  # between windows, so a cancelled job frees the device early
+            if on_progress is not None:
+                on_progress(written / len(spans))
+            if on_written is not None:
+                on_written(out.seconds)
+
+    timings["separate"] = time.perf_counter() - start_time
+    timings["write_stems"] = 0.0  # written while stitching
+    timings["audio_seconds"] = total / rate
+    timings["segments"] = len(spans)
+    return timings
@@ -0,0 +1,109 @@
+import threading
+import time
+from typing import TYPE_CHECKING
+from util import SEPARATION_MODEL, SEPARATION_PROFILES, DEFAULT_SEPARATION_PROFILE, pick_device
+from metrics import MODEL_LOAD_SECONDS
+
+if TYPE_CHECKING:
+    import torch  # annotations only; the real import waits for the first separation
+
+# Resident Demucs engine. The model (htdemucs_ft is a bag of 4 models) is loaded
+# once and kept on the device, instead of paying interpreter startup + torch import
+# + model load on every upload by shelling out to `python -m demucs`.
+# torch and demucs are imported on first use, so importing this module (the server
+# does, for preloading) stays cheap.
+
+class SeparationEngine:
+    backend = "torch"
+
+    def __init__(self, model_name: str = SEPARATION_MODEL, device: str = None, shifts: int = 1):
+        self.model_name = model_name
+        self.device = device or pick_device()
+        self.shifts = shifts
+        self.model = None
+        self.load_seconds = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self.model is None:
+                start = time.perf_counter()
+                from demucs.pretrained import get_model
+                model = get_model(self.model_name)
+                model.to(self.device)
+                model.eval()
+                self.model = model
+                self.load_seconds = time.perf_counter() - start
+                MODEL_LOAD_SECONDS.observe(self.load_seconds, kind="separation", model=self.model_name)
+                print(f"Loaded {self.model_name} on {self.device} in {self.load_seconds:.1f}s")
+        return self.model
+
+    def separate_tensor(self, wav: "torch.Tensor", stats=None):
+        """Split a (channels, samples) tensor at the model's sample rate into (vocals, no_vocals).
+        stats: (mean, std) of the whole track when wav is only a window of it."""
+        import torch
+        from demucs.apply import apply_model
+        model = self.load()
+
+        # same normalisation the demucs CLI does
+        if stats is None:
+            ref = wav.mean(0)
+            mean, std = ref.mean(), ref.std()
+        else:
+            mean, std = stats
+        wav = (wav - mean) / std
+
+        with torch.no_grad():
+            sources = apply_model(model, wav[None], device=self.device, shifts=self.shifts, split=True,
+                                  overlap=0.25, progress=False)[0]
+        sources = sources * std + mean
+
+        vocals_idx = model.sources.index("vocals")
+        vocals = sources[vocals_idx]
+        # --two-stems vocals: everything else summed into one stem
+        no_vocals = sources.sum(0) - vocals
+        return vocals.cpu(), no_vocals.cpu()
+
+    def separate_file(self, audio_path: str, vocals_path: str, no_vocals_path: str):
+        """Separate an audio file on disk and write both stems. Returns per-stage timings in seconds."""
+        from demucs.audio import save_audio
+        from demucs.separate import load_track
+        timings = {}
+        model = self.load()
+
+        start = time.perf_counter()
+        wav = load_track(audio_path, model.audio_channels, model.samplerate)
+        timings["load_audio"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vocals, no_vocals = self.separate_tensor(wav)
+        timings["separate"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        save_audio(vocals, vocals_path, samplerate=model.samplerate)
+        save_audio(no_vocals, no_vocals_path, samplerate=model.samplerate)
+        timings["write_stems"] = time.perf_counter() - start
+
+        timings["audio_seconds"] = wav.shape[-1] / model.samplerate
+        return timings
+
+_engines = {}  # profile name -> engine
+_engine_lock = threading.Lock()
+
+def get_engine(profile: str = None):
+    """The resident engine for a separation profile (see SEPARATION_PROFILES)."""
+    profile = profile or DEFAULT_SEPARATION_PROFILE
+    if profile not in SEPARATION_PROFILES:
+        raise ValueError(f"Unknown separation profile: {profile}")
+    with _engine_lock:
+        if profile not in _engines:
+            settings = SEPARATION_PROFILES[profile]
+            if settings["backend"] == "onnx":
+                from separation_onnx import OnnxSeparationEngine
+                _engines[profile] = OnnxSeparationEngine(settings["model"], settings["precision"], settings["shifts"])
+            else:
+                _engines[profile] = SeparationEngine(settings["model"], shifts=settings["shifts"])
+        return _engines[profile]
+
+def preload():
+    get_engine().load()
@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+import wave
+import numpy as np
+from util import ONNX_MODEL_DIR, ONNX_THREADS
+from segmented_separation import StemWriter, track_stats, audio_frames
+from metrics import MODEL_LOAD_SECONDS
+from scheduler import check_cancelled
+
+# Demucs exported to ONNX (export_onnx.py), run by onnxruntime on CPU, for machines
+# without a GPU where PyTorch Demucs is slow. The exported graph takes one fixed length
+# window (1, channels, samples) and returns (1, sources, channels, samples). The file
+# is read window by window with 25% overlap. Windows are blended with the triangular
+# weights demucs.apply uses, and stems are written out as soon as no later window can
+# touch them. Memory stays at a few windows however long the recording is.
+
+OVERLAP = 0.25
+
+def _window_weight(segment):
+    # same transition weights as demucs.apply.apply_model
+    weight = np.concatenate([np.arange(1, segment // 2 + 1), np.arange(segment - segment // 2, 0, -1)])
+    return (weight / weight.max()).astype(np.float32)
+
+def _read_frames(wav_file, start, length, total):
+    """`length` frames from `start` as float (channels, length), zero padded outside the file."""
+    channels = wav_file.getnchannels()
+    out = np.zeros((channels, length), dtype=np.float32)
+    lo, hi = max(start, 0), min(start + length, total)
+    if hi > lo:
+        wav_file.setpos(lo)
+        data = np.frombuffer(wav_file.readframes(hi - lo), dtype="<i2").reshape(-1, channels).T
+        out[:, lo - start:hi - start] = data / 32768
+    return out
+
+class OnnxSeparationEngine:
+    backend = "onnx"
+
+    def __init__(self, model_name: str, precision: str = "fp32", shifts: int = 1, threads: int = ONNX_THREADS):
+        self.model_name = model_name
+        self.precision = precision
+        self.shifts = shifts
+        self.threads = threads
+        suffix = ".int8.onnx" if precision == "int8" else ".onnx"
+        self.model_path = os.path.join(ONNX_MODEL_DIR, model_name + suffix)
+        self.session = None
+        self.load_seconds = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self.session is None:
+                if not os.path.isfile(self.model_path):
+                    raise FileNotFoundError(f"ONNX model not found: {self.model_path}. "
+                                            f"Export it with `python export_onnx.py --model {self.model_name}`")
+                import onnxruntime as ort
+                start = time.perf_counter()
+                with open(os.path.join(ONNX_MODEL_DIR, f"{self.model_name}.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                self.sources = meta["sources"]
+                self.samplerate = meta["samplerate"]
+                self.channels = meta["channels"]
+                self.segment = meta["segment"]
+
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = self.threads  # 0 = onnxruntime picks (one per core)
+                options.inter_op_num_threads = 1
+                options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+                self.input_name = session.get_inputs()[0].name
+                self.session = session
+                self.load_seconds = time.perf_counter() - start
+                MODEL_LOAD_SECONDS.observe(self.load_seconds, kind="separation",
+                                           model=f"{self.model_name}-onnx-{self.precision}")
+                print(f"Loaded {self.model_path} in {self.load_seconds:.1f}s")
+        return self.session
+
+    def separate_window(self, window):
+        """(channels, segment) normalised audio -> (vocals, no_vocals), each (channels, segment)."""
+        sources = self.session.run(None, {self.input_name: window[None]})[0][0]
+        vocals = sources[self.sources.index("vocals")]
+        # --two-stems vocals: everything else summed into one stem
+        return vocals, sources.sum(0) - vocals
+
+    def separate_file(self, audio_path: str, vocals_path: str, no_vocals_path: str, on_progress=None,
+                      on_written=None):
+        """Same contract as SeparationEngine.separate_file, for a 16-bit PCM WAV at the model's
+        sample rate (what media.extract_audio writes). on_progress(fraction) after each window,
+        on_written(seconds) whenever more of the stems is on disk."""
+        timings = {}
+        self.load()
+        total, rate = audio_frames(audio_path)
+        if rate != self.samplerate:
+            raise ValueError(f"{audio_path} is {rate} Hz, {self.model_name} expects {self.samplerate} Hz")
+
+        start_time = time.perf_counter()
+        mean, std = track_stats(audio_path)
+        timings["load_audio"] = time.perf_counter() - start_time
+
+        segment = self.segment
+        step = int(segment * (1 - OVERLAP))
+        # with shifts > 1, more grids of windows offset by a fraction of the step, averaged
+        grids = max(1, self.shifts)
+        starts = sorted(start for grid in range(grids) for start in range(-(grid * step // grids), total, step))
+        weight = _window_weight(segment)
+
+        # running sums for frames [base, base + acc.shape[-1]) that later windows may still add to
+        acc = np.zeros((2, self.channels, 0), dtype=np.float32)
+        weight_sum = np.zeros(0, dtype=np.float32)
+        base = 0
+
+        start_time = time.perf_counter()
+        with wave.open(audio_path, "rb") as src, StemWriter((vocals_path, no_vocals_path), self.channels, rate) as out:
+            if src.getnchannels() != self.channels:
+                raise ValueError(f"{audio_path} has {src.getnchannels()} channels, expected {self.channels}")
+
+            for i, start in enumerate(starts):
+                window = (_read_frames(src, start, segment, total) - mean) / std
+                stems = np.stack(self.separate_window(window)) * std + mean
+
+                lo, hi = max(start, base), min(start + segment, total)
+                if hi - base > acc.shape[-1]:
+                    grow = hi - base - acc.shape[-1]
+                    acc = np.concatenate([acc, np.zeros((*acc.shape[:2], grow), dtype=np.float32)], axis=-1)
+                    weight_sum = np.concatenate([weight_sum, np.zeros(grow, dtype=np.float32)])
+                acc[:, :, lo - base:hi - base] += stems[:, :, lo - start:hi - start] * weight[lo - start:hi - start]
+                weight_sum[lo - base:hi - base] += weight[lo - start:hi - start]
+
+                # nothing before the next window's start changes any more
+                done_to = min(starts[i + 1], total) if i + 1 < len(starts) else total
+                if done_to > base:
+                    out.write(acc[:, :, :done_to - base] / weight_sum[:done_to - base])
+                    acc, weight_sum = acc[:, :, done_to - base:], weight_sum[done_to - base:]
+                    base = done_to
+                    if on_written is not None:
+                        on_written(out.seconds)
+                check_cancelled()
+                if on_progress is not None:
+                    on_progress((i + 1) / len(starts))
+
+        timings["separate"] = time.perf_counter() - start_time
+        timings["write_stems"] = 0.0  # written while blending
+        timings["audio_seconds"] = total / rate
+        timings["windows"] = len(starts)
+        return timings
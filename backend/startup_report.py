@@ -0,0 +1,73 @@
+"""Where backend startup time goes.
+
+    python startup_report.py                          # what `uvicorn main:app` imports
+    python startup_report.py --module audio_processing --top 30
+
+Imports the module in a fresh interpreter with `-X importtime` and prints the total
+plus the packages that took longest (their own time, summed over submodules). For
+main it also checks the HTTP side stays light: exit code 1 if it pulled in any of
+HEAVY_PACKAGES (they belong to the first job or the model preload threads) or took
+longer than --budget seconds.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+HEAVY_PACKAGES = ("torch", "torchaudio", "demucs", "whisperx", "transformers", "onnxruntime", "numpy", "av")
+
+# "import time:       412 |       1203 |   torch.cuda" (microseconds, indent = nesting)
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\S.*)$")
+
+def import_times(module):
+    """Import `module` in a child interpreter. Returns (wall seconds, {module name: own seconds})."""
+    backend = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [backend, os.environ.get("PYTHONPATH")]))}
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    own = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            own[match.group(3).strip()] = int(match.group(1)) / 1e6
+    return float(result.stdout.strip().splitlines()[-1]), own
+
+def by_package(own):
+    totals = defaultdict(float)
+    for name, seconds in own.items():
+        totals[name.split(".")[0]] += seconds
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds main may take to import")
+    args = parser.parse_args()
+
+    wall, own = import_times(args.module)
+    packages = by_package(own)
+    print(f"import {args.module}: {wall:.3f}s, {len(own)} modules")
+    for package, seconds in packages[:args.top]:
+        print(f"  {seconds * 1000:9.1f} ms  {package}")
+
+    if args.module != "main":
+        return
+    heavy = sorted(package for package, _ in packages if package in HEAVY_PACKAGES)
+    problems = []
+    if heavy:
+        problems.append(f"main imports {', '.join(heavy)} at startup")
+    if wall > args.budget:
+        problems.append(f"main took {wall:.2f}s to import (budget {args.budget:.2f}s)")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
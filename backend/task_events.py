@@ -0,0 +1,64 @@
+import asyncio
+import json
+from collections import defaultdict
+from task_store import FINISHED_STATUSES
+
+# Push task updates to clients over Server-Sent Events instead of making them poll
+# /status. Job threads call notify() whenever they change a task; open streams wake
+# up at once. Updates written by another worker process aren't seen by notify(), so
+# streams also re-read the store every POLL_INTERVAL as a fallback.
+
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 15.0
+
+class TaskEvents:
+    def __init__(self):
+        self._loop = None
+        self._waiters = defaultdict(set)  # task_id -> asyncio.Events of open streams
+
+    def bind(self, loop):
+        self._loop = loop
+
+    def notify(self, task_id: str):
+        """Thread safe: wake every stream following this task."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake, task_id)
+
+    def _wake(self, task_id):
+        for event in self._waiters.get(task_id, ()):
+            event.set()
+
+    async def stream(self, task_id: str, get_state):
+        """Yield SSE frames with the task state each time it changes, until it finishes."""
+        event = asyncio.Event()
+        self._waiters[task_id].add(event)
+        last_sent = None
+        idle = 0.0
+        try:
+            while True:
+                state = get_state(task_id)
+                if state is None:
+                    yield "event: error\ndata: {\"detail\": \"Task not found\"}\n\n"
+                    return
+                if state != last_sent:
+                    yield f"event: status\ndata: {json.dumps(state)}\n\n"
+                    last_sent = state
+                    idle = 0.0
+                if state["status"] in FINISHED_STATUSES:
+                    return
+
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    idle += POLL_INTERVAL
+                    if idle >= HEARTBEAT_INTERVAL:
+                        # keeps proxies from closing a quiet connection during a long separation
+                        yield ": heartbeat\n\n"
+                        idle = 0.0
+        finally:
+            self._waiters[task_id].discard(event)
+            if not self._waiters[task_id]:
+                del self._waiters[task_id]
+
+task_events = TaskEvents()
@@ -0,0 +1,282 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# Where task state lives. The API, the scheduler threads and (with several uvicorn
+# workers) other processes all read and write through one of these stores.
+#   "memory"                    -> plain dict, single process only
+#   "sqlite:///path/to/tasks.db" -> shared file, survives restarts (default)
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+ACTIVE_STATUSES = ("queued", "processing", "cancelling")
+
+# identifies this process so a restarted server can tell its own dead tasks from a live sibling's
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+class TaskStore:
+    """Interface every backend implements. Task state is a dict with at least "status" and "message";
+    anything else (queue position, timings, ...) is stored alongside it."""
+
+    # called with the task_id after every change this process makes (used to push live updates)
+    on_change = None
+
+    def _changed(self, task_id):
+        if self.on_change is not None:
+            self.on_change(task_id)
+
+    def create(self, task_id: str, status: str, message: str = "", **extra):
+        raise NotImplementedError
+
+    def get(self, task_id: str):
+        raise NotImplementedError
+
+    def update(self, task_id: str, status: str = None, message: str = None, **extra):
+        raise NotImplementedError
+
+    def transition(self, task_id: str, from_statuses, status: str, message: str = None, **extra) -> bool:
+        """Atomically move a task to `status` only if it's currently in one of `from_statuses`."""
+        raise NotImplementedError
+
+    def delete(self, task_id: str):
+        raise NotImplementedError
+
+    def list(self, status: str = None, since: float = None, limit: int = 100):
+        raise NotImplementedError
+
+    def evict_finished(self, ttl_seconds: float) -> int:
+        raise NotImplementedError
+
+    def request_cancel(self, task_id: str):
+        raise NotImplementedError
+
+    def cancel_requested(self, task_id: str) -> bool:
+        raise NotImplementedError
+
+    def recover_orphans(self) -> int:
+        """Fail tasks left active by a process that no longer exists (e.g. after a restart)."""
+        raise NotImplementedError
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+def _owner_alive(owner: str) -> bool:
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True  # can't tell from here, leave it alone
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError, OSError):
+        return True
+    return True
+
+class MemoryTaskStore(TaskStore):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def create(self, task_id, status, message="", **extra):
+        now = time.time()
+        with self._lock:
+            self._tasks[task_id] = {
+                "state": {"status": status, "message": message, **extra},
+                "created_at": now, "updated_at": now, "owner": OWNER, "cancel": False,
+            }
+        self._changed(task_id)
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._tasks.get(task_id)
+            return dict(row["state"]) if row else None
+
+    def update(self, task_id, status=None, message=None, **extra):
+        with self._lock:
+            row = self._tasks.get(task_id)
+            if row is None:
+                return
+            self._apply(row, status, message, extra)
+        self._changed(task_id)
+
+    def transition(self, task_id, from_statuses, status, message=None, **extra):
+        with self._lock:
+            row = self._tasks.get(task_id)
+            if row is None or row["state"]["status"] not in from_statuses:
+                return False
+            self._apply(row, status, message, extra)
+        self._changed(task_id)
+        return True
+
+    def _apply(self, row, status, message, extra):
+        if status is not None:
+            row["state"]["status"] = status
+        if message is not None:
+            row["state"]["message"] = message
+        row["state"].update(extra)
+        row["updated_at"] = time.time()
+
+    def delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def list(self, status=None, since=None, limit=100):
+        with self._lock:
+            rows = [(tid, r) for tid, r in self._tasks.items()
+                    if (status is None or r["state"]["status"] == status)
+                    and (since is None or r["created_at"] >= since)]
+        rows.sort(key=lambda item: item[1]["created_at"], reverse=True)
+        return [{"task_id": tid, "created_at": r["created_at"], **r["state"]} for tid, r in rows[:limit]]
+
+    def evict_finished(self, ttl_seconds):
+        cutoff = time.time() - ttl_seconds
+        with self._lock:
+            stale = [tid for tid, r in self._tasks.items()
+                     if r["state"]["status"] in FINISHED_STATUSES and r["updated_at"] < cutoff]
+            for tid in stale:
+                del self._tasks[tid]
+        return len(stale)
+
+    def request_cancel(self, task_id):
+        with self._lock:
+            if task_id in self._tasks:
+                self._tasks[task_id]["cancel"] = True
+
+    def cancel_requested(self, task_id):
+        with self._lock:
+            row = self._tasks.get(task_id)
+            return bool(row and row["cancel"])
+
+    def recover_orphans(self):
+        return 0  # nothing survives a restart in memory
+
+class SQLiteTaskStore(TaskStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id    TEXT PRIMARY KEY,
+                    status     TEXT NOT NULL,
+                    message    TEXT NOT NULL DEFAULT '',
+                    extra      TEXT NOT NULL DEFAULT '{}',
+                    owner      TEXT NOT NULL,
+                    cancel     INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, updated_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at)")
+
+    def _conn(self):
+        # one connection per thread; WAL lets several uvicorn workers read while one writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_state(row):
+        return {"status": row["status"], "message": row["message"], **json.loads(row["extra"])}
+
+    def create(self, task_id, status, message="", **extra):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO tasks (task_id, status, message, extra, owner, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, status, message, json.dumps(extra), OWNER, now, now))
+        self._changed(task_id)
+
+    def get(self, task_id):
+        row = self._conn().execute(
+            "SELECT status, message, extra FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return self._to_state(row) if row else None
+
+    def update(self, task_id, status=None, message=None, **extra):
+        self.transition(task_id, None, status, message, **extra)
+
+    def transition(self, task_id, from_statuses, status, message=None, **extra):
+        conn = self._conn()
+        # BEGIN IMMEDIATE takes the write lock up front so the read-check-write can't interleave
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT status, message, extra FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None or (from_statuses is not None and row["status"] not in from_statuses):
+                conn.execute("ROLLBACK")
+                return False
+
+            merged = json.loads(row["extra"])
+            merged.update(extra)
+            conn.execute(
+                "UPDATE tasks SET status = ?, message = ?, extra = ?, updated_at = ? WHERE task_id = ?",
+                (status if status is not None else row["status"],
+                 message if message is not None else row["message"],
+                 json.dumps(merged), time.time(), task_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._changed(task_id)
+        return True
+
+    def delete(self, task_id):
+        self._conn().execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def list(self, status=None, since=None, limit=100):
+        query = "SELECT task_id, status, message, extra, created_at FROM tasks WHERE 1=1"
+        params = []
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if since is not None:
+            query += " AND created_at >= ?"
+            params.append(since)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        rows = self._conn().execute(query, params).fetchall()
+        return [{"task_id": r["task_id"], "created_at": r["created_at"], **self._to_state(r)} for r in rows]
+
+    def evict_finished(self, ttl_seconds):
+        cutoff = time.time() - ttl_seconds
+        placeholders = ",".join("?" * len(FINISHED_STATUSES))
+        cur = self._conn().execute(
+            f"DELETE FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?",
+            (*FINISHED_STATUSES, cutoff))
+        return cur.rowcount
+
+    def request_cancel(self, task_id):
+        self._conn().execute("UPDATE tasks SET cancel = 1 WHERE task_id = ?", (task_id,))
+
+    def cancel_requested(self, task_id):
+        row = self._conn().execute("SELECT cancel FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return bool(row and row["cancel"])
+
+    def recover_orphans(self):
+        placeholders = ",".join("?" * len(ACTIVE_STATUSES))
+        rows = self._conn().execute(
+            f"SELECT task_id, owner FROM tasks WHERE status IN ({placeholders})", ACTIVE_STATUSES).fetchall()
+        recovered = 0
+        for row in rows:
+            if row["owner"] != OWNER and not _owner_alive(row["owner"]):
+                if self.transition(row["task_id"], ACTIVE_STATUSES, "failed",
+                                   "Server restarted before this task finished. Please resubmit."):
+                    recovered += 1
+        return recovered
+
+def make_task_store(url: str) -> TaskStore:
+    if url == "memory":
+        return MemoryTaskStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteTaskStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unknown task store: {url}")
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from util import UPLOAD_DIR, MAX_UPLOAD_BYTES
+
+# Resumable uploads. The client opens a session, PUTs the file in chunks at
+# increasing offsets and then completes it. State is just two files on disk
+# (<id>.part and <id>.json), so any worker process can take the next chunk and a
+# dropped connection resumes from the last byte the server has.
+
+SESSION_DIR = os.path.join(UPLOAD_DIR, "sessions")
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _meta_path(upload_id):
+    return os.path.join(SESSION_DIR, f"{upload_id}.json")
+
+def part_path(upload_id):
+    return os.path.join(SESSION_DIR, f"{upload_id}.part")
+
+def _check_id(upload_id):
+    try:
+        uuid.UUID(upload_id)
+    except ValueError:
+        raise UploadError(404, "Upload not found")
+
+def create_session(filename: str, size: int):
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadError(413, f"File is larger than the {MAX_UPLOAD_BYTES} byte limit")
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    upload_id = str(uuid.uuid4())
+    meta = {"upload_id": upload_id, "filename": os.path.basename(filename), "size": size}
+    with open(_meta_path(upload_id), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    open(part_path(upload_id), "wb").close()
+    return session_info(upload_id)
+
+def session_info(upload_id: str):
+    _check_id(upload_id)
+    try:
+        with open(_meta_path(upload_id), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        raise UploadError(404, "Upload not found")
+    meta["received"] = os.path.getsize(part_path(upload_id))
+    return meta
+
+async def write_chunk(upload_id: str, offset: int, stream):
+    """Append the request body stream at `offset`. The offset must match what the server already
+    has (or be earlier, when a client re-sends a chunk it isn't sure arrived)."""
+    meta = session_info(upload_id)
+    if offset > meta["received"]:
+        raise UploadError(409, f"Expected offset <= {meta['received']}, got {offset}")
+
+    written = offset
+    with open(part_path(upload_id), "r+b") as f:
+        f.seek(offset)
+        f.truncate()
+        async for chunk in stream:
+            written += len(chunk)
+            if written > meta["size"]:
+                raise UploadError(413, "More data than the size given when the upload was created")
+            f.write(chunk)
+    return written
+
+def finish_session(upload_id: str):
+    """Check the upload is complete and return (path of the assembled file, original filename, sha256)."""
+    meta = session_info(upload_id)
+    if meta["received"] != meta["size"]:
+        raise UploadError(409, f"Upload incomplete: {meta['received']} of {meta['size']} bytes")
+    os.remove(_meta_path(upload_id))
+    # chunks can be re-sent and arrive at any worker, so the hash is taken once at the end
+    return part_path(upload_id), meta["filename"], hash_file(part_path(upload_id))
+
+def hash_file(path: str, chunk_size: int = 2**20):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+async def save_stream(upload_file, dest_path: str, chunk_size: int):
+    """Copy an UploadFile to disk in fixed-size chunks instead of reading it into memory.
+    Returns the sha256 of the content, computed on the way through."""
+    total = 0
+    hasher = hashlib.sha256()
+    with open(dest_path, "wb") as f:
+        while chunk := await upload_file.read(chunk_size):
+            total += len(chunk)
+            if total > MAX_UPLOAD_BYTES:
+                raise UploadError(413, f"File is larger than the {MAX_UPLOAD_BYTES} byte limit")
+            hasher.update(chunk)
+            f.write(chunk)
+    return hasher.hexdigest()
+
+def evict_stale_sessions(max_age_seconds: float):
+    """Drop sessions nobody has written to for a while (client gave up)."""
+    if not os.path.isdir(SESSION_DIR):
+        return 0
+    cutoff = time.time() - max_age_seconds
+    evicted = 0
+    for name in os.listdir(SESSION_DIR):
+        if not name.endswith(".json"):
+            continue
+        meta, part = os.path.join(SESSION_DIR, name), part_path(name[:-5])
+        last_write = os.path.getmtime(part if os.path.exists(part) else meta)
+        if last_write < cutoff:
+            for stale in (meta, part):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            evicted += 1
+    return evicted
@@ -1 +1,102 @@
+import os
+from functools import cache
+
 TRACK_ROOT = "karaoke_output"
+
+# Each track folder holds video.mp4 plus these stems, as <stem>.<format> in one or more formats
+STEMS = ("vocals", "no_vocals")
+# stem formats we can store, in the order we fall back to them when serving
+STEM_MEDIA_TYPES = {
+    "opus": "audio/ogg",
+    "flac": "audio/flac",
+    "wav": "audio/wav",
+}
+# compressed copies made after separation, and whether the original WAVs are kept
+STEM_FORMATS = [fmt for fmt in os.environ.get("KARAOKE_STEM_FORMATS", "flac,opus").split(",") if fmt]
+KEEP_WAV_STEMS = os.environ.get("KARAOKE_KEEP_WAV", "0") == "1"
+
+# Each job builds its track folder here and renames it into TRACK_ROOT when done. Point it
+# at tmpfs or a fast local disk to keep scratch I/O off the library disk (finished files
+# are then copied over once instead of renamed)
+SCRATCH_DIR = os.environ.get("KARAOKE_SCRATCH_DIR", os.path.join(TRACK_ROOT, ".scratch"))
+
+# Job scheduling. Slots = how many jobs may run at once on each device.
+JOB_SLOTS = {
+    "cuda": int(os.environ.get("KARAOKE_CUDA_SLOTS", "1")),
+    "cpu": int(os.environ.get("KARAOKE_CPU_SLOTS", "1")),
+}
+MAX_QUEUED_JOBS = int(os.environ.get("KARAOKE_MAX_QUEUED_JOBS", "50"))
+
+# Distributed mode: with a queue URL ("sqlite:///<path>") the API only enqueues jobs and
+# separate `python worker.py` processes run them. Empty = run jobs inside the API process.
+JOB_QUEUE_URL = os.environ.get("KARAOKE_JOB_QUEUE", "")
+# a worker renews its lease on a running job every third of this; a job whose lease runs
+# out (worker died) is retried elsewhere, up to JOB_MAX_ATTEMPTS claims in total
+JOB_LEASE_SECONDS = float(os.environ.get("KARAOKE_JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("KARAOKE_JOB_MAX_ATTEMPTS", "3"))
+
+# processes for CPU heavy ffmpeg work (video remux/re-encode) that runs alongside separation
+VIDEO_WORKERS = int(os.environ.get("KARAOKE_VIDEO_WORKERS", "2"))
+
+# Uploads are streamed to disk in chunks of this size; bigger files are rejected
+UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_BYTES = int(os.environ.get("KARAOKE_UPLOAD_CHUNK_MB", "8")) * 2**20
+MAX_UPLOAD_BYTES = int(os.environ.get("KARAOKE_MAX_UPLOAD_GB", "20")) * 2**30
+
+# Content-addressed cache of finished outputs, so re-uploading the same video is instant
+DEDUP_CACHE = os.environ.get("KARAOKE_DEDUP_CACHE", "1") == "1"
+CACHE_DIR = "karaoke_cache"
+CACHE_BUDGET_BYTES = int(os.environ.get("KARAOKE_CACHE_BUDGET_GB", "50")) * 2**30
+
+# Library index behind /tracks
+CATALOG_DB = os.environ.get("KARAOKE_CATALOG_DB", "karaoke_catalog.db")
+
+# Task state backend: "sqlite:///<path>" (default) or "memory"
+TASK_STORE_URL = os.environ.get("KARAOKE_TASK_STORE", "sqlite:///karaoke_tasks.db")
+# finished/failed tasks are forgotten after this many seconds
+FINISHED_TASK_TTL = float(os.environ.get("KARAOKE_FINISHED_TASK_TTL", str(24 * 3600)))
+
+# Demucs model kept resident in the backend process
+SEPARATION_MODEL = os.environ.get("KARAOKE_SEPARATION_MODEL", "htdemucs_ft")
+
+# tracks longer than this are separated in overlapping windows across a worker pool (0 = never)
+SEGMENTED_MIN_MINUTES = float(os.environ.get("KARAOKE_SEGMENTED_MIN_MINUTES", "20"))
+SEGMENT_SECONDS = float(os.environ.get("KARAOKE_SEGMENT_SECONDS", "60"))
+SEGMENT_OVERLAP_SECONDS = float(os.environ.get("KARAOKE_SEGMENT_OVERLAP_SECONDS", "5"))
+if SEGMENT_SECONDS <= SEGMENT_OVERLAP_SECONDS:
+    raise ValueError("KARAOKE_SEGMENT_SECONDS must be longer than KARAOKE_SEGMENT_OVERLAP_SECONDS")
+# new tracks are listed (as partial) once this much is separated, and their stems keep
+# growing while the rest is; 0 = only list tracks when they're finished
+PREVIEW_SECONDS = float(os.environ.get("KARAOKE_PREVIEW_SECONDS", "20"))
+# one segment worker per entry, e.g. "cuda:0,cuda:1" or "cpu,cpu,cpu". Empty = pick automatically
+SEPARATION_DEVICES = [d for d in os.environ.get("KARAOKE_SEPARATION_DEVICES", "").split(",") if d]
+# load it when the server starts instead of on the first upload
+PRELOAD_MODELS = os.environ.get("KARAOKE_PRELOAD_MODELS", "1") == "1"
+
+# Separation profiles, chosen per upload with ?profile= (default KARAOKE_SEPARATION_PROFILE).
+# "torch" runs the resident Demucs model (on the GPU if there is one); "onnx" runs a model
+# exported with export_onnx.py through onnxruntime on CPU, optionally int8 quantised.
+# shifts: passes over differently offset windows, averaged (more = slower, slightly better)
+SEPARATION_PROFILES = {
+    "quality": {"backend": "torch", "model": SEPARATION_MODEL, "shifts": 1},
+    "balanced": {"backend": "onnx", "model": "htdemucs", "precision": "fp32", "shifts": 1},
+    "fast": {"backend": "onnx", "model": "htdemucs", "precision": "int8", "shifts": 1},
+}
+DEFAULT_SEPARATION_PROFILE = os.environ.get("KARAOKE_SEPARATION_PROFILE", "quality")
+# exported models: <dir>/<model>.onnx, <model>.int8.onnx and <model>.json
+ONNX_MODEL_DIR = os.environ.get("KARAOKE_ONNX_MODEL_DIR", "models")
+# onnxruntime threads per separation (0 = one per core)
+ONNX_THREADS = int(os.environ.get("KARAOKE_ONNX_THREADS", "0"))
+
+# alignment models cached per (language, device), dropped LRU past this budget
+ALIGN_CACHE_MB = int(os.environ.get("KARAOKE_ALIGN_CACHE_MB", "2048"))
+# comma separated language codes to load at startup, e.g. "en,ja"
+ALIGN_PRELOAD_LANGUAGES = [lang for lang in os.environ.get("KARAOKE_ALIGN_PRELOAD", "en").split(",") if lang]
+# align lyrics stanza by stanza over the sung regions of the vocals, this many segments at once
+SEGMENTED_ALIGNMENT = os.environ.get("KARAOKE_SEGMENTED_ALIGNMENT", "1") == "1"
+ALIGN_WORKERS = int(os.environ.get("KARAOKE_ALIGN_WORKERS", "2"))
+
+@cache
+def pick_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
@@ -0,0 +1,123 @@
+"""Processing worker for distributed mode.
+
+    cd /mnt/karaoke && KARAOKE_JOB_QUEUE=sqlite:///karaoke_jobs.db python /opt/karaoke/backend/worker.py
+
+Claims the jobs the API put in KARAOKE_JOB_QUEUE, runs them on this machine's GPU or
+CPU and publishes the results into the shared library. Run one per machine, with slots
+per device set as for the API (KARAOKE_CUDA_SLOTS / KARAOKE_CPU_SLOTS). Start it in
+the directory the API runs in, shared by every node. The relative paths resolve against
+it: karaoke_output/, uploads/, the dedup cache, and the catalog, task and queue
+databases. That way workers read the uploads and write the tracks the API serves.
+
+While a job runs, the worker renews its lease. If the worker dies, the lease runs out
+and another worker retries the job (see job_queue.py).
+"""
+import argparse
+import threading
+from functools import partial
+from util import (JOB_QUEUE_URL, JOB_SLOTS, JOB_LEASE_SECONDS, TASK_STORE_URL, FINISHED_TASK_TTL, PRELOAD_MODELS,
+                  ALIGN_PRELOAD_LANGUAGES, pick_device)
+from scheduler import JobScheduler
+from task_store import OWNER
+from job_queue import make_job_queue
+from jobs import tasks, JOB_KINDS, job_device, recover_expired_jobs
+from workspace import evict_stale_workspaces
+
+class Worker:
+    def __init__(self, job_queue, slots: dict, lease_seconds: float):
+        self.job_queue = job_queue
+        self.lease_seconds = lease_seconds
+        self.device = pick_device()
+        # the accelerator's slots, plus CPU ones for ONNX profiles as in the API (jobs.job_device)
+        self.slots = {"cpu": slots["cpu"], self.device: slots[self.device]}
+        # a local scheduler, so jobs get the usual check_cancelled()/check_lease() behaviour
+        self.scheduler = JobScheduler(self.slots, cancel_check=tasks.cancel_requested)
+        # claims are capped by the total; a job may wait here briefly for a slot on its own device
+        self._free = threading.Semaphore(sum(self.slots.values()))
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self, poll_interval=1.0):
+        print(f"Worker {OWNER} taking jobs on " + ", ".join(f"{d} ({n} at a time)" for d, n in self.slots.items()))
+        threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True).start()
+        while not self._stop.is_set():
+            # only claim what can start right away, so idle workers elsewhere get the rest
+            self._free.acquire()
+            job = None
+            while job is None and not self._stop.is_set():
+                job = self.job_queue.claim(OWNER, self.lease_seconds)
+                if job is None:
+                    self._stop.wait(poll_interval)
+            if job is None:
+                break
+            with self._lock:
+                self._held.add(job["task_id"])
+            print(f"Claimed {job['kind']} task {job['task_id']} (attempt {job['attempts']})")
+            self.scheduler.submit(job["task_id"], self._run, job, device=job_device(job["kind"], job["args"], self.device),
+                                  lease=partial(self.job_queue.heartbeat, job["task_id"], OWNER, self.lease_seconds))
+
+    def stop(self):
+        self._stop.set()
+        self.scheduler.shutdown()
+
+    def _run(self, job):
+        task_id = job["task_id"]
+        try:
+            # the job checks (and renews) its lease before publishing or recording anything, so
+            # a run that was given away to a retry stops short of touching the retry's track
+            JOB_KINDS[job["kind"]](task_id, *job["args"])
+        finally:
+            self.job_queue.complete(job["task_id"], OWNER)
+            with self._lock:
+                self._held.discard(job["task_id"])
+            self._free.release()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self._heartbeat_once()
+            except Exception as e:
+                # e.g. "database is locked", or a scratch folder another node removed mid-scan.
+                # Never let this thread die: without it every lease runs out
+                print(f"Heartbeat failed, retrying: {e!r}")
+
+    def _heartbeat_once(self):
+        with self._lock:
+            held = list(self._held)
+        for task_id in held:
+            if not self.job_queue.heartbeat(task_id, OWNER, self.lease_seconds):
+                # stalled past the lease and the job went back to the queue. This copy
+                # stops at its next check_lease() and its outcome is dropped
+                print(f"Lost the lease on task {task_id}")
+        # pick up after workers that died, as the API does
+        recover_expired_jobs(self.job_queue)
+        evict_stale_workspaces(FINISHED_TASK_TTL)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between queue checks when idle")
+    args = parser.parse_args()
+    if not JOB_QUEUE_URL:
+        parser.error("set KARAOKE_JOB_QUEUE to the queue the API uses (e.g. sqlite:///karaoke_jobs.db)")
+    if TASK_STORE_URL == "memory":
+        parser.error("KARAOKE_TASK_STORE must be shared with the API (sqlite:///...)")
+
+    if PRELOAD_MODELS:
+        # the models live here in distributed mode, not in the API
+        import separation
+        from model_registry import registry as align_models
+        threading.Thread(target=separation.preload, name="preload-separation", daemon=True).start()
+        threading.Thread(target=align_models.preload, args=(ALIGN_PRELOAD_LANGUAGES,),
+                         name="preload-align", daemon=True).start()
+
+    worker = Worker(make_job_queue(JOB_QUEUE_URL), JOB_SLOTS, JOB_LEASE_SECONDS)
+    try:
+        worker.run(args.poll)
+    except KeyboardInterrupt:
+        # jobs still running here are retried elsewhere once their leases run out
+        print("Stopping")
+        worker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from util import TRACK_ROOT, SCRATCH_DIR
+
+# Per-job scratch directories and atomic publishing into TRACK_ROOT.
+# A job builds its whole track folder in its own scratch directory (which can be on
+# tmpfs or a fast local disk, see KARAOKE_SCRATCH_DIR) and only then moves it into
+# place with a rename, so concurrent jobs never share files and /tracks never sees a
+# half-built folder. A failed job just drops its scratch directory; whatever was
+# published before stays as it was.
+
+# always inside TRACK_ROOT, so a rename from here into a song folder is atomic
+STAGING_DIR = os.path.join(TRACK_ROOT, ".staging")
+
+# in a song folder that's still being separated (see progressive.py); its stems are growing
+PARTIAL_MARKER = "partial.json"
+
+def is_internal(name: str):
+    """Folders in TRACK_ROOT that aren't tracks (scratch/staging areas)."""
+    return name.startswith(".")
+
+def partial_state(song_dir: str):
+    """{"ready_seconds", "duration"} while a track is a progressive preview, None once it's complete."""
+    try:
+        with open(os.path.join(song_dir, PARTIAL_MARKER), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class JobWorkspace:
+    """Scratch directory for one job, removed when the `with` block ends."""
+
+    def __init__(self, job_id: str, root: str = SCRATCH_DIR):
+        self.path = os.path.join(root, job_id)
+        self.track_dir = os.path.join(self.path, "track")  # becomes the song folder
+
+    def create(self):
+        # job_id is unique per run; what a crashed run leaves is swept by evict_stale_workspaces
+        os.makedirs(self.track_dir)
+        return self
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, *exc):
+        self.remove()
+        return False
+
+def _same_filesystem(path_a, path_b):
+    return os.stat(path_a).st_dev == os.stat(path_b).st_dev
+
+def publish(build_dir: str, song_dir: str, artifacts=()):
+    """Move a finished track folder into place. A new track appears with one directory
+    rename. An existing one (re-processing) gets each file replaced with os.replace, and
+    any of `artifacts` the new build didn't produce are removed (e.g. a stem format that's
+    no longer made). Other files in it, such as lyrics, are kept."""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    if not _same_filesystem(build_dir, STAGING_DIR):
+        # scratch on another disk: copy next to the destination first, then rename from there
+        staged = os.path.join(STAGING_DIR, uuid.uuid4().hex)
+        shutil.copytree(build_dir, staged)
+        try:
+            return publish(staged, song_dir, artifacts)
+        finally:
+            shutil.rmtree(staged, ignore_errors=True)
+
+    if not os.path.exists(song_dir):
+        try:
+            os.rename(build_dir, song_dir)
+            return
+        except OSError:
+            if not os.path.isdir(song_dir):
+                raise
+            # another job published the same track first; merge into it below
+
+    produced = set(os.listdir(build_dir))
+    for name in produced:
+        os.replace(os.path.join(build_dir, name), os.path.join(song_dir, name))
+    for name in set(artifacts) - produced:
+        path = os.path.join(song_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def write_atomic(path: str, data):
+    """Write a small file (str or bytes) so readers see either the old or the new version."""
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    mode, encoding = ("wb", None) if isinstance(data, bytes) else ("w", "utf-8")
+    with open(tmp, mode, encoding=encoding) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def evict_stale_workspaces(max_age_seconds: float):
+    """Remove scratch/staging directories left behind by jobs that died mid-run."""
+    cutoff = time.time() - max_age_seconds
+    evicted = 0
+    for root in {SCRATCH_DIR, STAGING_DIR}:
+        if not os.path.isdir(root):
+            continue
+        for entry in os.scandir(root):
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                evicted += 1
+    return evicted
@@ -0,0 +1,199 @@
+"""Load-test the read endpoints of a backend serving a synthetic library.
+
+    python benchmarks/bench_http.py --tracks 200 --concurrency 16 --seconds 10
+
+Starts uvicorn in a scratch directory filled with fake tracks (short stems, a video,
+lyrics and an alignment each), then hammers /tracks, /search, /lyrics and /audio from
+--concurrency threads. Reports requests/s and latency percentiles per endpoint, and
+compares them with benchmarks/baselines.json like bench_pipeline.py does.
+Use --url to load an already running server instead (its library is used as is).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import (BACKEND_DIR, DEFAULT_BASELINE, make_video, make_audio, synthetic_lyrics,
+                    load_baseline, save_baseline, compare)
+
+RANGE_BYTES = 256 * 1024
+
+def build_library(workdir, count, seconds):
+    """count tracks that all share one set of synthetic media files (hard linked)."""
+    source = os.path.join(workdir, "source")
+    os.makedirs(source)
+    make_video(os.path.join(source, "video.mp4"), seconds)
+    for stem in ("vocals", "no_vocals"):
+        make_audio(os.path.join(source, f"{stem}.flac"), seconds, ("-c:a", "flac"))
+        make_audio(os.path.join(source, f"{stem}.opus"), seconds, ("-c:a", "libopus", "-b:a", "160k"))
+
+    lyrics = synthetic_lyrics(seconds)
+    words = lyrics.split()
+    step = seconds / max(1, len(words))
+    word_segments = [{"word": w, "start": round(i * step, 3), "end": round((i + 0.8) * step, 3), "score": 0.9}
+                     for i, w in enumerate(words)]
+
+    names = []
+    for i in range(count):
+        name = f"bench_track_{i:04d}"
+        song_dir = os.path.join(workdir, "karaoke_output", name)
+        os.makedirs(song_dir)
+        for file in os.listdir(source):
+            os.link(os.path.join(source, file), os.path.join(song_dir, file))
+        with open(os.path.join(song_dir, "lyrics_raw.txt"), "w", encoding="utf-8") as f:
+            f.write(lyrics)
+        with open(os.path.join(song_dir, "alignment.json"), "w", encoding="utf-8") as f:
+            json.dump({"audio_path": "", "language": "en", "word_segments": word_segments}, f)
+        names.append(name)
+    return names, words
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workdir, timeout=300):
+    port = _free_port()
+    env = {**os.environ,
+           "PYTHONPATH": BACKEND_DIR,
+           "CUDA_VISIBLE_DEVICES": "",
+           "KARAOKE_PRELOAD_MODELS": "0",
+           "KARAOKE_ALIGN_PRELOAD": "",
+           "KARAOKE_TASK_STORE": "memory"}
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited, see {log.name}")
+        try:
+            # the catalog and lyrics index fill in a background thread at startup
+            if requests.get(f"{url}/tracks", params={"limit": 1}, timeout=2).json().get("total"):
+                return process, url
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        time.sleep(1)
+    process.terminate()
+    raise RuntimeError("server didn't come up in time")
+
+def load(make_request, concurrency, seconds):
+    """Run make_request(session) from `concurrency` threads for `seconds`."""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def worker():
+        nonlocal errors
+        session = requests.Session()
+        own, failed = [], 0
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                response = make_request(session)
+                response.content
+                if response.status_code >= 400:
+                    failed += 1
+            except requests.exceptions.RequestException:
+                failed += 1
+            own.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own)
+            errors += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+    return {
+        "requests_per_second": len(latencies) / seconds,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "errors": errors,
+    }
+
+def scenarios(url, names, words, stem_size):
+    def audio_range(session):
+        start = random.randrange(0, max(1, stem_size - RANGE_BYTES))
+        return session.get(f"{url}/audio/{random.choice(names)}/vocals", params={"format": "opus,flac"},
+                           headers={"Range": f"bytes={start}-{start + RANGE_BYTES - 1}"}, timeout=30)
+    return {
+        "tracks_page": lambda s: s.get(f"{url}/tracks", params={"offset": random.randrange(len(names)), "limit": 50}, timeout=30),
+        "tracks_filtered": lambda s: s.get(f"{url}/tracks", params={"q": "track_00", "has_lyrics": "true"}, timeout=30),
+        "search": lambda s: s.get(f"{url}/search", params={"q": random.choice(words)}, timeout=30),
+        "lyrics": lambda s: s.get(f"{url}/lyrics/{random.choice(names)}", timeout=30),
+        "alignment": lambda s: s.get(f"{url}/lyrics/{random.choice(names)}/alignment", timeout=30),
+        "audio_range": audio_range,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark this running server instead of starting one")
+    parser.add_argument("--tracks", type=int, default=200)
+    parser.add_argument("--track-seconds", type=int, default=30)
+    parser.add_argument("--concurrency", default="1,16", help="comma separated thread counts")
+    parser.add_argument("--seconds", type=float, default=10, help="per endpoint and concurrency")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    workdir = server = None
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+            names = [t["name"] for t in requests.get(f"{url}/tracks", params={"limit": 1000}, timeout=10).json()["tracks"]]
+            words = ["love", "night"]
+        else:
+            workdir = tempfile.mkdtemp(prefix="karaoke_http_bench_")
+            print(f"Building a {args.tracks} track library in {workdir}")
+            names, words = build_library(workdir, args.tracks, args.track_seconds)
+            server, url = start_server(workdir)
+        if not names:
+            sys.exit("No tracks to benchmark against")
+        # the stem size, from the Content-Range of a one byte request
+        probe = requests.get(f"{url}/audio/{names[0]}/vocals", params={"format": "opus,flac"},
+                             headers={"Range": "bytes=0-0"}, timeout=10)
+        stem_size = int(probe.headers.get("content-range", f"/{RANGE_BYTES}").rpartition("/")[2])
+
+        results = {}
+        for concurrency in [int(c) for c in args.concurrency.split(",") if c]:
+            for name, make_request in scenarios(url, names, words, stem_size).items():
+                metrics = load(make_request, concurrency, args.seconds)
+                print(f"  {name}@{concurrency}: {metrics['requests_per_second']:.0f} req/s, p95 {metrics['p95_ms']:.1f} ms")
+                results[f"{name}@{concurrency}"] = metrics
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\nResults")
+    regressions = compare(results, load_baseline(args.baseline, "http"), args.tolerance,
+                          {"requests_per_second": False, "p95_ms": True, "p99_ms": True})
+    if args.save_baseline:
+        save_baseline(args.baseline, "http", results)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
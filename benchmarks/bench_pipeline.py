@@ -0,0 +1,196 @@
+"""Time each stage of track processing on synthetic media, on CPU.
+
+    python benchmarks/bench_pipeline.py --durations 30,180
+    python benchmarks/bench_pipeline.py --stages extract,separate --save-baseline
+
+Every stage runs in a fresh process, so peak RSS is that stage's own (plus any ffmpeg
+it started). Results are compared with benchmarks/baselines.json; the exit code is 1
+if any stage got slower or bigger than its baseline by more than --tolerance.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import (DEFAULT_BASELINE, ISOLATED_ENV, use_backend, make_video, make_audio, synthetic_lyrics, peak_rss_mb,
+                    wait_for_result, load_baseline, save_baseline, compare)
+
+SONG = "bench"
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def _song_dir():
+    from util import TRACK_ROOT
+    path = os.path.join(TRACK_ROOT, SONG)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+# Each stage returns {"wall_seconds": ..., other metrics}. They run in this order and
+# later ones use earlier outputs, so a subset must include what it depends on.
+
+def stage_extract(fixtures):
+    from media import extract_audio
+    wall, _ = _timed(extract_audio, fixtures["h264"], "audio.wav")
+    return {"wall_seconds": wall}
+
+def stage_mute_remux(fixtures):
+    from media import write_muted_video
+    wall, _ = _timed(write_muted_video, fixtures["h264"], os.path.join(_song_dir(), "video.mp4"), "h264")
+    return {"wall_seconds": wall}
+
+def stage_mute_reencode(fixtures):
+    from media import write_muted_video
+    wall, _ = _timed(write_muted_video, fixtures["mjpeg"], "reencoded.mp4", "mjpeg")
+    return {"wall_seconds": wall}
+
+def stage_separate(fixtures):
+    from separation import SeparationEngine
+    engine = SeparationEngine(device="cpu")
+    load, _ = _timed(engine.load)
+    song_dir = _song_dir()
+    wall, _ = _timed(engine.separate_file, "audio.wav",
+                     os.path.join(song_dir, "vocals.wav"), os.path.join(song_dir, "no_vocals.wav"))
+    return {"wall_seconds": wall, "model_load_seconds": load}
+
+def stage_separate_segmented(fixtures):
+    from segmented_separation import separate_file_segmented
+    os.makedirs("segmented", exist_ok=True)
+    wall, _ = _timed(separate_file_segmented, "audio.wav",
+                     os.path.join("segmented", "vocals.wav"), os.path.join("segmented", "no_vocals.wav"))
+    return {"wall_seconds": wall}
+
+def stage_encode(fixtures):
+    from media import encode_stems
+    from util import STEMS
+    song_dir = _song_dir()
+    # without "separate" in the run, stand-in stems of the same length (the fixture's
+    # music) so encoding can be measured on its own; flagged in the results
+    stand_in = [stem for stem in STEMS if not os.path.exists(os.path.join(song_dir, f"{stem}.wav"))]
+    for stem in stand_in:
+        make_audio(os.path.join(song_dir, f"{stem}.wav"), fixtures["seconds"])
+    wall, _ = _timed(encode_stems, song_dir, STEMS, ["flac", "opus"], True)
+    return {"wall_seconds": wall, "stand_in_stems": bool(stand_in)}
+
+def stage_copy(fixtures):
+    # the re-upload fast path: hash the upload, then link the cached outputs into a new track
+    from dedup_cache import ContentCache
+    from uploads import hash_file
+    cache = ContentCache("bench_cache", 10 * 2**30)
+    start = time.perf_counter()
+    content_hash = hash_file(fixtures["h264"])
+    cache.store(content_hash, _song_dir())
+    restored = cache.restore(content_hash, "restored")
+    return {"wall_seconds": time.perf_counter() - start, "restored": restored}
+
+def stage_align(fixtures):
+    from audio_processing import run_lyrics_alignment_process
+    from model_registry import registry
+    load, _ = _timed(registry.get, "en", "cpu")
+    wall, (ok, message, *_) = _timed(run_lyrics_alignment_process, SONG, synthetic_lyrics(fixtures["seconds"]), "en")
+    if not ok:
+        raise RuntimeError(message)
+    return {"wall_seconds": wall, "model_load_seconds": load}
+
+def stage_pipeline(fixtures):
+    # the whole of run_karaoke_process, as an upload would run it
+    from audio_processing import run_karaoke_process
+    wall, result = _timed(run_karaoke_process, fixtures["h264"], str(uuid.uuid4()), "bench_full.mp4")
+    if not result[0]:
+        raise RuntimeError(result[1])
+    # time_to_preview: when the partial track became playable (None with KARAOKE_PREVIEW_SECONDS=0)
+    return {"wall_seconds": wall, "time_to_preview_seconds": result[2]["time_to_preview"],
+            **{f"{k}_seconds": v for k, v in result[2]["timings"].items()}}
+
+STAGES = {
+    "extract": stage_extract,
+    "mute_remux": stage_mute_remux,
+    "mute_reencode": stage_mute_reencode,
+    "separate": stage_separate,
+    "separate_segmented": stage_separate_segmented,
+    "encode": stage_encode,
+    "copy": stage_copy,
+    "align": stage_align,
+    "pipeline": stage_pipeline,
+}
+DEFAULT_STAGES = ["extract", "mute_remux", "mute_reencode", "separate", "encode", "copy", "align", "pipeline"]
+
+def _run_stage(stage, workdir, fixtures, queue):
+    os.environ.update(ISOLATED_ENV)
+    os.chdir(workdir)
+    use_backend()
+    try:
+        metrics = STAGES[stage](fixtures)
+    except Exception as e:
+        queue.put({"error": repr(e)})
+        return
+    metrics["peak_rss_mb"] = peak_rss_mb()
+    metrics["audio_seconds_per_second"] = fixtures["seconds"] / metrics["wall_seconds"]
+    queue.put(metrics)
+
+def run(durations, stages, keep=False):
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for seconds in durations:
+        workdir = tempfile.mkdtemp(prefix=f"karaoke_bench_{seconds}s_")
+        try:
+            print(f"Generating {seconds}s fixtures in {workdir}")
+            fixtures = {"seconds": seconds,
+                        "h264": os.path.join(workdir, "input.mp4"),
+                        "mjpeg": os.path.join(workdir, "input.mkv")}
+            make_video(fixtures["h264"], seconds, "h264")
+            make_video(fixtures["mjpeg"], seconds, "mjpeg")
+
+            for stage in stages:
+                queue = ctx.Queue()
+                process = ctx.Process(target=_run_stage, args=(stage, workdir, fixtures, queue))
+                process.start()
+                metrics = wait_for_result(process, queue)
+                process.join()
+                if "error" in metrics:
+                    print(f"  {stage}@{seconds}s failed: {metrics['error']}")
+                    continue
+                print(f"  {stage}@{seconds}s: {metrics['wall_seconds']:.2f}s")
+                results[f"{stage}@{seconds}s"] = metrics
+        finally:
+            if not keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", default="30,180", help="comma separated fixture lengths in seconds")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES), help=f"any of {', '.join(STAGES)}")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--keep", action="store_true", help="keep the work directories")
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    durations = [int(d) for d in args.durations.split(",") if d]
+
+    results = run(durations, [s for s in STAGES if s in stages], keep=args.keep)
+
+    print("\nResults")
+    regressions = compare(results, load_baseline(args.baseline, "pipeline"), args.tolerance,
+                          {"wall_seconds": True, "time_to_preview_seconds": True, "peak_rss_mb": True})
+    if args.save_baseline:
+        save_baseline(args.baseline, "pipeline", results)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
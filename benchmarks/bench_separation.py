@@ -0,0 +1,170 @@
+"""Compare the separation profiles for speed and quality (SDR), on CPU.
+
+    python benchmarks/bench_separation.py --profiles quality,balanced,fast
+    python benchmarks/bench_separation.py --musdb /data/musdb18hq/test --tracks 5 --seconds 60
+
+With --musdb (MUSDB18-HQ layout: <track>/mixture.wav and <track>/vocals.wav), SDR is
+measured against the real stems, with accompaniment = mixture - vocals. Without it, a
+synthetic mix is used: a vibrato "voice" that comes and goes over a chord and noise
+bed. That's fine for speed, but only a smoke test for quality. SDR is the whole-track
+signal to distortion ratio in dB (higher is better). Median over tracks.
+
+Each profile runs in a fresh process, so peak RSS is its own. The ONNX profiles need
+models exported with backend/export_onnx.py (--onnx-models points at them). Results
+are compared with benchmarks/baselines.json like the other benchmarks. An SDR more than
+--sdr-tolerance dB below its baseline fails the run as well.
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import (BACKEND_DIR, DEFAULT_BASELINE, ISOLATED_ENV, use_backend, peak_rss_mb, wait_for_result,
+                    load_baseline, save_baseline, compare)
+
+RATE = 44100
+
+def read_wav(path, seconds=None):
+    with wave.open(path, "rb") as w:
+        frames = w.getnframes() if seconds is None else min(w.getnframes(), int(seconds * w.getframerate()))
+        data = np.frombuffer(w.readframes(frames), dtype="<i2").reshape(-1, w.getnchannels())
+    return data.T.astype(np.float32) / 32768
+
+def write_wav(path, audio):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(audio.shape[0])
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes((np.clip(audio, -1, 1) * 32767).astype("<i2").T.tobytes())
+
+def synthetic_track(seconds, seed=0):
+    """(mixture, vocals, accompaniment) as (2, samples) float arrays."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * RATE)) / RATE
+    pitch = 220 * 2 ** (rng.integers(0, 12, size=int(seconds) + 1)[t.astype(int)] / 12)
+    phase = 2 * np.pi * np.cumsum(pitch * (1 + 0.01 * np.sin(2 * np.pi * 5.5 * t))) / RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6)) * (np.sin(2 * np.pi * 0.4 * t) > -0.3)
+    chord = sum(np.sin(2 * np.pi * f * t) for f in (110, 138.6, 164.8)) / 3
+    beat = rng.standard_normal(len(t)) * np.exp(-(t % 0.5) * 30)
+    vocals = np.stack([voice, voice * 0.9]) * 0.2
+    accompaniment = np.stack([chord + 0.2 * beat, chord * 0.8 + 0.2 * beat]) * 0.25
+    return (vocals + accompaniment).astype(np.float32), vocals.astype(np.float32), accompaniment.astype(np.float32)
+
+def prepare_tracks(workdir, musdb, count, seconds):
+    """Write each mixture (16-bit WAV) and its reference stems to workdir; returns the mixture paths."""
+    tracks = []
+    if musdb:
+        names = sorted(d for d in os.listdir(musdb) if os.path.isfile(os.path.join(musdb, d, "mixture.wav")))
+        for name in names[:count]:
+            mixture = read_wav(os.path.join(musdb, name, "mixture.wav"), seconds)
+            vocals = read_wav(os.path.join(musdb, name, "vocals.wav"), seconds)
+            tracks.append((mixture, vocals, mixture - vocals))
+    else:
+        tracks = [synthetic_track(seconds or 30, seed=i) for i in range(count)]
+
+    prepared = []
+    for i, (mixture, vocals, accompaniment) in enumerate(tracks):
+        path = os.path.join(workdir, f"mix_{i}.wav")
+        write_wav(path, mixture)
+        np.save(os.path.join(workdir, f"ref_{i}.npy"), np.stack([vocals, accompaniment]))
+        prepared.append(path)
+    return prepared
+
+def sdr(reference, estimate):
+    n = min(reference.shape[-1], estimate.shape[-1])
+    error = reference[..., :n] - estimate[..., :n]
+    return 10 * math.log10((np.sum(reference[..., :n] ** 2) + 1e-9) / (np.sum(error ** 2) + 1e-9))
+
+def _run_profile(profile, workdir, mixes, queue):
+    os.environ.update(ISOLATED_ENV)
+    os.chdir(workdir)
+    use_backend()
+    try:
+        from separation import get_engine
+        engine = get_engine(profile)
+        start = time.perf_counter()
+        engine.load()
+        load = time.perf_counter() - start
+
+        wall, audio_seconds, vocal_sdrs, accompaniment_sdrs = 0.0, 0.0, [], []
+        for i, mix in enumerate(mixes):
+            start = time.perf_counter()
+            timings = engine.separate_file(mix, f"{profile}_vocals_{i}.wav", f"{profile}_no_vocals_{i}.wav")
+            wall += time.perf_counter() - start
+            audio_seconds += timings["audio_seconds"]
+            reference = np.load(f"ref_{i}.npy")
+            vocal_sdrs.append(sdr(reference[0], read_wav(f"{profile}_vocals_{i}.wav")))
+            accompaniment_sdrs.append(sdr(reference[1], read_wav(f"{profile}_no_vocals_{i}.wav")))
+    except Exception as e:
+        queue.put({"error": repr(e)})
+        return
+    queue.put({
+        "wall_seconds": wall,
+        "model_load_seconds": load,
+        "audio_seconds_per_second": audio_seconds / wall,
+        "sdr_vocals": statistics.median(vocal_sdrs),
+        "sdr_accompaniment": statistics.median(accompaniment_sdrs),
+        "peak_rss_mb": peak_rss_mb(),
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="quality,balanced,fast", help="comma separated profile names")
+    parser.add_argument("--musdb", help="MUSDB18-HQ split folder to measure real SDR on")
+    parser.add_argument("--tracks", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=None, help="only the first N seconds of each track")
+    parser.add_argument("--onnx-models", default=os.path.join(BACKEND_DIR, "models"), help="exported ONNX models")
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime threads (0 = one per core)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--sdr-tolerance", type=float, default=0.5, help="allowed SDR drop in dB")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory (separated stems)")
+    args = parser.parse_args()
+
+    os.environ["KARAOKE_ONNX_MODEL_DIR"] = os.path.abspath(args.onnx_models)
+    os.environ["KARAOKE_ONNX_THREADS"] = str(args.threads)
+    ctx = multiprocessing.get_context("spawn")
+    workdir = tempfile.mkdtemp(prefix="karaoke_separation_bench_")
+    results = {}
+    try:
+        mixes = prepare_tracks(workdir, args.musdb, args.tracks, args.seconds)
+        data = "musdb" if args.musdb else "synthetic"
+        print(f"{len(mixes)} {data} tracks in {workdir}")
+        for profile in [p for p in args.profiles.split(",") if p]:
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run_profile, args=(profile, workdir, mixes, queue))
+            process.start()
+            metrics = wait_for_result(process, queue)
+            process.join()
+            if "error" in metrics:
+                print(f"  {profile} failed: {metrics['error']}")
+                continue
+            print(f"  {profile}: {metrics['audio_seconds_per_second']:.2f}x realtime, "
+                  f"SDR vocals {metrics['sdr_vocals']:.2f} dB")
+            results[f"{profile}@{data}"] = metrics
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print("\nResults")
+    regressions = compare(results, load_baseline(args.baseline, "separation"), args.tolerance,
+                          {"wall_seconds": True, "peak_rss_mb": True, "sdr_vocals": False, "sdr_accompaniment": False},
+                          absolute={"sdr_vocals": args.sdr_tolerance, "sdr_accompaniment": args.sdr_tolerance})
+    if args.save_baseline:
+        save_baseline(args.baseline, "separation", results)
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%} (SDR: {args.sdr_tolerance} dB)")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+from queue import Empty
+from imageio_ffmpeg import get_ffmpeg_exe
+
+# Shared pieces of the benchmark scripts: synthetic media, peak memory, baselines.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# keep benchmark processes away from the real library, caches and GPUs
+ISOLATED_ENV = {
+    "CUDA_VISIBLE_DEVICES": "",
+    "KARAOKE_SEPARATION_DEVICES": "cpu,cpu",
+    "KARAOKE_CATALOG_DB": "bench_catalog.db",
+    "KARAOKE_TASK_STORE": "memory",
+    "KARAOKE_DEDUP_CACHE": "0",
+    "KARAOKE_PRELOAD_MODELS": "0",
+    "KARAOKE_ALIGN_PRELOAD": "",
+}
+
+def use_backend():
+    """Make the backend's flat modules (util, media, ...) importable."""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+def _ffmpeg(args):
+    cmd = [get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", *args]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+
+# stereo "song": a chord that changes every 2s on the left, a wandering tone plus a little
+# noise on the right, so separation and the encoders get something other than silence
+_SONG = ("aevalsrc='0.25*sin(2*PI*(220+55*mod(floor(t/2),4))*t)+0.1*sin(2*PI*(330+55*mod(floor(t/2),3))*t)"
+         "|0.25*sin(2*PI*(440+40*sin(t/3))*t)+0.02*(random(0)-0.5)':s=44100:d={d}")
+
+def make_video(path, seconds, codec="h264"):
+    """Synthetic test video with a stereo audio track. codec "h264" gives an mp4 the
+    pipeline can remux; "mjpeg" gives an mkv it has to re-encode."""
+    video = ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p"] if codec == "h264" else ["-c:v", "mjpeg", "-q:v", "5"]
+    _ffmpeg(["-f", "lavfi", "-i", f"testsrc2=size=640x360:rate=25:duration={seconds}",
+             "-f", "lavfi", "-i", _SONG.format(d=seconds),
+             *video, "-c:a", "aac", "-b:a", "128k", "-shortest", path])
+
+def make_audio(path, seconds, codec_args=("-c:a", "pcm_s16le")):
+    _ffmpeg(["-f", "lavfi", "-i", _SONG.format(d=seconds), *codec_args, path])
+
+def synthetic_lyrics(seconds, words_per_second=2.0, line_words=6, stanza_lines=4):
+    vocabulary = ["love", "night", "city", "light", "heart", "road", "fire", "rain", "dream", "home", "sky", "time"]
+    total = max(line_words, int(seconds * words_per_second))
+    words = [vocabulary[(i * 7) % len(vocabulary)] for i in range(total)]
+    lines = [" ".join(words[i:i + line_words]) for i in range(0, total, line_words)]
+    stanzas = ["\n".join(lines[i:i + stanza_lines]) for i in range(0, len(lines), stanza_lines)]
+    return "\n\n".join(stanzas)
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children (ffmpeg), in MB.
+    None where the platform can't tell us."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2**20  # Windows
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return max(own, children) / 2**20
+
+def wait_for_result(process, queue):
+    """What a benchmark child process put on `queue`, or an error if it died first."""
+    while True:
+        try:
+            return queue.get(timeout=5)
+        except Empty:
+            if not process.is_alive():
+                return {"error": f"stage process died with exit code {process.exitcode}"}
+
+def _cpu_name():
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.partition(":")[2].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+def _memory_gb():
+    try:
+        return round(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30, 1)
+    except (AttributeError, ValueError, OSError):
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return round(psutil.virtual_memory().total / 2**30, 1)
+
+def machine_profile():
+    """What a baseline was recorded on. Timings only compare between like machines."""
+    return {
+        "os": platform.system(),
+        "arch": platform.machine(),
+        "cpu": _cpu_name(),
+        "cpus": os.cpu_count(),
+        "memory_gb": _memory_gb(),
+        "python": platform.python_version(),
+    }
+
+def load_baseline(path, section=None):
+    """The whole baseline file, or just one section of it. For a section, warns when it was
+    recorded on a different machine than this one."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+    if section is None:
+        return baseline
+    recorded = baseline.get("machines", {}).get(section)
+    current = machine_profile()
+    if recorded and recorded != current:
+        print(f"Note: the {section} baseline was recorded on another machine; expect differences")
+        for key in sorted(set(recorded) | set(current)):
+            if recorded.get(key) != current.get(key):
+                print(f"  {key}: baseline {recorded.get(key)}, here {current.get(key)}")
+    return baseline.get(section, {})
+
+def save_baseline(path, section, results):
+    """Store results[key][metric] under `section` (e.g. "pipeline", "http"), keeping the other
+    sections, along with the machine profile it was recorded on."""
+    baseline = load_baseline(path)
+    baseline[section] = results
+    baseline.setdefault("machines", {})[section] = machine_profile()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+def compare(results, baseline, tolerance, higher_is_worse, absolute=None):
+    """Print each metric next to its baseline. higher_is_worse maps metric -> bool; metrics
+    not in it are shown but not judged. tolerance is relative; absolute maps metric -> the
+    allowed change in its own units instead, for metrics a percentage means nothing for
+    (SDR in dB, which can be near or below zero). Returns the list of regressions."""
+    absolute = absolute or {}
+    regressions = []
+    for key, metrics in results.items():
+        if key not in baseline:
+            print(f"  {key:32} (no baseline: record one on this machine with --save-baseline)")
+        base = baseline.get(key, {})
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if value is None or old is None or metric not in higher_is_worse:
+                print(f"  {key:32} {metric:20} {_fmt(value):>12}")
+                continue
+            if metric in absolute:
+                change, limit = value - old, absolute[metric]
+                shown = f"{change:+.2f}"
+            else:
+                change, limit = (value - old) / old if old else 0.0, tolerance
+                shown = f"{change:+.0%}"
+            worse = change > limit if higher_is_worse[metric] else change < -limit
+            flag = "  REGRESSION" if worse else ""
+            print(f"  {key:32} {metric:20} {_fmt(value):>12}  (baseline {_fmt(old)}, {shown}){flag}")
+            if worse:
+                regressions.append((key, metric, old, value))
+    return regressions
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
@@ -0,0 +1,59 @@
+import struct
+from array import array
+from bisect import bisect_right
+
+# Reader for the backend's binary alignment format (backend/alignment_format.py)
+# plus a time index, so finding the word being sung at a given playback position
+# is a binary search instead of a scan over every word on each positionChanged tick.
+
+MAGIC = b"KALN"
+VERSION = 1
+MISSING = 0xFFFFFFFF
+
+def _read_column(data, offset, typecode, count):
+    column = array(typecode)
+    size = column.itemsize * count
+    column.frombytes(data[offset:offset + size])
+    if struct.pack("=H", 1) != struct.pack("<H", 1):
+        column.byteswap()  # file is little-endian
+    return column, offset + size
+
+class WordTimeline:
+    def __init__(self, words, start_ms, end_ms):
+        self.words = words
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        # words whisperx couldn't place have no time; index only the timed ones
+        self._timed = [i for i, start in enumerate(start_ms) if start != MISSING]
+        self._starts = [start_ms[i] for i in self._timed]
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        if data[:4] != MAGIC:
+            raise ValueError("Not an alignment file")
+        version, count = struct.unpack_from("<BI", data, 4)
+        if version != VERSION:
+            raise ValueError(f"Unsupported alignment version {version}")
+        offset = 9
+        (blob_len,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        words = data[offset:offset + blob_len].decode("utf-8").split("\0") if count else []
+        offset += blob_len
+        start_ms, offset = _read_column(data, offset, "I", count)
+        end_ms, offset = _read_column(data, offset, "I", count)
+        return cls(words, start_ms, end_ms)
+
+    def __len__(self):
+        return len(self.words)
+
+    def word_at(self, position_ms: int):
+        """Index of the last word that started at or before position_ms, or None before the first one."""
+        i = bisect_right(self._starts, position_ms) - 1
+        if i < 0:
+            return None
+        return self._timed[i]
+
+    def context(self, index: int, before: int = 4, after: int = 6):
+        """Words around `index`, as (first_index, words) for display."""
+        first = max(0, index - before)
+        return first, self.words[first:index + after + 1]
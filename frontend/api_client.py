@@ -1,34 +1,124 @@
+import json
+import os
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from alignment import WordTimeline
+from media_cache import media_cache
 
 BASE_URL = "http://127.0.0.1:8000"
+STEM_FORMATS = "opus,flac,wav" # preferred stem encodings, best first
+UPLOAD_RETRIES = 5
 
-def upload_to_server(file_path):
-    url = f"{BASE_URL}/upload_track"
-    with open(file_path, 'rb') as f:
-        files = {'file': f}
-        response = requests.post(url, files=files)
+# one keep-alive connection pool shared by every call (they run on async_api's threads)
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+def upload_to_server(file_path, progress=None):
+    """Upload in chunks through the resumable upload endpoints.
+    progress(sent_bytes, total_bytes) is called after every chunk.
+    If the connection drops, it asks the server how much arrived and continues from there."""
+    size = os.path.getsize(file_path)
+    with requests.Session() as session:
+        response = session.post(f"{BASE_URL}/uploads", data={"filename": os.path.basename(file_path), "size": size})
+        response.raise_for_status()
+        upload = response.json()
+        upload_url = f"{BASE_URL}/uploads/{upload['upload_id']}"
+        chunk_size = upload["chunk_size"]
+
+        offset = 0
+        failures = 0
+        resuming = False
+        with open(file_path, 'rb') as f:
+            while offset < size:
+                try:
+                    if resuming:
+                        # how much arrived before the connection dropped. If the server is
+                        # still down this fails too, and counts as another attempt
+                        response = session.get(upload_url, timeout=10)
+                        response.raise_for_status()
+                        offset = response.json()["received"]
+                        resuming = False
+                    else:
+                        f.seek(offset)
+                        chunk = f.read(chunk_size)
+                        response = session.put(upload_url, params={"offset": offset}, data=chunk, timeout=60)
+                        response.raise_for_status()
+                        offset = response.json()["received"]
+                        failures = 0
+                except requests.exceptions.RequestException as e:
+                    failures += 1
+                    if failures > UPLOAD_RETRIES:
+                        raise
+                    print(f"Upload interrupted ({e}), resuming...")
+                    time.sleep(min(2 ** failures, 30))
+                    resuming = True
+                    continue
+
+                if progress is not None:
+                    progress(offset, size)
+
+        response = session.post(f"{upload_url}/complete")
+        response.raise_for_status()
     return response.json() # Returns {"task_id": "..."}
 
-def check_status(task_id):
-    url = f"{BASE_URL}/status/{task_id}"
-    response = requests.get(url)
-    return response.json() # Returns {"status": "processing/completed/failed", ...}
+_tracks_cache = {} # page offset -> (etag, page json), so an unchanged library costs a 304
+
+def stream_status(task_id):
+    """Yield the task's status dict every time the server reports a change (Server-Sent Events).
+    Ends when the task finishes; raises requests exceptions if the connection drops."""
+    url = f"{BASE_URL}/events/{task_id}"
+    # no read timeout beyond the server's 15s heartbeat
+    with requests.get(url, stream=True, timeout=(3, 60)) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data:"):
+                yield json.loads(line[len("data:"):])
 
-def get_all_tracks():
+def get_all_tracks(page_size=500):
+    """All tracks as dicts (name, duration, stems, has_lyrics, ...), fetched page by page."""
     try:
-        # Added a 3-second timeout so the UI doesn't freeze if server is dead
-        response = requests.get(f"{BASE_URL}/tracks", timeout=3)
-        response.raise_for_status() # Raises error for 4xx or 5xx codes
-        return response.json().get("tracks", [])
+        tracks = []
+        offset = 0
+        while True:
+            etag, cached = _tracks_cache.get(offset, (None, None))
+            headers = {"If-None-Match": etag} if etag else {}
+            # Added a 3-second timeout so the UI doesn't freeze if server is dead
+            response = _session.get(f"{BASE_URL}/tracks", params={"offset": offset, "limit": page_size},
+                                  headers=headers, timeout=3)
+            if response.status_code == 304:
+                page = cached
+            else:
+                response.raise_for_status() # Raises error for 4xx or 5xx codes
+                page = response.json()
+                _tracks_cache[offset] = (response.headers.get("ETag"), page)
+
+            tracks.extend(page.get("tracks", []))
+            offset += page_size
+            if offset >= page.get("total", 0):
+                return tracks
     except requests.exceptions.RequestException as e:
         print(f"Connection Error: {e}")
         return [] # Return empty list so the UI doesn't crash
-    
-def get_lyrics(song_name):
-    try:
-        response = requests.get(f"{BASE_URL}/lyrics/{song_name}")
-        return response
-    
-    except requests.exceptions.RequestException as e:
-        print(f"Connection Error: {e}")
-        return []
+
+def track_urls(song_name):
+    """Everything the player loads for a track, by kind."""
+    return {
+        # compressed stems when the server has them, WAV for older tracks
+        "vocals": f"{BASE_URL}/audio/{song_name}/vocals?format={STEM_FORMATS}",
+        "no_vocals": f"{BASE_URL}/audio/{song_name}/no_vocals?format={STEM_FORMATS}",
+        "video": f"{BASE_URL}/video/{song_name}",
+        "alignment": f"{BASE_URL}/lyrics/{song_name}/alignment",
+    }
+
+def get_alignment(song_name):
+    """The track's word timeline (alignment.WordTimeline), or None if it has no synced lyrics.
+    Served from the disk cache when it's there; the prefetcher keeps it up to date."""
+    url = track_urls(song_name)["alignment"]
+    # requests asks for gzip and unpacks it for us
+    path = media_cache.cached_path(url) or media_cache.fetch(url, session=_session, timeout=5)
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return WordTimeline.from_bytes(f.read())
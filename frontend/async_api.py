@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from PySide6.QtCore import QObject, Signal
+
+import api_client
+
+# Runs the blocking api_client calls on a small thread pool so the UI thread never
+# waits on the network, and hands results back through Qt signals (queued onto the
+# UI thread, since the receiving widgets live there). A request that's already in
+# flight isn't sent again: the second caller just gets the same signal when the
+# first one finishes.
+
+API_THREADS = 4
+
+class AsyncApi(QObject):
+    tracks_ready = Signal(list)             # track dicts, [] if the server is offline
+    alignment_ready = Signal(str, object)   # song name, WordTimeline or None
+    failed = Signal(str, str)               # request key, error message
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pool = ThreadPoolExecutor(max_workers=API_THREADS, thread_name_prefix="api")
+        self._in_flight = set()
+
+    def _submit(self, key, fn, *args, on_result):
+        # called from the UI thread; done() may discard concurrently, set ops are atomic
+        if key in self._in_flight:
+            return
+        self._in_flight.add(key)
+        future = self._pool.submit(fn, *args)
+
+        def done(future):
+            # runs on the pool thread; signal emission is what crosses back to the UI thread
+            self._in_flight.discard(key)
+            try:
+                result = future.result()
+            except Exception as e:
+                self.failed.emit(key, str(e))
+                return
+            on_result(result)
+
+        future.add_done_callback(done)
+
+    def fetch_tracks(self):
+        self._submit("tracks", api_client.get_all_tracks, on_result=self.tracks_ready.emit)
+
+    def fetch_alignment(self, song_name):
+        self._submit(f"alignment:{song_name}", api_client.get_alignment, song_name,
+                     on_result=lambda timeline: self.alignment_ready.emit(song_name, timeline))
+
+@cache
+def api():
+    """The app's shared AsyncApi, created on first use (after the QApplication exists)."""
+    return AsyncApi()
@@ -1,9 +1,12 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QLabel, QPushButton, QProgressBar, QFileDialog)
 from PySide6.QtCore import QThread, Signal
 
-from api_client import upload_to_server, check_status, BASE_URL
+from api_client import upload_to_server, stream_status, BASE_URL
 from .TrackListWidget import TrackListWidget
 import time
+import requests
+
+STREAM_RECONNECTS = 5
 
 class AddSongWidget(QWidget):
     add_track = Signal()
@@ -38,9 +41,23 @@ class AddSongWidget(QWidget):
             
             self.worker = ProcessingWorker(path)
             self.worker.status_update.connect(lambda msg: self.status_label.setText(msg))
+            self.worker.upload_progress.connect(self.on_upload_progress)
+            self.worker.task_progress.connect(self.on_task_progress)
+            self.worker.preview_ready.connect(self.track_list.refresh) # playable before it's finished
             self.worker.finished.connect(self.on_complete)
             self.worker.start()
 
+    def on_upload_progress(self, percent):
+        if percent >= 100:
+            self.progress.setRange(0, 0) # back to "busy" while the server works
+        else:
+            self.progress.setRange(0, 100)
+            self.progress.setValue(percent)
+
+    def on_task_progress(self, percent):
+        self.progress.setRange(0, 100)
+        self.progress.setValue(percent)
+
     def on_complete(self, success, message):
         self.start_btn.setEnabled(True)
         self.progress.hide() # HIDE when finished
@@ -56,36 +73,66 @@ class AddSongWidget(QWidget):
 class ProcessingWorker(QThread):
     finished = Signal(bool, str)
     status_update = Signal(str) # allows updating of UI text during status polling
+    upload_progress = Signal(int) # percent uploaded
+    task_progress = Signal(int) # percent processed on the server
+    preview_ready = Signal() # the server has listed the start of the track while it separates the rest
 
     def __init__(self, file_path):
         super().__init__()
         self.file_path = file_path
+        self.preview_announced = False
 
     def run(self):
         try:
             # Talk to the FastAPI server
             self.status_update.emit("Uploading to Server...")
-            init_res = upload_to_server(self.file_path)
+            init_res = upload_to_server(
+                self.file_path,
+                progress=lambda sent, total: self.upload_progress.emit(int(100 * sent / max(total, 1)))
+            )
             task_id = init_res.get("task_id")
 
             if not task_id:
                 self.finished.emit(False, "Failed to start task on server.")
                 return
             
+            # the server pushes every status change; reconnect if the stream drops mid-job
+            reconnects = 0
             while True:
-                res = check_status(task_id)
-                status = res.get("status")
-                
-                if status == "completed":
-                    self.finished.emit(True, res.get("message", "Done!"))
-                    break
-                elif status == "failed":
-                    self.finished.emit(False, res.get("message", "GPU Error"))
-                    break
-                
-                # Update UI and wait 2 seconds before asking again
-                self.status_update.emit("AI is separating tracks")
-                time.sleep(2)
+                try:
+                    for res in stream_status(task_id):
+                        if self.handle_status(res):
+                            return
+                except requests.exceptions.RequestException:
+                    reconnects += 1
+                    if reconnects > STREAM_RECONNECTS:
+                        raise
+                time.sleep(1)
 
         except Exception as e:
-            self.finished.emit(False, f"Connection Error: {str(e)}")
\ No newline at end of file
+            self.finished.emit(False, f"Connection Error: {str(e)}")
+
+    def handle_status(self, res):
+        """Show one status update. Returns True once the task is over."""
+        status = res.get("status")
+
+        if status is None: # error event, e.g. the server forgot the task
+            self.finished.emit(False, res.get("detail", "Task not found"))
+            return True
+        elif status == "completed":
+            self.finished.emit(True, res.get("message", "Done!"))
+            return True
+        elif status in ("failed", "cancelled"):
+            self.finished.emit(False, res.get("message", "GPU Error"))
+            return True
+
+        if status == "queued":
+            self.status_update.emit(f"Waiting in queue (position {res.get('queue_position')})")
+        else:
+            self.status_update.emit(res.get("message") or "AI is separating tracks")
+            if res.get("percent") is not None:
+                self.task_progress.emit(int(res["percent"]))
+            if res.get("preview_seconds") and not self.preview_announced:
+                self.preview_announced = True
+                self.preview_ready.emit()
+        return False
\ No newline at end of file
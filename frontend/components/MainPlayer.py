@@ -1,11 +1,15 @@
+import html
 from PySide6.QtWidgets import (QHBoxLayout, QVBoxLayout, 
                              QPushButton, QLabel, QSlider, QFrame, QStyle)
 from PySide6.QtCore import Qt, QUrl
-from PySide6.QtMultimedia import QMediaPlayer, QAudioOutput
+from PySide6.QtMultimedia import QMediaPlayer
 from PySide6.QtMultimediaWidgets import QVideoWidget
 
 from components import ClickSlider 
-from api_client import BASE_URL, get_lyrics
+from api_client import track_urls
+from async_api import api
+from media_cache import media_cache
+from playback_engine import PlaybackEngine
 
 class MainPlayer(QFrame):
     def __init__(self, parent=None):
@@ -18,6 +22,17 @@ class MainPlayer(QFrame):
         self.song_title.setAlignment(Qt.AlignCenter)
         self.song_title.setStyleSheet("font-size: 18px; font-weight: bold;")
 
+        ## Synced lyrics: the word being sung, with a few words of context
+        self.lyrics_label = QLabel("")
+        self.lyrics_label.setAlignment(Qt.AlignCenter)
+        self.lyrics_label.setWordWrap(True)
+        self.lyrics_label.setTextFormat(Qt.RichText)
+        self.lyrics_label.setStyleSheet("font-size: 16px;")
+        self.timeline = None
+        self.current_word = None
+        self.current_song = None
+        api().alignment_ready.connect(self.set_alignment)
+
         ## Playback controls
         self.controls_layout = QHBoxLayout()
         
@@ -53,6 +68,7 @@ class MainPlayer(QFrame):
         self.player_layout.insertWidget(0, self.video_widget) # Place video at the top
         self.player_layout.addStretch()
         self.player_layout.addWidget(self.song_title)
+        self.player_layout.addWidget(self.lyrics_label)
         self.player_layout.addLayout(self.controls_layout)
         self.player_layout.addStretch()
         self.player_layout.addLayout(self.vocal_vol)
@@ -60,21 +76,16 @@ class MainPlayer(QFrame):
         self.player_layout.addLayout(self.footer)
 
         ### Setting up audio and video output
-        self.vocal_player = QMediaPlayer()
-        self.vocal_output = QAudioOutput()
-        self.vocal_player.setAudioOutput(self.vocal_output)
-        
-        self.inst_player = QMediaPlayer()
-        self.inst_output = QAudioOutput()
-        self.inst_player.setAudioOutput(self.inst_output)
-
+        # both stems are mixed by one engine whose audio clock the (muted) video follows
         self.video_player = QMediaPlayer()
         self.video_player.setVideoOutput(self.video_widget)
+        self.engine = PlaybackEngine(self.video_player, self)
 
-        ### Connect players to the seeker. We use inst_player as the "master" for timing
-        self.inst_player.positionChanged.connect(self.update_position)
-        self.inst_player.durationChanged.connect(self.update_duration)
-        self.inst_player.playbackStateChanged.connect(self.update_buttons)
+        ### Connect the engine to the seeker
+        self.engine.positionChanged.connect(self.update_position)
+        self.engine.durationChanged.connect(self.update_duration)
+        self.engine.playbackStateChanged.connect(self.update_buttons)
+        self.engine.errorOccurred.connect(lambda msg: self.song_title.setText(f"Can't play track: {msg}"))
 
     def create_volume_slider(self, label_text, player_type):
         layout = QVBoxLayout()
@@ -84,10 +95,10 @@ class MainPlayer(QFrame):
 
         if player_type == "vocal":
             slider.setValue(50)
-            slider.valueChanged.connect(lambda v: self.vocal_output.setVolume(v / 100))
+            slider.valueChanged.connect(lambda v: self.engine.set_gain("vocals", v / 100))
         else:
             slider.setValue(100)
-            slider.valueChanged.connect(lambda v: self.inst_output.setVolume(v / 100))
+            slider.valueChanged.connect(lambda v: self.engine.set_gain("no_vocals", v / 100))
 
         layout.addWidget(label)
         layout.addWidget(slider)
@@ -97,37 +108,46 @@ class MainPlayer(QFrame):
     def load_track(self, song_name):
         self.song_title.setText(f"Playing: {song_name}")
 
+        self.current_song = song_name
+        self.set_alignment(song_name, None)
+        api().fetch_alignment(song_name) # arrives in set_alignment
+
+        # play from the disk cache when we have the file, otherwise stream it from the backend
+        # (the track list has already queued it for the cache)
+        urls = track_urls(song_name)
+        self.video_player.setSource(self.media_source(urls["video"]))
+        self.engine.load(self.stem_source(urls["vocals"]), self.stem_source(urls["no_vocals"]))
+        self.engine.play()
+
+    @staticmethod
+    def media_source(url):
+        path = media_cache.cached_path(url)
+        return QUrl.fromLocalFile(path) if path else QUrl(url)
+
+    @staticmethod
+    def stem_source(url):
+        # the engine decodes with PyAV, which takes a path or URL string
+        return media_cache.cached_path(url) or url
+
+    def set_alignment(self, song_name, timeline):
+        if song_name != self.current_song:
+            return # answer for a track the user has already moved on from
+        self.timeline = timeline
+        self.current_word = None
+        self.lyrics_label.setText("")
         self.toggle_add_lyrics.setEnabled(True)
-        lyrics = get_lyrics(song_name).json()
-        print(lyrics)
-        if lyrics is not None:
+        if self.timeline is not None:
             self.toggle_add_lyrics.setText("Update Lyrics")
         else:
             self.toggle_add_lyrics.setText("Add Lyrics")
-        
-        # Construct URLs to the backend static mount
-        vocal_url = f"{BASE_URL}/audio/{song_name}/vocals.wav"
-        inst_url = f"{BASE_URL}/audio/{song_name}/no_vocals.wav"
-        video_url = f"{BASE_URL}/video/{song_name}"
-
-        self.vocal_player.setSource(QUrl(vocal_url))
-        self.inst_player.setSource(QUrl(inst_url))
-        self.video_player.setSource(QUrl(video_url))
-
-        self.vocal_player.play()
-        self.inst_player.play()
-        self.video_player.play()
+        self.update_lyrics(self.engine.position())
 
     def toggle_playback(self):
-        # Both players stay in sync by sharing the same command
-        if self.inst_player.playbackState() == QMediaPlayer.PlayingState:
-            self.vocal_player.pause()
-            self.inst_player.pause()
-            self.video_player.pause()
+        # the engine pauses/resumes the video along with the audio
+        if self.engine.playbackState() == QMediaPlayer.PlayingState:
+            self.engine.pause()
         else:
-            self.vocal_player.play()
-            self.inst_player.play()
-            self.video_player.play()
+            self.engine.play()
 
     def update_buttons(self, state):
         # Changes icon based on whether the music is moving or not
@@ -143,12 +163,30 @@ class MainPlayer(QFrame):
     def update_position(self, position):
         # Moves the slider as the song plays
         self.seek_slider.setValue(position)
+        self.update_lyrics(position)
+
+    def update_lyrics(self, position):
+        # binary search in the timeline, and only re-render when the word changes
+        if self.timeline is None:
+            return
+        index = self.timeline.word_at(position)
+        if index == self.current_word:
+            return
+        self.current_word = index
+        if index is None:
+            self.lyrics_label.setText("")
+            return
+
+        first, words = self.timeline.context(index)
+        rendered = [
+            f"<b style='color: #4CAF50;'>{html.escape(word)}</b>" if first + i == index else html.escape(word)
+            for i, word in enumerate(words)
+        ]
+        self.lyrics_label.setText(" ".join(rendered))
 
     def set_position(self, position):
-        # Allows user to click/drag slider to change time for BOTH tracks
-        self.vocal_player.setPosition(position)
-        self.inst_player.setPosition(position)
-        self.video_player.setPosition(position)
+        # Allows user to click/drag slider to change time; one seek for audio, video follows
+        self.engine.setPosition(position)
 
 
 
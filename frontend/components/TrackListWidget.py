@@ -1,6 +1,10 @@
-from PySide6.QtWidgets import (QListWidget)
-from PySide6.QtCore import Signal
-from api_client import get_all_tracks
+from PySide6.QtWidgets import (QListWidget, QListWidgetItem)
+from PySide6.QtCore import Qt, Signal
+from api_client import track_urls
+from async_api import api
+from media_cache import media_cache, prefetcher
+
+PREFETCH_NEIGHBOURS = 1 # tracks on each side of the selected one to download ahead
 
 class TrackListWidget(QListWidget):
     track_selected = Signal(str)
@@ -9,17 +13,57 @@ class TrackListWidget(QListWidget):
         super().__init__(parent)
 
         self.itemClicked.connect(self._on_item_clicked)
-        self.refresh()
+        api().tracks_ready.connect(self._show_tracks)
 
     def refresh(self):
-        """Fetch tracks from backend and update UI"""
-        self.clear()
-        tracks = get_all_tracks()
+        """Ask the backend for the track list; the list updates when it arrives"""
+        api().fetch_tracks()
 
+    def _show_tracks(self, tracks):
+        self.clear()
         if tracks:
-            self.addItems(tracks)
+            for track in tracks:
+                item = QListWidgetItem(track["name"])
+                item.setToolTip(self._describe(track))
+                item.setData(Qt.UserRole, track)
+                self.addItem(item)
         else:
             self.addItem("No tracks found or server offline")
 
+    @staticmethod
+    def _describe(track):
+        parts = []
+        if track.get("partial"):
+            minutes, seconds = divmod(int(track.get("ready_seconds") or 0), 60)
+            parts.append(f"still processing, first {minutes}:{seconds:02d} playable")
+        if track.get("duration"):
+            minutes, seconds = divmod(int(track["duration"]), 60)
+            parts.append(f"{minutes}:{seconds:02d}")
+        parts.append("synced lyrics" if track.get("has_alignment") else "no lyrics")
+        if track.get("language"):
+            parts.append(track["language"])
+        return " | ".join(parts)
+
     def _on_item_clicked(self, item):
-        self.track_selected.emit(item.text())
\ No newline at end of file
+        self.prefetch_around(self.row(item))
+        self.track_selected.emit(item.text())
+
+    def _cacheable(self, row):
+        track = self.item(row).data(Qt.UserRole)
+        # None: "No tracks found" placeholder. Partial tracks are still growing on the
+        # server, so the player streams them rather than keeping a snapshot on disk
+        return track is not None and not track.get("partial")
+
+    def prefetch_around(self, row):
+        # the selected track first (revalidates its cached files), then its neighbours in the list
+        if not self._cacheable(row):
+            return
+        # only revalidate what's cached: the player streams the rest of this track right now,
+        # and fetching it as well would download it twice. It's cached as a neighbour later
+        current = [url for url in track_urls(self.item(row).text()).values() if media_cache.cached_path(url)]
+        neighbours = []
+        for offset in range(1, PREFETCH_NEIGHBOURS + 1):
+            for r in (row + offset, row - offset):
+                if 0 <= r < self.count() and self._cacheable(r):
+                    neighbours.extend(track_urls(self.item(r).text()).values())
+        prefetcher.prefetch(urgent=current, later=neighbours)
\ No newline at end of file
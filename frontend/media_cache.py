@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import requests
+
+# Local disk cache of everything the player downloads (stems, video, alignment), so
+# switching back to a track plays from disk and the backend serves each file once.
+# Entries are kept until the cache goes over its size budget, least recently used
+# first. A cached copy is used straight away and re-checked against the server's ETag
+# in the background; if the server has a newer one it replaces the cached file.
+#
+# The Prefetcher fills the cache from a background thread: the track being played
+# first, then the ones next to it in the list.
+
+CACHE_DIR = os.environ.get("KARAOKE_CLIENT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "karaoke"))
+CACHE_BUDGET_BYTES = int(os.environ.get("KARAOKE_CLIENT_CACHE_MB", "4096")) * 2**20
+DOWNLOAD_CHUNK = 256 * 1024
+
+# QMediaPlayer sniffs the container, but a matching extension helps some backends
+EXTENSIONS = {
+    "audio/ogg": ".opus",
+    "audio/flac": ".flac",
+    "audio/wav": ".wav",
+    "video/mp4": ".mp4",
+}
+
+class MediaCache:
+    def __init__(self, root: str, budget_bytes: int):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._entries = OrderedDict()  # url -> {"file", "etag", "size"}, least recently used first
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for url, entry in entries:
+            if os.path.isfile(os.path.join(self.root, entry["file"])):
+                self._entries[url] = entry
+
+    def _save_index(self):
+        # caller holds self._lock
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(self._entries.items()), f)
+        os.replace(tmp, self._index_path)
+
+    def cached_path(self, url: str):
+        """Local copy of url if there is one (marks it recently used), else None. No network."""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            path = os.path.join(self.root, entry["file"])
+            if not os.path.isfile(path):
+                del self._entries[url]
+                return None
+            self._entries.move_to_end(url)
+            return path
+
+    def fetch(self, url: str, session=None, timeout=10):
+        """Download url into the cache, or revalidate the cached copy with If-None-Match.
+        Returns the local path, None if the server has no such file, and the stale copy
+        if the server can't be reached."""
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        # one download per url, even if the prefetcher and the player ask at once
+        with url_lock:
+            with self._lock:
+                entry = self._entries.get(url)
+            headers = {"If-None-Match": entry["etag"]} if entry and entry.get("etag") else {}
+            http = session or requests
+            try:
+                with http.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                    if response.status_code == 304:
+                        return self.cached_path(url)
+                    if response.status_code == 404:
+                        self.discard(url)
+                        return None
+                    response.raise_for_status()
+                    return self._store(url, response)
+            except requests.exceptions.RequestException as e:
+                print(f"Cache fetch failed for {url}: {e}")
+                return self.cached_path(url)
+
+    def _store(self, url, response):
+        media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest() + EXTENSIONS.get(media_type, ".bin")
+        path = os.path.join(self.root, name)
+        tmp = f"{path}.{threading.get_ident()}.part"
+        size = 0
+        with open(tmp, "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, path)
+
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None and old["file"] != name:
+                _unlink(os.path.join(self.root, old["file"]))
+            self._entries[url] = {"file": name, "etag": response.headers.get("ETag"),
+                                  "size": size, "stored_at": time.time()}
+            self._evict(keep=url)
+            self._save_index()
+        return path
+
+    def discard(self, url: str):
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is not None:
+                _unlink(os.path.join(self.root, entry["file"]))
+                self._save_index()
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry["size"] for entry in self._entries.values())
+
+    def _evict(self, keep):
+        # caller holds self._lock
+        total = sum(entry["size"] for entry in self._entries.values())
+        for url in list(self._entries):
+            if total <= self.budget_bytes:
+                break
+            if url == keep:
+                continue
+            entry = self._entries.pop(url)
+            _unlink(os.path.join(self.root, entry["file"]))
+            total -= entry["size"]
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass  # e.g. still open in the player on Windows; it's just an orphan file then
+
+class Prefetcher:
+    """Background thread that pulls urls into a MediaCache, the current track's first."""
+
+    def __init__(self, cache: MediaCache):
+        self.cache = cache
+        self._queue = []
+        self._cond = threading.Condition()
+        self._session = requests.Session()  # keep-alive across the many small requests
+        self._thread = threading.Thread(target=self._run, name="media-prefetch", daemon=True)
+        self._thread.start()
+
+    def prefetch(self, urgent=(), later=()):
+        with self._cond:
+            # whatever is still queued belongs to the previous selection and isn't wanted any more
+            self._queue = list(dict.fromkeys([*urgent, *later]))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                url = self._queue.pop(0)
+            try:
+                self.cache.fetch(url, session=self._session)
+            except Exception as e:
+                # e.g. disk full, or the cached file is open in the player (Windows). Skip it,
+                # the thread has to stay up for the rest of the session
+                print(f"Prefetch failed for {url}: {e!r}")
+
+media_cache = MediaCache(CACHE_DIR, CACHE_BUDGET_BYTES)
+prefetcher = Prefetcher(media_cache)
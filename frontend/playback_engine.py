@@ -0,0 +1,358 @@
+import threading
+from collections import deque
+import av
+import numpy as np
+from PySide6.QtCore import QObject, QIODevice, QTimer, Signal
+from PySide6.QtMultimedia import QAudioFormat, QAudioSink, QMediaDevices, QMediaPlayer
+
+# One audio engine for both stems. A decode thread reads vocals and no_vocals in
+# lockstep (PyAV, resampled to float32 stereo) into a small bounded buffer, and the
+# audio device pulls from it, mixing the two with the current per-stem gain. Frames
+# handed to the device are the master clock: the playback position is what has been
+# delivered minus what the device still has queued. The video player is slaved to
+# that clock. Small drift is corrected by nudging its playback rate, large drift
+# (or a seek) by moving it.
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+BYTES_PER_FRAME = 4 * CHANNELS  # float32
+BLOCK_FRAMES = 2048
+# decoded audio waiting for the device; also the most a gain change can lag behind
+BUFFER_FRAMES = SAMPLE_RATE // 2
+TICK_MS = 50
+
+# video sync: ignore drift below the tolerance, correct up to DRIFT_SEEK_MS by playing the
+# video a little faster or slower, and jump it to the clock beyond that
+DRIFT_TOLERANCE_MS = 40
+DRIFT_SEEK_MS = 300
+DRIFT_RATE_STEP = 0.05
+
+STEMS = ("vocals", "no_vocals")
+
+class StemDecoder:
+    """One stem (local file or URL) decoded to float32 stereo frames at SAMPLE_RATE."""
+
+    def __init__(self, source):
+        self.container = av.open(source)
+        self.stream = self.container.streams.audio[0]
+        self.duration = self.container.duration / av.time_base if self.container.duration else 0.0
+        self._restart(0.0)
+
+    def _restart(self, seconds):
+        self._frames = self.container.decode(self.stream)
+        self._resampler = av.AudioResampler(format="flt", layout="stereo", rate=SAMPLE_RATE)
+        self._pending = deque()
+        self._pending_frames = 0
+        self._position = None   # seconds at the start of the next decoded sample
+        self._trim_to = seconds  # seeks land on the packet before; drop samples up to here
+        self.eof = False
+
+    def seek(self, seconds):
+        self.container.seek(int(seconds * av.time_base), backward=True)
+        self._restart(seconds)
+
+    @property
+    def finished(self):
+        return self.eof and self._pending_frames == 0
+
+    def _decode_more(self):
+        try:
+            frame = next(self._frames)
+        except (StopIteration, av.error.EOFError):
+            self.eof = True
+            resampled = self._resampler.resample(None)  # flush
+        else:
+            if self._position is None:
+                self._position = frame.time if frame.time is not None else self._trim_to
+            resampled = self._resampler.resample(frame)
+
+        for out in resampled:
+            pcm = out.to_ndarray().reshape(-1, CHANNELS)
+            if self._position is None:
+                self._position = self._trim_to
+            start = self._position
+            self._position += len(pcm) / SAMPLE_RATE
+            if self._trim_to is not None:
+                if self._position <= self._trim_to:
+                    continue
+                pcm = pcm[max(0, int((self._trim_to - start) * SAMPLE_RATE)):]
+                self._trim_to = None
+            self._pending.append(pcm)
+            self._pending_frames += len(pcm)
+
+    def read(self, count):
+        """Next `count` frames, padded with silence at the end of the stream."""
+        while self._pending_frames < count and not self.eof:
+            self._decode_more()
+        parts, got = [], 0
+        while got < count and self._pending:
+            pcm = self._pending.popleft()
+            if got + len(pcm) > count:
+                self._pending.appendleft(pcm[count - got:])
+                pcm = pcm[:count - got]
+            parts.append(pcm)
+            got += len(pcm)
+        self._pending_frames -= got
+        if got < count:
+            parts.append(np.zeros((count - got, CHANNELS), dtype=np.float32))
+        return np.concatenate(parts)
+
+    def close(self):
+        self.container.close()
+
+class _MixDevice(QIODevice):
+    """What the audio sink pulls from."""
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self.engine = engine
+
+    def readData(self, maxlen):
+        return self.engine._pull(maxlen // BYTES_PER_FRAME)
+
+    def writeData(self, data):
+        return -1
+
+    def bytesAvailable(self):
+        return self.engine._buffered * BYTES_PER_FRAME + super().bytesAvailable()
+
+    def isSequential(self):
+        return True
+
+class PlaybackEngine(QObject):
+    """Mixed stem playback on one clock, with the same signals the player used from QMediaPlayer."""
+
+    positionChanged = Signal(int)   # ms
+    durationChanged = Signal(int)   # ms
+    playbackStateChanged = Signal(QMediaPlayer.PlaybackState)
+    driftChanged = Signal(int)      # video position minus audio clock, ms
+    errorOccurred = Signal(str)
+
+    def __init__(self, video_player: QMediaPlayer = None, parent=None):
+        super().__init__(parent)
+        self.video_player = video_player
+        self.gains = {"vocals": 0.5, "no_vocals": 1.0}
+        self.drift_ms = 0
+        self.max_drift_ms = 0
+
+        fmt = QAudioFormat()
+        fmt.setSampleRate(SAMPLE_RATE)
+        fmt.setChannelCount(CHANNELS)
+        fmt.setSampleFormat(QAudioFormat.Float)
+        self._sink = QAudioSink(QMediaDevices.defaultAudioOutput(), fmt, self)
+        self._device = _MixDevice(self)
+        self._device.open(QIODevice.ReadOnly)
+
+        # shared with the decode thread, all under _cond
+        self._cond = threading.Condition()
+        self._buffer = deque()      # {stem: float32 (frames, 2)} blocks, all the same length
+        self._buffered = 0          # frames in _buffer
+        self._delivered = 0         # frames handed to the device since _base_ms
+        self._base_ms = 0           # clock position the current run started from
+        self._generation = 0        # bumped on load, stops the previous decode thread
+        self._seek_to = None
+        self._eof = False
+
+        self._state = QMediaPlayer.StoppedState
+        self._loaded = False
+        self._timer = QTimer(self)
+        self._timer.setInterval(TICK_MS)
+        self._timer.timeout.connect(self._tick)
+
+    # --- decode thread ---
+
+    def _emit_current(self, signal, value, generation):
+        # a decode thread outlived by a newer load() stays quiet. Emitting under the lock keeps
+        # load() from slipping in between; the UI thread gets the signals queued in order
+        with self._cond:
+            if generation == self._generation:
+                signal.emit(value)
+
+    def _decode(self, sources, generation):
+        decoders = {}
+        try:
+            for stem in STEMS:
+                decoders[stem] = StemDecoder(sources[stem])
+        except (av.error.FFmpegError, OSError) as e:
+            for decoder in decoders.values():
+                decoder.close()
+            self._emit_current(self.errorOccurred, str(e), generation)
+            return
+        self._emit_current(self.durationChanged, int(max(d.duration for d in decoders.values()) * 1000), generation)
+
+        try:
+            while True:
+                with self._cond:
+                    while (generation == self._generation and self._seek_to is None
+                           and (self._eof or self._buffered >= BUFFER_FRAMES)):
+                        self._cond.wait()
+                    if generation != self._generation:
+                        return
+                    seek_to, self._seek_to = self._seek_to, None
+
+                if seek_to is not None:
+                    for decoder in decoders.values():
+                        decoder.seek(seek_to)
+                block = {stem: decoder.read(BLOCK_FRAMES) for stem, decoder in decoders.items()}
+                finished = all(decoder.finished for decoder in decoders.values())
+
+                with self._cond:
+                    if generation != self._generation or self._seek_to is not None:
+                        continue  # decoded for a position that's no longer wanted
+                    self._buffer.append(block)
+                    self._buffered += BLOCK_FRAMES
+                    self._eof = finished
+        except av.error.FFmpegError as e:
+            self._emit_current(self.errorOccurred, str(e), generation)
+        finally:
+            for decoder in decoders.values():
+                decoder.close()
+
+    # --- audio device side ---
+
+    def _pull(self, frames):
+        parts, got = [], 0
+        gains = self.gains
+        with self._cond:
+            while got < frames and self._buffer:
+                block = self._buffer[0]
+                take = min(frames - got, len(block["vocals"]))
+                if take == len(block["vocals"]):
+                    self._buffer.popleft()
+                else:
+                    self._buffer[0] = {stem: pcm[take:] for stem, pcm in block.items()}
+                # mixed here rather than when decoded, so volume changes apply right away
+                parts.append(sum(gains[stem] * pcm[:take] for stem, pcm in block.items()))
+                got += take
+            self._buffered -= got
+            self._delivered += got
+            self._cond.notify_all()
+        if not parts:
+            return b""
+        return np.clip(np.concatenate(parts), -1.0, 1.0).astype(np.float32).tobytes()
+
+    # --- controls, called from the UI thread ---
+
+    def load(self, vocals_source, no_vocals_source):
+        """Open a track's stems (local paths or URLs) and start decoding from the beginning."""
+        self._sink.stop()
+        with self._cond:
+            self._generation += 1
+            self._reset(0)
+            generation = self._generation
+            self._cond.notify_all()
+        self._loaded = True
+        self.max_drift_ms = 0
+        threading.Thread(target=self._decode, args=({"vocals": vocals_source, "no_vocals": no_vocals_source},
+                                                    generation), name="stem-decode", daemon=True).start()
+        self._set_state(QMediaPlayer.StoppedState)
+        self.positionChanged.emit(0)
+
+    def _reset(self, position_ms):
+        # caller holds _cond
+        self._buffer.clear()
+        self._buffered = 0
+        self._delivered = 0
+        self._base_ms = position_ms
+        self._eof = False
+
+    def play(self):
+        if not self._loaded or self._state == QMediaPlayer.PlayingState:
+            return
+        with self._cond:
+            ended = self._eof and not self._buffered
+        if ended:
+            self.setPosition(0)  # play again from the top
+        if self._sink.state() == QAudioSink.SuspendedState:
+            self._sink.resume()
+        else:
+            self._sink.start(self._device)
+        if self.video_player is not None:
+            self.video_player.play()
+        self._set_state(QMediaPlayer.PlayingState)
+
+    def pause(self):
+        if self._state != QMediaPlayer.PlayingState:
+            return
+        self._sink.suspend()
+        if self.video_player is not None:
+            self.video_player.pause()
+        self._set_state(QMediaPlayer.PausedState)
+
+    def setPosition(self, position_ms):
+        # the device's queued audio belongs to the old position, drop it and start over there
+        self._sink.stop()
+        with self._cond:
+            self._reset(position_ms)
+            self._seek_to = position_ms / 1000
+            self._cond.notify_all()
+        if self.video_player is not None:
+            self.video_player.setPosition(position_ms)
+        if self._state == QMediaPlayer.PlayingState:
+            self._sink.start(self._device)
+        elif self._state == QMediaPlayer.PausedState:
+            self._set_state(QMediaPlayer.StoppedState)  # next play() starts the device again
+        self.positionChanged.emit(position_ms)
+
+    def set_gain(self, stem, gain):
+        self.gains = {**self.gains, stem: gain}
+
+    def playbackState(self):
+        return self._state
+
+    def position(self):
+        """Milliseconds of audio actually played: delivered to the device minus still queued in it."""
+        queued = 0
+        if self._sink.state() in (QAudioSink.ActiveState, QAudioSink.SuspendedState, QAudioSink.IdleState):
+            queued = (self._sink.bufferSize() - self._sink.bytesFree()) // BYTES_PER_FRAME
+        with self._cond:
+            delivered = self._delivered
+            base = self._base_ms
+        return max(0, base + (delivered - queued) * 1000 // SAMPLE_RATE)
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        self._state = state
+        if state == QMediaPlayer.PlayingState:
+            self._timer.start()
+        else:
+            self._timer.stop()
+        self.playbackStateChanged.emit(state)
+
+    def _tick(self):
+        with self._cond:
+            buffered, eof = self._buffered, self._eof
+        idle = self._sink.state() == QAudioSink.IdleState
+        if idle and buffered:
+            self._device.readyRead.emit()  # device ran dry and went idle, there's data again
+        elif idle and eof:
+            # end of the track
+            self._sink.stop()
+            if self.video_player is not None:
+                self.video_player.pause()
+            self._set_state(QMediaPlayer.StoppedState)
+            return
+
+        position = self.position()
+        self.positionChanged.emit(position)
+        self._sync_video(position)
+
+    def _sync_video(self, clock_ms):
+        video = self.video_player
+        if video is None or video.playbackState() != QMediaPlayer.PlayingState:
+            return
+        drift = video.position() - clock_ms
+        self.drift_ms = drift
+        self.max_drift_ms = max(self.max_drift_ms, abs(drift))
+        self.driftChanged.emit(drift)
+
+        if abs(drift) > DRIFT_SEEK_MS:
+            video.setPosition(clock_ms)
+            rate = 1.0
+        elif abs(drift) > DRIFT_TOLERANCE_MS:
+            rate = 1.0 - DRIFT_RATE_STEP if drift > 0 else 1.0 + DRIFT_RATE_STEP
+        else:
+            rate = 1.0
+        if video.playbackRate() != rate:
+            video.setPlaybackRate(rate)